@@ -0,0 +1,95 @@
+"""
+Benchmark of the user ip reservation at different pool utilization levels.
+Compares the ip pool with the legacy "random ip + lookup + retry" approach on the same range.
+
+Run from the project root:
+    python -m benchmarks.ip_pool [-n 200] [--network 10.0.0.0/20]
+"""
+import argparse
+from ipaddress import ip_network
+from random import randint
+from timeit import default_timer
+from module import App
+from module.server.models.user import User
+from module.server.models.ip_pool import IpRange, reserve_ip
+
+UTILIZATION_LEVELS = (0.10, 0.50, 0.95)
+
+
+def legacy_random_ip(db, network):
+    """Emulates the old 'User.set_ip': random ip, lookup, retry on collision. Returns number of lookups"""
+    first, size = int(network.network_address), network.num_addresses - 2
+    lookups = 1
+    while True:
+        ip = str(network.network_address.__class__(first + randint(1, size)))
+        if not db.session.query(User.id).filter_by(ip=ip).first():
+            return ip, lookups
+        lookups += 1
+
+
+def fill(db, network, level):
+    """Creates users until the range is filled up to 'level' and syncs the pool pointer"""
+    size = network.num_addresses - 2
+    used = int(size * level)
+    hosts = network.hosts()
+    db.session.execute(
+        User.__table__.insert(),
+        [dict(username="fill{0}".format(i), ip=str(next(hosts)), password_hash="x") for i in range(used)],
+    )
+    db.session.query(IpRange).update({IpRange.next_offset: used})
+    db.session.commit()
+
+
+def run(num, network):
+    """Measures average cost of 'num' ip reservations per utilization level"""
+    results = []
+    for level in UTILIZATION_LEVELS:
+        runner = App(testing=True)
+        app, db = runner.get_flask_app(), runner.db
+        app.config["IP_POOL_RANGES"] = [str(network)]
+
+        with app.app_context():
+            db.create_all()
+            IpRange.sync(app.config["IP_POOL_RANGES"])
+            fill(db, network, level)
+
+            start = default_timer()
+            for i in range(num):
+                db.session.execute(
+                    User.__table__.insert(), dict(username="pool{0}".format(i), ip=reserve_ip(), password_hash="x")
+                )
+                db.session.commit()
+            pool_cost = (default_timer() - start) / num
+
+            db.session.execute(User.__table__.delete().where(User.username.like("pool%")))
+            db.session.commit()
+
+            lookups = 0
+            start = default_timer()
+            for i in range(num):
+                ip, tries = legacy_random_ip(db, network)
+                lookups += tries
+                db.session.execute(
+                    User.__table__.insert(), dict(username="legacy{0}".format(i), ip=ip, password_hash="x")
+                )
+                db.session.commit()
+            legacy_cost = (default_timer() - start) / num
+
+            results.append((level, pool_cost, legacy_cost, lookups / num))
+            db.session.remove()
+            db.drop_all()
+
+    print("Network: {0}, reservations per level: {1}".format(network, num))
+    print("{0:>12} {1:>14} {2:>16} {3:>16}".format("utilization", "pool, ms", "legacy, ms", "legacy lookups"))
+    for level, pool_cost, legacy_cost, lookups in results:
+        print(
+            "{0:>11.0%} {1:>14.3f} {2:>16.3f} {3:>16.2f}".format(level, pool_cost * 1000, legacy_cost * 1000, lookups)
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--num", type=int, default=200, help="Number of reservations per utilization level.")
+    parser.add_argument("--network", default="10.0.0.0/20", help="CIDR range of the benchmarked pool.")
+    args = parser.parse_args()
+    run(args.num, ip_network(args.network))
@@ -0,0 +1,482 @@
+"""
+Load test of the REST API on a deterministic synthetic dataset.
+Seeds the database with users, payment cards and payment history, starts the gunicorn 'StandaloneApplication'
+of module/run.py on a copy of the database and replays a mix of logins, polls of the user info and history
+(conditional GETs with the ETags of the previous responses) and card redemptions from concurrent clients.
+Throughput, errors and latency percentiles per endpoint are saved as JSON and compared with a previous run.
+The clients run in this process (asyncio), so on small machines they take a share of the CPU from the server.
+
+Run from the project root:
+    python -m benchmarks.load [-c 500] [-d 60] [--users 10000] [--output run.json] [--baseline previous.json]
+    python -m benchmarks.load --url http://127.0.0.1:8080  # against a running server seeded with the same dataset
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import asyncio
+import argparse
+import subprocess
+from uuid import UUID, uuid5
+from random import Random
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from werkzeug.security import generate_password_hash
+from module import App
+from module.server.config import Config, TestConfig
+from module.server.models.user import User
+from module.server.models.payment_cards import Card, UsedCard
+from module.server.models.stats import Stats
+
+PASSWORD = "load-test"  # password of every synthetic user
+NAMESPACE = UUID("6f1c5c1e-2f55-4c43-9a0c-0d6a3e1f4b27")  # uuids of the users are derived from their numbers
+AMOUNTS = (50, 100, 200, 500)
+MIX = dict(auth=5, user_info=50, history=35, redeem=10)  # share of every action in percents
+PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1))
+
+
+def user_uuid(number) -> str:
+    """Returns uuid of the synthetic user"""
+    return str(uuid5(NAMESPACE, "user{0}".format(number)))
+
+
+def card_code(number) -> str:
+    """Returns code of the unused synthetic card"""
+    return "L{0:011d}".format(number)
+
+
+def seed(path, users, cards, history, hash_method, chunk_size=10000):
+    """
+    Creates database with 'users' activated users, 'cards' unused cards and 'history' used cards of every user.
+    The same arguments always make the same data
+    """
+
+    class SeedConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+
+    if os.path.exists(path):
+        os.remove(path)
+    runner = App(config_obj=SeedConfig)
+    app, db = runner.get_flask_app(), runner.db
+    rnd = Random(0)
+    password_hash = generate_password_hash(PASSWORD, hash_method)  # the same hash makes seeding fast
+
+    with app.app_context():
+        db.create_all()
+        start_date = datetime(2021, 1, 1)
+        for start in range(0, users, chunk_size):
+            user_rows, history_rows = [], []
+            for i in range(start, min(start + chunk_size, users)):
+                balance = 0
+                for k in range(history):
+                    amount = rnd.choice(AMOUNTS)
+                    balance += amount
+                    history_rows.append(
+                        dict(
+                            uuid=str(uuid5(NAMESPACE, "used{0}-{1}".format(i, k))),
+                            amount=amount,
+                            code="H{0:08d}{1:03d}".format(i, k),
+                            balance_after_use=balance,
+                            used_at=start_date + timedelta(hours=i % 24, days=k),
+                            user_id=i + 1,  # the table is empty, ids are assigned in the order of the rows
+                        )
+                    )
+                user_rows.append(
+                    dict(
+                        uuid=user_uuid(i),
+                        username="user{0}".format(i),
+                        name="User {0}".format(i),
+                        email="user{0}@example.com".format(i),
+                        phone="+380{0:09d}".format(i),
+                        address="Khreshchatyk st. {0}".format(i % 200),
+                        tariff=rnd.choice(("50m", "100m", "200m", "500m")),
+                        state="activated",
+                        balance=balance,
+                        password_hash=password_hash,
+                    )
+                )
+            db.session.execute(User.__table__.insert(), user_rows)
+            if history_rows:
+                db.session.execute(UsedCard.__table__.insert(), history_rows)
+            db.session.commit()
+
+        for start in range(0, cards, chunk_size):
+            db.session.execute(
+                Card.__table__.insert(),
+                [
+                    dict(uuid=str(uuid5(NAMESPACE, "card{0}".format(i))), code=card_code(i), amount=rnd.choice(AMOUNTS))
+                    for i in range(start, min(start + chunk_size, cards))
+                ],
+            )
+            db.session.commit()
+        Stats.rebuild()
+        db.session.remove()
+    db.get_engine(app).dispose()
+
+
+class Connection:
+    """
+    HTTP/1.1 client connection. It's opened again when the server closes it (sync gunicorn workers close
+    every connection), a request on a kept-alive connection which was closed by the server is retried once.
+    Bodies are read by the Content-Length, the chunked transfer encoding (streamed responses) or until the end
+    of the connection.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers=None, body=None) -> tuple:
+        """
+        Sends request and returns status, headers (lower case names) and body of the response
+        :raises ConnectionError: the server closed the connection or refused it
+        """
+        reused = self.writer is not None
+        try:
+            return await self._request(method, path, headers or {}, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+        return await self._request(method, path, headers or {}, body)
+
+    async def _request(self, method, path, headers, body) -> tuple:
+        """Sends request on the current or a new connection"""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = b"" if body is None else json.dumps(body).encode()
+        lines = ["{0} {1} HTTP/1.1".format(method, path), "Host: {0}:{1}".format(self.host, self.port)]
+        lines.extend("{0}: {1}".format(name, value) for name, value in headers.items())
+        if body is not None:
+            lines.extend(("Content-Type: application/json", "Content-Length: {0}".format(len(payload))))
+        self.writer.write("\r\n".join(lines).encode() + b"\r\n\r\n" + payload)
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection is closed by the server.")
+        status = int(status_line.split()[1])
+        response_headers = dict()
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if status in (204, 304) or method == "HEAD":
+            data = b""
+        elif response_headers.get("transfer-encoding", "").lower() == "chunked":
+            data = await self._read_chunked()
+        elif "content-length" in response_headers:
+            data = await self.reader.readexactly(int(response_headers["content-length"]))
+        else:  # the body ends with the connection
+            data = await self.reader.read()
+            response_headers["connection"] = "close"
+        if response_headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, response_headers, data
+
+    async def _read_chunked(self) -> bytes:
+        """Returns body sent with the chunked transfer encoding (e.g. the ndjson streams), trailers are skipped"""
+        chunks = []
+        while True:
+            size_line = await self.reader.readline()
+            if not size_line:
+                raise ConnectionError("Connection is closed by the server.")
+            size = int(size_line.split(b";", 1)[0], 16)
+            if not size:
+                break
+            chunks.append(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)  # CRLF after the chunk
+        while (await self.reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        return b"".join(chunks)
+
+    def close(self) -> None:
+        """Closes the connection"""
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class LoadTest:
+    """
+    Concurrent clients which replay the mix of actions until the end of the test.
+    Every client logs in as its own user first, polls the info and history of the user and redeems cards.
+    Requests completed during the warm-up or after the end aren't recorded.
+
+    :param host: host of the server
+    :type host: str
+    :param port: port of the server
+    :type port: int
+    :param users: number of the seeded users
+    :type users: int
+    :param cards: number of the seeded unused cards
+    :type cards: int
+    :param wrong_codes: share of the redemptions with wrong codes
+    :type wrong_codes: float
+    """
+
+    def __init__(self, host, port, users, cards, wrong_codes=0.1, timeout=30):
+        self.host = host
+        self.port = port
+        self.users = users
+        self.wrong_codes = wrong_codes
+        self.timeout = timeout
+        self.codes = iter(range(cards))  # every valid card is redeemed only once
+        self.timings = {name: [] for name in MIX}
+        self.statuses = {name: dict() for name in MIX}
+        self.record_from = self.stop_at = None
+
+    async def run(self, clients, duration, warmup) -> float:
+        """Runs the clients and returns duration of the recorded period"""
+        start = time.perf_counter()
+        self.record_from, self.stop_at = start + warmup, start + warmup + duration
+        await asyncio.gather(*(self.client(number) for number in range(clients)))
+        return min(time.perf_counter(), self.stop_at) - self.record_from
+
+    def record(self, name, status, started) -> None:
+        """Saves result of the request completed within the recorded period"""
+        now = time.perf_counter()
+        if self.record_from <= now <= self.stop_at:
+            self.timings[name].append(now - started)
+            self.statuses[name][status] = self.statuses[name].get(status, 0) + 1
+
+    async def call(self, connection, name, method, path, headers=None, body=None) -> tuple:
+        """Sends request and records it, errors of the connection are recorded with the 'error' status"""
+        started = time.perf_counter()
+        try:
+            status, headers, data = await asyncio.wait_for(
+                connection.request(method, path, headers, body), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            connection.close()
+            self.record(name, "timeout" if isinstance(e, asyncio.TimeoutError) else "error", started)
+            return None, {}, b""
+        self.record(name, str(status), started)
+        return status, headers, data
+
+    async def client(self, number) -> None:
+        """Replays the mix of actions as one user"""
+        rnd = Random(number)
+        user = rnd.randrange(self.users)
+        uuid = user_uuid(user)
+        connection = Connection(self.host, self.port)
+        token, etags = None, dict()
+        actions, weights = list(MIX), list(MIX.values())
+
+        while time.perf_counter() < self.stop_at:
+            action = "auth" if token is None else rnd.choices(actions, weights)[0]
+            headers = {} if token is None else {"Authorization": "Bearer " + token}
+            if action == "auth":
+                login = dict(login="user{0}".format(user), password=PASSWORD)
+                status, _, data = await self.call(connection, action, "GET", "/api/v1/auth", body=login)
+                token = json.loads(data)["access_token"] if status == 200 else None
+                if token is None:
+                    await asyncio.sleep(0.1)  # the server is busy
+            elif action in ("user_info", "history"):
+                path = "/api/v1/users/" + uuid + ("/history" if action == "history" else "")
+                if action in etags:
+                    headers["If-None-Match"] = etags[action]
+                status, response_headers, _ = await self.call(connection, action, "GET", path, headers)
+                if status == 200 and "etag" in response_headers:
+                    etags[action] = response_headers["etag"]
+            else:
+                code = next(self.codes, None)
+                if code is None or rnd.random() < self.wrong_codes:
+                    code = "W{0:011d}".format(rnd.randrange(10**11))
+                else:
+                    code = card_code(code)
+                body = dict(code=code)
+                await self.call(connection, action, "POST", "/api/v1/users/" + uuid, headers, body)
+        connection.close()
+
+    def report(self, elapsed) -> dict:
+        """Returns throughput, statuses and latency percentiles (in milliseconds) of every endpoint"""
+        endpoints = dict()
+        for name, timings in self.timings.items():
+            timings.sort()
+            statuses = self.statuses[name]
+            errors = sum(count for status, count in statuses.items() if not status.isdigit() or status[0] == "5")
+            endpoints[name] = dict(
+                requests=len(timings),
+                throughput=round(len(timings) / elapsed, 2),
+                errors=errors,
+                statuses=dict(sorted(statuses.items())),
+            )
+            for percentile, share in PERCENTILES:
+                value = timings[min(int(len(timings) * share), len(timings) - 1)] * 1000 if timings else None
+                endpoints[name][percentile] = None if value is None else round(value, 2)
+
+        total = sum(endpoint["requests"] for endpoint in endpoints.values())
+        return dict(
+            duration=round(elapsed, 2),
+            requests=total,
+            throughput=round(total / elapsed, 2),
+            errors=sum(endpoint["errors"] for endpoint in endpoints.values()),
+            endpoints=endpoints,
+        )
+
+
+def wait_for_server(host, port, process=None, timeout=60) -> None:
+    """
+    Waits until the server accepts connections
+    :raises RuntimeError: the server has exited or hasn't started in time
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("Server has exited with code {0}.".format(process.returncode))
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("Server hasn't started in {0} seconds.".format(timeout))
+
+
+def serve(bind, workers, threads):
+    """Runs the app with gunicorn, the database and other settings are taken from the environment"""
+    from module.run import StandaloneApplication, app
+
+    StandaloneApplication(app, {"bind": bind, "workers": workers, "threads": threads}).run()
+
+
+def start_server(path, host, port, workers, threads, hash_method) -> "subprocess.Popen":
+    """Starts gunicorn in a new process on the database file"""
+    env = dict(
+        os.environ,
+        DATABASE_URL="sqlite:///" + path,
+        PASSWORD_HASH_METHOD=hash_method,
+        METRICS_DIR=path + ".metrics",
+    )
+    shutil.rmtree(env["METRICS_DIR"], ignore_errors=True)
+    command = [sys.executable, "-m", "benchmarks.load", "--serve", "{0}:{1}".format(host, port)]
+    command += ["--workers", str(workers), "--threads", str(threads)]
+    return subprocess.Popen(command, env=env, cwd=os.getcwd())
+
+
+def compare(result, baseline) -> list:
+    """Returns lines with changes of the throughput and the latency since the baseline run"""
+
+    def change(old, new):
+        if old is None or new is None:
+            return "{0} -> {1}".format(old, new)
+        return "{0} -> {1} ({2:+.1f}%)".format(old, new, (new - old) / old * 100 if old else 0)
+
+    lines = [
+        "Changes since the baseline:",
+        "total: throughput {0} rps".format(change(baseline["throughput"], result["throughput"])),
+    ]
+    for name, endpoint in result["endpoints"].items():
+        old = baseline["endpoints"].get(name)
+        if old is None:
+            continue
+        parts = ["throughput {0} rps".format(change(old["throughput"], endpoint["throughput"]))]
+        parts.extend(
+            "{0} {1} ms".format(percentile, change(old[percentile], endpoint[percentile]))
+            for percentile, _ in PERCENTILES
+            if percentile != "max"
+        )
+        parts.append("errors {0}".format(change(old["errors"], endpoint["errors"])))
+        lines.append("{0}: {1}".format(name, ", ".join(parts)))
+    return lines
+
+
+def run(args):
+    """Seeds the database (once per dataset), starts the server and runs the clients"""
+    dataset = dict(users=args.users, cards=args.cards, history=args.history, hash_method=args.hash_method)
+    meta_path = args.db + ".json"
+    if args.url is None:
+        seeded = None
+        if os.path.exists(args.db) and os.path.exists(meta_path):
+            with open(meta_path) as file:
+                seeded = json.load(file)
+        if seeded != dataset:
+            start = time.perf_counter()
+            seed(args.db, **dataset)
+            with open(meta_path, "w") as file:
+                json.dump(dataset, file)
+            print("Seeded {0} users, {1} cards in {2:.1f}s".format(args.users, args.cards, time.perf_counter() - start))
+        work_db = args.db + ".run"
+        shutil.copyfile(args.db, work_db)  # every run starts with the same data
+        host, port = "127.0.0.1", args.port
+        server = start_server(work_db, host, port, args.workers, args.threads, args.hash_method)
+    else:
+        url = urlsplit(args.url)
+        host, port, server = url.hostname, url.port or 80, None
+
+    try:
+        wait_for_server(host, port, server)
+        load_test = LoadTest(host, port, args.users, args.cards, args.wrong_codes, args.timeout)
+        elapsed = asyncio.run(load_test.run(args.clients, args.duration, args.warmup))
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait()
+
+    result = dict(
+        created_at=datetime.utcnow().isoformat(timespec="seconds"),
+        clients=args.clients,
+        workers=args.workers if server else None,
+        threads=args.threads if server else None,
+        mix=MIX,
+        dataset=dataset,
+        **load_test.report(elapsed),
+    )
+    with open(args.output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    print(
+        "Clients: {0}, {1:.0f}s, {2} requests, {3} rps, {4} errors".format(
+            args.clients, result["duration"], result["requests"], result["throughput"], result["errors"]
+        )
+    )
+    for name, endpoint in result["endpoints"].items():
+        print(
+            "{0:>9}: {1:>8} rps, p50 {2} ms, p95 {3} ms, p99 {4} ms, statuses {5}".format(
+                name, endpoint["throughput"], endpoint["p50"], endpoint["p95"], endpoint["p99"], endpoint["statuses"]
+            )
+        )
+    if args.baseline:
+        with open(args.baseline) as file:
+            print("\n".join(compare(result, json.load(file))))
+    print("Results are saved to {0}".format(args.output))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-c", "--clients", type=int, default=500, help="Number of concurrent clients.")
+    parser.add_argument("-d", "--duration", type=float, default=60, help="Recorded time of the test in seconds.")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds before the recording.")
+    parser.add_argument("--users", type=int, default=10000, help="Number of seeded users.")
+    parser.add_argument("--cards", type=int, default=100000, help="Number of seeded unused cards.")
+    parser.add_argument("--history", type=int, default=20, help="Number of used cards of every seeded user.")
+    parser.add_argument("--wrong-codes", type=float, default=0.1, help="Share of redemptions with wrong codes.")
+    parser.add_argument(
+        "--hash-method", default=Config.PASSWORD_HASH_METHOD, help="Password hash method of the seeded users."
+    )
+    parser.add_argument("--db", default="/tmp/load_benchmark.db", help="Seeded database, it's filled once.")
+    parser.add_argument("--port", type=int, default=8090, help="Port of the started server.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of gunicorn workers (as in run.py).")
+    parser.add_argument("--threads", type=int, default=1, help="Number of threads of every worker.")
+    parser.add_argument("--url", default=None, help="Test the running server instead of starting one.")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout of every request in seconds.")
+    parser.add_argument("--output", default="/tmp/load_benchmark.json", help="File of the results.")
+    parser.add_argument("--baseline", default=None, help="Results of a previous run to compare with.")
+    parser.add_argument("--serve", metavar="BIND", default=None, help=argparse.SUPPRESS)  # the server process
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.workers, args.threads)
+    else:
+        if args.workers is None:
+            cwd = os.getcwd()
+            from module.run import number_of_workers
+
+            os.chdir(cwd)  # module.run changes it on import, the paths of the arguments are relative to it
+            args.workers = number_of_workers()
+        run(args)
@@ -0,0 +1,96 @@
+"""
+Benchmark of the user search on a synthetic user base.
+Measures latency percentiles of the indexed search for name fragments, phone suffixes, addresses and common words.
+
+Run from the project root:
+    python -m benchmarks.search [-n 1000000] [-q 1000] [--db /tmp/search_benchmark.db]
+"""
+import os
+import argparse
+from random import Random
+from timeit import default_timer
+from module import App
+from module.server.config import TestConfig
+from module.server.models.user import User
+from module.server.models.search import search_users
+
+FIRST_NAMES = ("Ivan", "Petro", "Olena", "Maria", "Andrii", "Oksana", "Taras", "Iryna", "Mykola", "Sofia")
+LAST_NAMES = ("Shevchenko", "Kovalenko", "Bondarenko", "Tkachenko", "Kravchenko", "Oliinyk", "Melnyk", "Lysenko")
+STREETS = ("Khreshchatyk", "Shevchenka", "Franka", "Lesi Ukrainky", "Sadova", "Zelena", "Hrushevskoho")
+
+
+def fill(db, num, chunk_size=50000):
+    """Inserts 'num' users with random names, phones and addresses (the search index is filled by the triggers)"""
+    rnd = Random(0)
+    for start in range(0, num, chunk_size):
+        db.session.execute(
+            User.__table__.insert(),
+            [
+                dict(
+                    username="user{0}".format(i),
+                    name="{0} {1}".format(rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)),
+                    phone="+380{0:09d}".format(i * 7919 % 10**9),  # unique and scattered
+                    email="user{0}@example.com".format(i),
+                    address="{0} st. {1}".format(rnd.choice(STREETS), rnd.randrange(1, 200)),
+                    password_hash="x",
+                )
+                for i in range(start, min(start + chunk_size, num))
+            ],
+        )
+        db.session.commit()
+
+
+def queries(num, users):
+    """Returns search texts: rare usernames, phone suffixes, common names and streets"""
+    rnd = Random(1)
+    texts = []
+    for i in range(num):
+        kind = i % 4
+        if kind == 0:
+            texts.append("user{0}".format(rnd.randrange(users)))
+        elif kind == 1:
+            texts.append("{0:04d}".format(rnd.randrange(10**4)))
+        elif kind == 2:
+            texts.append("{0} {1}".format(rnd.choice(FIRST_NAMES)[:4], rnd.choice(LAST_NAMES)[:5]))
+        else:
+            texts.append(rnd.choice(STREETS)[:5])
+    return texts
+
+
+def run(num, num_queries, path):
+    """Fills the database (once) and measures latency of the search"""
+
+    class BenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+
+    runner = App(config_obj=BenchmarkConfig)
+    app, db = runner.get_flask_app(), runner.db
+
+    with app.app_context():
+        if not os.path.exists(path):
+            db.create_all()
+            start = default_timer()
+            fill(db, num)
+            print("Filled {0} users in {1:.1f}s".format(num, default_timer() - start))
+        users = db.session.query(db.func.count(User.id)).scalar()
+
+        timings = []
+        for text in queries(num_queries, users):
+            start = default_timer()
+            search_users(text, limit=20, max_candidates=app.config["SEARCH_MAX_CANDIDATES"])
+            timings.append(default_timer() - start)
+        db.session.remove()
+
+    timings.sort()
+    print("Users: {0}, queries: {1}".format(users, num_queries))
+    for name, share in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1)):
+        print("{0:>4}: {1:.2f} ms".format(name, timings[min(int(len(timings) * share), len(timings) - 1)] * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--num", type=int, default=1000000, help="Number of users.")
+    parser.add_argument("-q", "--queries", type=int, default=1000, help="Number of search queries.")
+    parser.add_argument("--db", default="/tmp/search_benchmark.db", help="Database file, it's filled only once.")
+    args = parser.parse_args()
+    run(args.num, args.queries, args.db)
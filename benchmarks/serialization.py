@@ -0,0 +1,101 @@
+"""
+Benchmark of the user serialization.
+Compares dumping of the users with the generic marshmallow path (a new schema per request, hyperlinks built by
+Flask's url_for) against the shared schemas with precompiled url templates, and the compact sparse fieldset.
+
+Run from the project root:
+    python -m benchmarks.serialization [-n 10000] [-r 5]
+"""
+import argparse
+from timeit import default_timer
+from module import App
+from module.server.config import TestConfig
+from module.server.models.user import User
+from module.server.api.schemas.base import get_schema, get_sparse_schema
+from module.server.api.schemas.user import AdminUserInfoSchema, FullUserInfoSchema
+
+ma = App.ma
+
+
+def legacy(schema_class):
+    """Returns the schema class with the same fields serialized by the generic marshmallow and Flask code"""
+    links = schema_class._declared_fields["_links"].schema
+    return type(
+        "Legacy" + schema_class.__name__,
+        (ma.SQLAlchemyAutoSchema,),
+        dict(
+            Meta=schema_class.Meta,
+            _links=ma.Hyperlinks(
+                {name: ma.URLFor(field.endpoint, values=field.values) for name, field in links.items()}
+            ),
+        ),
+    )
+
+
+def fill(db, num):
+    """Inserts 'num' users with every serialized column filled"""
+    db.session.execute(
+        User.__table__.insert(),
+        [
+            dict(
+                username="user{0}".format(i),
+                name="User {0}".format(i),
+                phone="+380{0:09d}".format(i),
+                email="user{0}@example.com".format(i),
+                address="Khreshchatyk st. {0}".format(i % 200),
+                ip="10.{0}.{1}.{2}".format(i >> 16, (i >> 8) & 255, i & 255),
+                tariff="100m",
+                state="activated",
+                balance=i % 500 - 250,
+                password_hash="x",
+            )
+            for i in range(num)
+        ],
+    )
+    db.session.commit()
+
+
+def measure(dump, repeat) -> float:
+    """Returns the best time of 'repeat' runs of the dump in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = default_timer()
+        dump()
+        timings.append(default_timer() - start)
+    return min(timings)
+
+
+def run(num, repeat):
+    """Fills the in-memory database and measures time of dumping all users"""
+    runner = App(config_obj=TestConfig)
+    app, db = runner.get_flask_app(), runner.db
+
+    with app.app_context(), app.test_request_context():
+        db.create_all()
+        fill(db, num)
+        users = User.query.order_by(User.id).all()  # loaded once, so only the serialization is measured
+
+        print("Users: {0}, best of {1} runs".format(num, repeat))
+        for schema_class in (AdminUserInfoSchema, FullUserInfoSchema):
+            legacy_class = legacy(schema_class)
+            assert legacy_class(many=True).dump(users) == get_schema(schema_class, many=True).dump(users)
+            before = measure(lambda: legacy_class(many=True).dump(users), repeat)
+            after = measure(lambda: get_schema(schema_class, many=True).dump(users), repeat)
+            compact_schema = get_sparse_schema(
+                schema_class, only=("tariff", "state", "balance"), links=False, many=True
+            )
+            compact = measure(lambda: compact_schema.dump(users), repeat)
+            print(
+                "{0}: before {1:.1f} ms, after {2:.1f} ms ({3:.1f}x), compact {4:.1f} ms ({5:.1f}x)".format(
+                    schema_class.__name__, before * 1000, after * 1000, before / after, compact * 1000, before / compact
+                )
+            )
+        db.session.remove()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--num", type=int, default=10000, help="Number of users.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of runs, the best one is reported.")
+    args = parser.parse_args()
+    run(args.num, args.repeat)
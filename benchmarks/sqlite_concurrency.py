@@ -0,0 +1,169 @@
+"""
+Benchmark of the concurrent writes to the SQLite file database by several worker processes, like gunicorn workers.
+Every worker alternates card redemptions and logins followed by logouts (the revoked token is saved) through the API.
+The same load is run with the default pysqlite settings, with the SQLite profile (WAL, pragmas, BEGIN IMMEDIATE)
+and with the profile and the write queue (the writes are applied by one writer process),
+every run on a new database file.
+
+Run from the project root:
+    python -m benchmarks.sqlite_concurrency [-w 9] [-d 10] [--busy-timeout 5000]
+"""
+import os
+import argparse
+import tempfile
+import multiprocessing
+from time import sleep
+from timeit import default_timer
+from collections import Counter
+from sqlalchemy.exc import OperationalError
+from werkzeug.security import generate_password_hash
+from module import App
+from module.server.config import Config, TestConfig
+from module.server.models.user import User
+from module.server.models.payment_cards import Card
+from module.server.writer import run_writer
+
+PASSWORD = "bench"
+PROFILES = ("default", "tuned", "queue")
+
+
+def make_config(path, profile, busy_timeout):
+    """Returns config of the app with the database file and the profile"""
+
+    class BenchmarkConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + path
+        SQLITE_PRAGMAS = dict(Config.SQLITE_PRAGMAS, busy_timeout=busy_timeout) if profile != "default" else {}
+        SQLITE_IMMEDIATE_WRITES = profile != "default"
+        WRITE_QUEUE_ADDRESS = path + ".sock" if profile == "queue" else None
+        DEBUG = TESTING = False
+        PROPAGATE_EXCEPTIONS = False  # errors are returned as 500 like in production
+
+    return BenchmarkConfig
+
+
+def seed(config, workers, cards):
+    """Creates a user and 'cards' unused cards for every worker"""
+    runner = App(config_obj=config)
+    app, db = runner.get_flask_app(), runner.db
+    password_hash = generate_password_hash(PASSWORD, app.config["PASSWORD_HASH_METHOD"])
+    with app.app_context():
+        db.create_all()
+        db.session.execute(
+            User.__table__.insert(),
+            [dict(username="worker{0}".format(i), password_hash=password_hash, balance=0) for i in range(workers)],
+        )
+        for i in range(workers):
+            db.session.execute(Card.__table__.insert(), [dict(code=card_code(i, n), amount=1) for n in range(cards)])
+        db.session.commit()
+        db.session.remove()
+        db.get_engine(app).dispose()
+
+
+def card_code(worker, number) -> str:
+    """Returns code of the card redeemed by the worker"""
+    return "W{0:03d}{1:08d}".format(worker, number)
+
+
+def writer(config):
+    """Applies the writes of the workers"""
+    runner = App(config_obj=config)
+    run_writer(runner.get_flask_app(), runner.db)
+
+
+def worker(index, config, start, duration, results):
+    """Redeems cards and logs in and out until the time is over, puts counts and latencies to the results"""
+    runner = App(config_obj=config)
+    app, db = runner.get_flask_app(), runner.db
+    client = app.test_client()
+    login = dict(login="worker{0}".format(index), password=PASSWORD)
+    data = client.get("/api/v1/auth", json=login).get_json()
+    headers = dict(Authorization="Bearer " + data["access_token"])
+    with app.app_context():
+        uuid = User.get_user_by_username(login["login"]).uuid
+        db.session.remove()
+
+    counts, timings = Counter(), dict(redeem=[], login=[])
+    start.wait()
+    deadline, number = default_timer() + duration, 0
+    while default_timer() < deadline:
+        action = "redeem" if number % 2 else "login"
+        begin = default_timer()
+        try:
+            if action == "redeem":
+                response = client.post(
+                    "/api/v1/users/" + uuid, json=dict(code=card_code(index, number)), headers=headers
+                )
+                ok = response.status_code == 200
+            else:
+                response = client.get("/api/v1/auth", json=login)
+                ok = response.status_code == 200
+                if ok:
+                    token = response.get_json()["access_token"]
+                    response = client.post("/api/v1/logout", headers=dict(Authorization="Bearer " + token))
+                    ok = response.status_code == 200
+        except OperationalError:
+            ok = False
+        timings[action].append(default_timer() - begin)
+        counts[(action, ok)] += 1
+        number += 1
+    results.put((counts, timings))
+
+
+def percentile(values, share) -> float:
+    """Returns the percentile of the sorted values in milliseconds"""
+    return values[min(int(len(values) * share), len(values) - 1)] * 1000 if values else 0
+
+
+def run(profile, workers, duration, busy_timeout, cards):
+    """Runs the load with the profile and prints throughput and latency of the actions"""
+    path = os.path.join(tempfile.mkdtemp(), "concurrency.db")
+    config = make_config(path, profile, busy_timeout)
+    seed(config, workers, cards)
+    if config.WRITE_QUEUE_ADDRESS:
+        writer_process = multiprocessing.Process(target=writer, args=(config,), daemon=True)
+        writer_process.start()
+        while not os.path.exists(config.WRITE_QUEUE_ADDRESS):
+            sleep(0.01)
+
+    start, results = multiprocessing.Event(), multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(i, config, start, duration, results)) for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    start.set()
+    counts, timings = Counter(), dict(redeem=[], login=[])
+    for _ in processes:
+        worker_counts, worker_timings = results.get(timeout=duration + 60)  # raises Empty if a worker has failed
+        counts.update(worker_counts)
+        for action, values in worker_timings.items():
+            timings[action].extend(values)
+    for process in processes:
+        process.join()
+    if config.WRITE_QUEUE_ADDRESS:
+        writer_process.terminate()
+
+    print("Profile: {0}, workers: {1}, {2} s".format(profile, workers, duration))
+    for action in ("redeem", "login"):
+        values = sorted(timings[action])
+        print(
+            "  {0:<6} {1:>7.1f} ok/s, {2:>5} errors, p50 {3:>7.1f} ms, p99 {4:>7.1f} ms".format(
+                action,
+                counts[(action, True)] / duration,
+                counts[(action, False)],
+                percentile(values, 0.5),
+                percentile(values, 0.99),
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() * 2 + 1, help="Number of processes.")
+    parser.add_argument("-d", "--duration", type=float, default=10, help="Duration of every run in seconds.")
+    parser.add_argument("--busy-timeout", type=int, default=5000, help="busy_timeout of the tuned profile in ms.")
+    parser.add_argument("--cards", type=int, default=20000, help="Number of cards of every worker.")
+    parser.add_argument("-p", "--profile", choices=PROFILES, action="append", help="Profiles to run, defaults to all.")
+    args = parser.parse_args()
+    for name in args.profile or PROFILES:
+        run(name, args.workers, args.duration, args.busy_timeout, args.cards)
@@ -2,16 +2,21 @@
 import os
 import logging
 from datetime import timedelta
-from logging.handlers import RotatingFileHandler, SMTPHandler
+from logging.handlers import RotatingFileHandler
 from marshmallow import ValidationError
 from flask import Flask, session, jsonify
 from flask_migrate import Migrate
 from flask_moment import Moment
 from flask_login import LoginManager
-from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_marshmallow import Marshmallow
 from module.server.config import Config, TestConfig
+from module.server.logs import TEXT_FORMAT, BackgroundHandler, DigestSMTPHandler, JsonFormatter
+from module.server.metrics import Metrics
+from module.server.queries import SqlMonitor
+from module.server.sqlite import SqliteProfile
+from module.server.writer import WriteQueue
+from module.server.replica import REPLICA_BIND, Replica, RoutingSQLAlchemy
 
 
 __version__ = "1.0.5"
@@ -27,7 +32,7 @@ class App:
     :type config_obj: object, optional
     """
 
-    db = SQLAlchemy()
+    db = RoutingSQLAlchemy()
     migrate = Migrate()
     ma = Marshmallow()
     moment = Moment()
@@ -41,7 +46,6 @@ class App:
         self.migration_folder = os.path.join(os.path.dirname(__file__), "server", "models", "migrations")
         self.templates_folder = os.path.join(os.path.dirname(__file__), "client", "templates")
         self.static_folder = os.path.join(os.path.dirname(__file__), "client", "static")
-        self.logs_folder = os.path.join(os.path.dirname(__file__), "server", "static", "logs")
 
         # App
         self._app = Flask(
@@ -53,11 +57,18 @@ class App:
             self._app.config.from_object(TestConfig)
         else:
             self._app.config.from_object(config_obj)
+        self.logs_folder = self._app.config["LOGS_FOLDER"]
+        replica_url = self._app.config["REPLICA_DATABASE_URL"]
+        if replica_url:
+            binds = dict(self._app.config.get("SQLALCHEMY_BINDS") or {})
+            binds[REPLICA_BIND] = replica_url
+            self._app.config["SQLALCHEMY_BINDS"] = binds
 
         # Init
         App.db.init_app(self._app)
         with self._app.app_context():  # Fixing ALTER table SQLite issue
-            if App.db.engine.url.drivername == "sqlite":
+            is_sqlite = App.db.engine.url.drivername == "sqlite"
+            if is_sqlite:
                 App.migrate.init_app(
                     self._app,
                     App.db,
@@ -67,6 +78,15 @@ class App:
             else:
                 App.migrate.init_app(self._app, App.db, directory=self.migration_folder)
 
+        # Reads of the read-only views from the replica
+        if replica_url:
+            Replica(self._app.config["REPLICA_STICKY_SECONDS"]).init_app(self._app, App.db)
+
+        # Pragmas and locking of the SQLite connections shared by the workers
+        pragmas, immediate_writes = self._app.config["SQLITE_PRAGMAS"], self._app.config["SQLITE_IMMEDIATE_WRITES"]
+        if is_sqlite and (pragmas or immediate_writes):
+            SqliteProfile(pragmas, immediate_writes).init_app(self._app, App.db)
+
         App.ma.init_app(self._app)
         App.login_manager.init_app(self._app)
         App.moment.init_app(self._app)
@@ -79,6 +99,24 @@ class App:
 
         self.setup_logging_error_handling()
 
+        # Metrics of the requests, available on /metrics
+        if self._app.config["METRICS_ENABLED"]:
+            Metrics(self._app.config["METRICS_DIR"]).init_app(self._app, App.db)
+
+        # Writes of all workers are applied by one writer process
+        if self._app.config["WRITE_QUEUE_ADDRESS"]:
+            self._app.extensions["write_queue"] = WriteQueue(
+                self._app.config["WRITE_QUEUE_ADDRESS"],
+                authkey=self._app.config["SECRET_KEY"].encode(),
+                timeout=self._app.config["WRITE_QUEUE_TIMEOUT"],
+            )
+
+        # Logs of the slow and repeated SQL queries
+        slow_threshold = self._app.config["SQL_SLOW_QUERY_THRESHOLD"]
+        repeat_threshold = self._app.config["SQL_REPEATED_QUERY_THRESHOLD"]
+        if slow_threshold is not None or repeat_threshold:
+            SqlMonitor(slow_threshold, repeat_threshold).init_app(self._app, App.db)
+
         @self._app.before_request
         def before_request() -> None:
             """
@@ -125,41 +163,52 @@ class App:
         :param log_level: logger level (debug, info, warning, error, exception, critical), defaults to logging.DEBUG
         """
 
+        config = self._app.config
+
         # Logging to the file
         path_to_logs = logs_folder if logs_folder else self.logs_folder
 
         if not os.path.exists(path_to_logs):
             os.mkdir(path_to_logs)
 
-        file_handler = RotatingFileHandler(os.path.join(path_to_logs, "main.log"), maxBytes=10240, backupCount=5)
-        file_handler.setFormatter(
-            logging.Formatter("%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]")
+        file_handler = RotatingFileHandler(
+            os.path.join(path_to_logs, "main.log"),
+            maxBytes=config["LOG_MAX_BYTES"],
+            backupCount=config["LOG_BACKUP_COUNT"],
+            delay=True,
         )
-
-        self._app.logger.addHandler(file_handler)
-        self._app.logger.setLevel(log_level)
-
-        # Email notifications about failures
-        auth = secure = None
-
-        if self._app.config["MAIL_USERNAME"] and self._app.config["MAIL_PASSWORD"]:
-            auth = (
-                self._app.config["MAIL_USERNAME"],
-                self._app.config["MAIL_PASSWORD"],
+        file_handler.setFormatter(JsonFormatter() if config["LOG_FORMAT"] == "json" else logging.Formatter(TEXT_FORMAT))
+        handlers = [file_handler]
+
+        # Email notifications about failures, sent in digests
+        if config["ADMINS"]:
+            auth = secure = None
+
+            if config["MAIL_USERNAME"] and config["MAIL_PASSWORD"]:
+                auth = (config["MAIL_USERNAME"], config["MAIL_PASSWORD"])
+            if config["MAIL_USE_TLS"]:
+                secure = ()
+
+            mail_handler = DigestSMTPHandler(
+                interval=config["LOG_MAIL_INTERVAL"],
+                mailhost=(config["MAIL_SERVER"], config["MAIL_PORT"]),
+                fromaddr="no-reply@cabinet.support",
+                toaddrs=config["ADMINS"],
+                subject="Cabinet Error",
+                credentials=auth,
+                secure=secure,
             )
-        if self._app.config["MAIL_USE_TLS"]:
-            secure = ()
-
-        mail_handler = SMTPHandler(
-            mailhost=(self._app.config["MAIL_SERVER"], self._app.config["MAIL_PORT"]),
-            fromaddr="no-reply@cabinet.support",
-            toaddrs=self._app.config["ADMINS"],
-            subject="Cabinet Error",
-            credentials=auth,
-            secure=secure,
-        )
-        mail_handler.setLevel(logging.ERROR)
-        self._app.logger.addHandler(mail_handler)
+            mail_handler.setLevel(logging.ERROR)
+            mail_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+            handlers.append(mail_handler)
+
+        # The handlers are called by a background thread, so requests never wait for the disk or the mail server.
+        # The logger is shared by the apps, so the handler of the previous configuration is replaced
+        for handler in [handler for handler in self._app.logger.handlers if isinstance(handler, BackgroundHandler)]:
+            self._app.logger.removeHandler(handler)
+            handler.close()
+        self._app.logger.addHandler(BackgroundHandler(handlers, queue_size=config["LOG_QUEUE_SIZE"]))
+        self._app.logger.setLevel(log_level)
 
         # Marshmallow ValidationError
         @self._app.errorhandler(ValidationError)
@@ -187,4 +236,9 @@ from module.server.models import (
     user,
     payment_cards,
     jwt_tokens,
+    ip_pool,
+    stats,
+    billing,
+    search,
+    replica,
 )  # these imports are required for migration
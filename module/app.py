@@ -4,10 +4,20 @@ from module.server.view.login import bp as login_bp
 from module.server.view.cabinet import bp as cabinet_bp
 from module.server.view.admin import bp as admin_bp
 from module.commands.common import populate_cli
+from module.commands.tokens import tokens_cli
+from module.commands.stats import stats_cli
+from module.commands.billing import billing_cli
+from module.commands.debtors import debtors_cli
+from module.commands.export import export_cli
+from module.commands.bench import bench_cli
+from module.commands.writer import writer_cli
+from module.commands.replica import replica_cli
 
 runner = App()
 runner.register_blueprints(login_bp, cabinet_bp, admin_bp)
-runner.register_cli_commands(populate_cli)
+runner.register_cli_commands(
+    populate_cli, tokens_cli, stats_cli, billing_cli, debtors_cli, export_cli, bench_cli, writer_cli, replica_cli
+)
 
 # Flask app. Required for migration
 app = runner.get_flask_app()
@@ -0,0 +1,311 @@
+"""Micro-benchmarks of the hot paths of the models and schemas"""
+import os
+import json
+import sqlite3
+import platform
+import subprocess
+from itertools import cycle
+from statistics import median
+from timeit import default_timer
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from werkzeug.security import generate_password_hash
+from module import App
+from module.server.config import Config
+from module.server.hashing import get_hasher
+from module.server.models import generate_uuid
+from module.server.models.user import User
+from module.server.models.payment_cards import Card
+from module.server.models.jwt_tokens import TokenBlocklist, check_if_token_in_blocklist
+from module.server.models.stats import Stats
+from module.server.api.schemas.base import get_schema
+from module.server.api.schemas.user import AdminUserInfoSchema
+
+bench_cli = AppGroup("bench")
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PASSWORD = "bench"  # password of every user of the dataset
+PAGE_SIZE = 100  # number of users dumped at once by the schema benchmarks
+BENCHMARKS = dict()  # name: function which prepares the dataset and returns the measured function
+
+
+def benchmark(name):
+    """
+    Registers benchmark. The decorated function gets the dataset and returns the function called on every operation
+    :param name: name of the benchmark
+    :type name: str
+    """
+
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+@benchmark("check_password")
+def _check_password(dataset):
+    """Password hash verification with the configured method"""
+    user = User.get_by_uuid(dataset["uuids"][0])
+    return lambda: user.check_password(PASSWORD)
+
+
+@benchmark("get_by_uuid")
+def _get_by_uuid(dataset):
+    """Loading of the user by uuid"""
+    uuids = cycle(dataset["uuids"])
+    return lambda: User.get_by_uuid(next(uuids))
+
+
+@benchmark("token_blocklist")
+def _token_blocklist(dataset):
+    """Check of the access tokens, a half of them are revoked"""
+    payloads = cycle(dict(jti=jti) for pair in zip(dataset["jtis"], dataset["uuids"]) for jti in pair)
+    return lambda: check_if_token_in_blocklist(None, next(payloads))
+
+
+@benchmark("admin_schema_dump")
+def _admin_schema_dump(dataset):
+    """Serialization of a page of users for the admin"""
+    users = User.query.order_by(User.id).limit(PAGE_SIZE).all()
+    schema = get_schema(AdminUserInfoSchema, many=True)
+    return lambda: schema.dump(users)
+
+
+@benchmark("use_card")
+def _use_card(dataset):
+    """Replenishment of the balance with a new card every time"""
+    user = User.get_by_uuid(dataset["uuids"][0])
+    codes = iter(dataset["codes"])
+
+    def use_card():
+        # the number of calls depends on the speed of the machine, so it isn't known while seeding
+        code = next(codes, None)
+        if code is None:
+            raise click.ClickException(
+                "All {0} cards are used by the use_card benchmark, raise --cards.".format(len(dataset["codes"]))
+            )
+        user.use_card(code)
+
+    return use_card
+
+
+@benchmark("dashboard_counters")
+def _dashboard_counters(dataset):
+    """Counters of the admin page read from the stored table"""
+    return Stats.get
+
+
+@benchmark("dashboard_aggregates")
+def _dashboard_aggregates(dataset):
+    """Counters of the admin page computed with aggregate queries"""
+    return Stats.compute
+
+
+def seed(db, users, cards, tokens, hash_method, chunk_size=10000) -> dict:
+    """
+    Fills the database and returns uuids of the users, codes of the cards and identifiers of the revoked tokens
+    """
+    password_hash = generate_password_hash(PASSWORD, hash_method)  # the same hash makes seeding fast
+    dataset = dict(
+        uuids=[generate_uuid() for _ in range(users)],
+        codes=["B{0:011d}".format(i) for i in range(cards)],
+        jtis=[generate_uuid() for _ in range(tokens)],
+    )
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    tables = (
+        (
+            User.__table__,
+            [
+                dict(
+                    uuid=uuid,
+                    username="bench{0}".format(i),
+                    name="User {0}".format(i),
+                    email="bench{0}@example.com".format(i),
+                    phone="+380{0:09d}".format(i),
+                    address="Khreshchatyk st. {0}".format(i % 200),
+                    tariff="100m",
+                    state="activated",
+                    balance=i % 500 - 250,
+                    password_hash=password_hash,
+                )
+                for i, uuid in enumerate(dataset["uuids"])
+            ],
+        ),
+        (Card.__table__, [dict(uuid=generate_uuid(), code=code, amount=100) for code in dataset["codes"]]),
+        (
+            TokenBlocklist.__table__,
+            [dict(user_id=1, jti=jti, reason="Logout", expires_at=expires_at) for jti in dataset["jtis"]],
+        ),
+    )
+    for table, rows in tables:
+        for start in range(0, len(rows), chunk_size):
+            db.session.execute(table.insert(), rows[start : start + chunk_size])
+            db.session.commit()
+    Stats.rebuild()
+    return dataset
+
+
+def measure(func, repeat, min_time) -> dict:
+    """
+    Returns the best and the median time of one call in microseconds.
+    The number of calls per repeat is chosen so that every repeat takes at least 'min_time' seconds
+    """
+
+    def timed(number):
+        start = default_timer()
+        for _ in range(number):
+            func()
+        return default_timer() - start
+
+    number = 1
+    elapsed = timed(number)  # warms up the caches too
+    while elapsed < min_time:
+        number = max(number * 2, int(number * min_time / elapsed) + 1) if elapsed else number * 10
+        elapsed = timed(number)
+
+    timings = [timed(number) / number * 1e6 for _ in range(repeat)]
+    return dict(best_us=round(min(timings), 3), median_us=round(median(timings), 3), number=number, repeat=repeat)
+
+
+def revision() -> dict:
+    """Returns the git commit of the project and whether there are uncommitted changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PROJECT_DIR, capture_output=True, text=True)
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=PROJECT_DIR, capture_output=True, text=True
+        )
+    except OSError:  # git isn't installed
+        return dict(commit=None, dirty=None)
+    if commit.returncode:
+        return dict(commit=None, dirty=None)
+    return dict(commit=commit.stdout.strip(), dirty=bool(status.stdout.strip()))
+
+
+def machine() -> dict:
+    """Returns information about the machine and the interpreter"""
+    return dict(
+        platform=platform.platform(),
+        processor=platform.processor() or platform.machine(),
+        cpu_count=os.cpu_count(),
+        python=platform.python_version(),
+        sqlite=sqlite3.sqlite_version,
+    )
+
+
+def compare(results, baseline, tolerance) -> list:
+    """
+    Prints changes of the best times since the baseline and returns names of the regressed benchmarks
+    :param tolerance: allowed slowdown, e.g. 0.25 - 25%
+    :type tolerance: float
+    """
+    if baseline.get("machine") != results["machine"]:
+        print("Warning: the baseline was measured on another machine or interpreter.")
+    regressed = []
+    for name, result in results["benchmarks"].items():
+        old = baseline["benchmarks"].get(name)
+        if old is None:
+            print("{0}: no baseline".format(name))
+            continue
+        change = (result["best_us"] - old["best_us"]) / old["best_us"]
+        mark = ""
+        if change > tolerance:
+            regressed.append(name)
+            mark = " REGRESSION"
+        print(
+            "{0}: {1:.1f} -> {2:.1f} us ({3:+.1f}%){4}".format(
+                name, old["best_us"], result["best_us"], change * 100, mark
+            )
+        )
+    return regressed
+
+
+@bench_cli.command("run")
+@click.option("-d", "--db", default=None, help="SQLite file of the dataset, it's filled again. Defaults to the memory.")
+@click.option("-n", "--users", default=10000, help="Number of users in the dataset.")
+@click.option("--cards", default=10000, help="Number of unused cards in the dataset.")
+@click.option("--tokens", default=10000, help="Number of revoked tokens in the dataset.")
+@click.option("-r", "--repeat", default=5, help="Number of measurements of every benchmark, the best one is compared.")
+@click.option("-t", "--min-time", default=0.2, help="Min duration (in seconds) of every measurement.")
+@click.option("-k", "--only", multiple=True, type=click.Choice(list(BENCHMARKS)), help="Benchmarks to run.")
+@click.option("-o", "--output", default=None, type=click.Path(dir_okay=False), help="File to save the results.")
+@click.option("-b", "--baseline", default=None, type=click.Path(exists=True, dir_okay=False), help="Previous results.")
+@click.option("--tolerance", default=0.25, help="Allowed slowdown against the baseline, 0.25 - 25%.")
+def run(db, users, cards, tokens, repeat, min_time, only, output, baseline, tolerance):
+    """
+    Runs micro-benchmarks of the hot paths on a new dataset, the application database isn't used.
+    Results are saved with the git revision and the machine info. Fails if any benchmark is slower
+    than the baseline by more than the tolerance.
+
+    :param db: SQLite file of the dataset, -d or --db argument, defaults to None (in-memory database)
+    :type db: str, optional
+    :param users: number of users, -n or --users argument, defaults to 10000
+    :type users: int, optional
+    :param cards: number of unused cards, --cards argument, defaults to 10000
+    :type cards: int, optional
+    :param tokens: number of revoked tokens, --tokens argument, defaults to 10000
+    :type tokens: int, optional
+    :param repeat: number of measurements, -r or --repeat argument, defaults to 5
+    :type repeat: int, optional
+    :param min_time: min duration of every measurement, -t or --min-time argument, defaults to 0.2
+    :type min_time: float, optional
+    :param only: names of the benchmarks to run, -k or --only argument, defaults to all benchmarks
+    :type only: tuple, optional
+    :param output: file to save the results, -o or --output argument, defaults to None
+    :type output: str, optional
+    :param baseline: file with the previous results, -b or --baseline argument, defaults to None
+    :type baseline: str, optional
+    :param tolerance: allowed slowdown against the baseline, --tolerance argument, defaults to 0.25
+    :type tolerance: float, optional
+    :raises ClickException: some benchmarks regressed
+    """
+    if db is not None and os.path.exists(db):
+        os.remove(db)
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + db if db else "sqlite://"
+        ADMINS = []
+        METRICS_ENABLED = False
+        # the writes and the reads of the benchmarks go to the bench database only
+        WRITE_QUEUE_ADDRESS = None
+        REPLICA_DATABASE_URL = None
+
+    runner = App(config_obj=BenchConfig)
+    app, database = runner.get_flask_app(), runner.db
+    results = dict(
+        created_at=datetime.utcnow().isoformat(timespec="seconds"),
+        revision=revision(),
+        machine=machine(),
+        dataset=dict(db=db or "memory", users=users, cards=cards, tokens=tokens),
+        benchmarks=dict(),
+    )
+
+    with app.app_context(), app.test_request_context():
+        database.create_all()
+        dataset = seed(database, users, cards, tokens, app.config["PASSWORD_HASH_METHOD"])
+        try:
+            for name, setup in BENCHMARKS.items():
+                if only and name not in only:
+                    continue
+                result = results["benchmarks"][name] = measure(setup(dataset), repeat, min_time)
+                print(
+                    "{0}: best {1:.1f} us, median {2:.1f} us ({3} x {4} calls)".format(
+                        name, result["best_us"], result["median_us"], result["repeat"], result["number"]
+                    )
+                )
+        finally:
+            get_hasher().shutdown()
+            database.session.remove()
+            database.get_engine(app).dispose()
+
+    if output:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+        print("Results are saved to {0}".format(output))
+
+    if baseline:
+        with open(baseline) as file:
+            regressed = compare(results, json.load(file), tolerance)
+        if regressed:
+            raise click.ClickException("Regressed by more than {0:.0%}: {1}".format(tolerance, ", ".join(regressed)))
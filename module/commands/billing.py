@@ -0,0 +1,40 @@
+"""Commands to charge users for their tariffs"""
+from datetime import datetime
+from timeit import default_timer
+import click
+from flask.cli import AppGroup
+from module.server.models.billing import charge_period
+
+billing_cli = AppGroup("billing")
+
+
+@billing_cli.command("run")
+@click.option("-p", "--period", default=None, help="Billing period, YYYY-MM. Defaults to the current month.")
+@click.option("-c", "--chunk-size", default=10000, help="Number of users charged in one transaction.")
+@click.option("-w", "--workers", default=1, help="Number of id ranges charged in parallel.")
+def run(period, chunk_size, workers):
+    """
+    Charges every activated user the cost of the tariff for the period.
+    Users who were already charged for the period are skipped, so an interrupted run can be repeated.
+
+    :param period: billing period, -p or --period argument, defaults to the current month
+    :type period: str, optional
+    :param chunk_size: number of users charged in one transaction, -c or --chunk-size argument, defaults to 10000
+    :type chunk_size: int, optional
+    :param workers: number of id ranges charged in parallel, -w or --workers argument, defaults to 1
+    :type workers: int, optional
+    """
+    period = period or datetime.utcnow().strftime("%Y-%m")
+    start = default_timer()
+    try:
+        charged, amount = charge_period(period, chunk_size=chunk_size, workers=workers)
+    except ValueError as e:
+        print("Unable to charge: {0}".format(e))
+        return
+
+    elapsed = default_timer() - start
+    print(
+        "Period {0}: charged {1} users, {2} in total. {3:.1f}s, {4:.0f} users/s".format(
+            period, charged, amount, elapsed, charged / elapsed if elapsed else 0
+        )
+    )
@@ -1,10 +1,25 @@
 """Common commands for the manager"""
+import os
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+from collections import deque
+from secrets import randbelow
+from timeit import default_timer
 import click
+from flask import current_app
 from flask.cli import AppGroup
+from marshmallow import EXCLUDE
 from sqlalchemy.exc import IntegrityError
 from module import App
-from module.server.models.user import User
-from module.server.models.payment_cards import Card
+from module.server.hashing import PasswordHasher
+from module.server.models import generate_uuid
+from module.server.models.user import User, Role, State
+from module.server.models.payment_cards import Card, UsedCard
+from module.server.models.ip_pool import reserve_ips
+from module.server.models.stats import increment
+from module.server.api.schemas.user import RegisterSchema
 
 populate_cli = AppGroup("populate")
 
@@ -24,7 +39,7 @@ def admin(password):
         # If the first row in the table doesn't exist
         # Creates account with login "admin" and password "test"(both fields may be changed)
         try:
-            admin = User(username="admin", password=password)
+            admin = User(username="admin", password=password, role=Role.admin_role.value)
             admin.save_to_db()
             # If everything is okay a message with the login and password from the admin account
             # will be displayed in the console
@@ -38,42 +53,372 @@ def admin(password):
 
 
 @populate_cli.command("cards")
-@click.option("-n", "--num", default=10, help="Number of test cards.")
-def cards(num):
+@click.option("-n", "--num", default=10, help="Number of payment cards.")
+@click.option(
+    "-o",
+    "--output",
+    default="cards.csv",
+    type=click.Path(dir_okay=False),
+    help="CSV file to which codes and amounts of the created cards are written.",
+)
+@click.option("-a", "--amount", "amounts", multiple=True, type=int, default=(200, 400), help="Amounts of the cards.")
+@click.option("-l", "--length", default=12, help="Number of digits in the card code.")
+@click.option("-c", "--chunk-size", default=10000, help="Number of cards inserted in one transaction.")
+@click.option("-r", "--resume", is_flag=True, help="Continue interrupted generation into the existing output file.")
+def cards(num, output, amounts, length, chunk_size, resume):
     """
-    Creates and saves to database test payment cards
+    Creates and saves to database payment cards with random codes
 
-    :param num: number of test payment cards with codes 00000i, where i in range(0, num_test_cards)
-        and amounts 200, 400 (50 on 50). In the command line interface, you can specify this by giving
-        the -n or --num argument, defaults to 10
+    :param num: number of payment cards. Amounts are distributed evenly between the values of the 'amounts'.
+        In the command line interface, you can specify this by giving the -n or --num argument, defaults to 10
     :type num: int, optional
+    :param output: CSV file for codes of the created cards, -o or --output argument, defaults to 'cards.csv'
+    :type output: str, optional
+    :param amounts: amounts of the cards, -a or --amount argument (may be repeated), defaults to (200, 400)
+    :type amounts: tuple, optional
+    :param length: number of digits in the code, -l or --length argument, defaults to 12
+    :type length: int, optional
+    :param chunk_size: number of cards inserted in one transaction, -c or --chunk-size argument, defaults to 10000
+    :type chunk_size: int, optional
+    :param resume: continue generation into the existing output file, -r or --resume flag, defaults to False
+    :type resume: bool, optional
     """
+    if os.path.exists(output) and not resume:
+        print("Output file {0} already exists. Use --resume to continue generation.".format(output))
+        return
 
-    num_200_test_cards = num // 2
-    num_400_test_cards = num - num_200_test_cards
+    start = default_timer()
+    done = _resume_cards(output, chunk_size) if resume and os.path.exists(output) else 0
 
-    card_codes_list = list()
+    with open(output, "a", newline="") as output_file:
+        writer = csv.writer(output_file)
+        if not done:
+            writer.writerow(("code", "amount"))
 
-    # Creates cards with amount 200
-    for i in range(num_200_test_cards):
-        code = str(i).rjust(6, "0")
-        card_codes_list.append(code)
+        def save_codes(rows):
+            # codes are saved right before the commit, so they can't be lost if the command is interrupted
+            writer.writerows((row["code"], row["amount"]) for row in rows)
+            output_file.flush()
+            os.fsync(output_file.fileno())
 
-        card = Card(amount=200, code=code)
-        App.db.session.add(card)
+        while done < num:
+            codes = _generate_codes(min(chunk_size, num - done), length)
+            rows = [dict(code=code, amount=amounts[(done + i) % len(amounts)]) for i, code in enumerate(codes)]
+            _insert_cards(rows, length, before_commit=save_codes)
+            done += len(rows)
 
-    # Creates cards with amount 400
-    for i in range(num_200_test_cards, num_200_test_cards + num_400_test_cards):
-        code = str(i).rjust(6, "0")
-        card_codes_list.append(code)
+    elapsed = default_timer() - start
+    print(
+        "Successfully created {0} cards in {1:.2f}s ({2:.0f} cards/s). Card codes: {3}".format(
+            done, elapsed, done / elapsed if elapsed else 0, output
+        )
+    )
 
-        card = Card(amount=400, code=code)
-        App.db.session.add(card)
 
+def _generate_codes(num, length, exclude=()) -> list:
+    """
+    Returns list of unique random numeric codes
+    :param num: number of codes
+    :type num: int
+    :param length: number of digits in the code
+    :type length: int
+    :param exclude: codes which mustn't be returned, defaults to ()
+    :type exclude: set, optional
+    """
+    codes = set()
+    while len(codes) < num:
+        codes.update(str(randbelow(10**length)).rjust(length, "0") for _ in range(num - len(codes)))
+        codes.difference_update(exclude)
+    return list(codes)
+
+
+def _existing_codes(codes) -> set:
+    """
+    Returns codes of the list which are already used by payment cards or used payment cards
+    :param codes: list of codes to check
+    :type codes: list
+    """
+    return _existing_values(Card.code, codes) | _existing_values(UsedCard.code, codes)
+
+
+def _existing_values(column, values) -> set:
+    """
+    Returns values of the list which are already stored in the column
+    :param column: column to check, e.g. User.username
+    :param values: list of values to check
+    :type values: list
+    """
+    existing = set()
+    for i in range(0, len(values), 500):  # keep number of parameters in the query low
+        part = values[i : i + 500]
+        existing.update(value for (value,) in App.db.session.query(column).filter(column.in_(part)))
+    return existing
+
+
+def _insert_cards(rows, length, before_commit=None) -> None:
+    """
+    Inserts cards with one executemany statement and commits them.
+    Codes are checked for uniqueness by the database, the rare colliding codes are replaced and the chunk is retried.
+    :param rows: list of dicts with 'code' and 'amount' keys
+    :type rows: list
+    :param length: number of digits in the replacement codes
+    :type length: int
+    :param before_commit: function called with inserted rows before the commit, defaults to None
+    :type before_commit: callable, optional
+    """
+    session = App.db.session
+    while True:
+        try:
+            last_id = session.query(App.db.func.max(Card.id)).scalar() or 0
+            session.execute(Card.__table__.insert(), rows)
+            # codes of the used cards must stay unique too
+            taken = {
+                code
+                for (code,) in session.query(Card.code)
+                .join(UsedCard, UsedCard.code == Card.code)
+                .filter(Card.id > last_id)
+            }
+            if not taken:
+                increment(session.connection(), num_non_used_cards=len(rows))
+                if before_commit:
+                    before_commit(rows)
+                session.commit()
+                return
+        except IntegrityError:  # some codes are already used by the other cards
+            taken = None
+        except Exception:
+            session.rollback()
+            raise
+
+        session.rollback()
+        codes = [row["code"] for row in rows]
+        taken = taken or _existing_codes(codes)
+        replacements = iter(_generate_codes(len(rows), length, exclude=taken.union(codes)))
+        seen = set()
+        for row in rows:
+            if row["code"] in taken or row["code"] in seen:  # duplicate or already used code
+                row["code"] = next(replacements)
+            seen.add(row["code"])
+
+
+def _resume_cards(output, chunk_size) -> int:
+    """
+    Inserts cards from the last chunk of the output file which weren't committed before the interruption.
+    Returns number of cards in the file.
+    :param output: CSV file with codes of the created cards
+    :type output: str
+    :param chunk_size: number of cards in the chunk
+    :type chunk_size: int
+    """
+    done, last_chunk = 0, deque(maxlen=chunk_size)
+    with open(output, newline="") as output_file:
+        for row in csv.DictReader(output_file):
+            last_chunk.append(dict(code=row["code"], amount=int(row["amount"])))
+            done += 1
+
+    existing = _existing_codes([row["code"] for row in last_chunk])
+    missing = [row for row in last_chunk if row["code"] not in existing]
+    if missing:  # codes were saved, but the cards weren't committed
+        _insert_cards(missing, len(missing[0]["code"]))
+    return done
+
+
+@populate_cli.command("users")
+@click.option(
+    "--from", "source", required=True, type=click.Path(exists=True, dir_okay=False), help="CSV or NDJSON file."
+)
+@click.option(
+    "-f",
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "ndjson"]),
+    default=None,
+    help="Format of the file. By default is detected by the extension.",
+)
+@click.option("-c", "--chunk-size", default=1000, help="Number of users inserted in one transaction.")
+@click.option("-w", "--workers", default=os.cpu_count(), help="Number of processes hashing passwords.")
+@click.option(
+    "--rejects",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="CSV file to which rejected rows are written. Defaults to <file>.rejects.csv",
+)
+@click.option("-r", "--resume", is_flag=True, help="Continue interrupted import from the checkpoint.")
+def users(source, file_format, chunk_size, workers, rejects, resume):
+    """
+    Imports users from the CSV or NDJSON file. Rows are validated with the rules of the 'RegisterSchema',
+    rows which are invalid or have already used username or phone are written to the rejects file.
+    Number of processed rows is saved to the <file>.checkpoint after every chunk, so the import can be resumed.
+
+    :param source: CSV file with a header or NDJSON file, --from argument
+    :type source: str
+    :param file_format: 'csv' or 'ndjson', -f or --format argument, defaults to None (detected by the extension)
+    :type file_format: str, optional
+    :param chunk_size: number of users inserted in one transaction, -c or --chunk-size argument, defaults to 1000
+    :type chunk_size: int, optional
+    :param workers: number of processes hashing passwords, -w or --workers argument, defaults to the number of CPUs
+    :type workers: int, optional
+    :param rejects: CSV file for the rejected rows, --rejects argument, defaults to <file>.rejects.csv
+    :type rejects: str, optional
+    :param resume: continue interrupted import, -r or --resume flag, defaults to False
+    :type resume: bool, optional
+    """
+    file_format = file_format or ("ndjson" if source.endswith((".ndjson", ".jsonl")) else "csv")
+    rejects = rejects or source + ".rejects.csv"
+    checkpoint = source + ".checkpoint"
+    if os.path.exists(checkpoint) and not resume:
+        print("Import of {0} was interrupted. Use --resume to continue it.".format(source))
+        return
+
+    done = 0
+    if resume and os.path.exists(checkpoint):
+        with open(checkpoint) as checkpoint_file:
+            done = int(checkpoint_file.read())
+
+    hasher = PasswordHasher(current_app.config["PASSWORD_HASH_METHOD"], workers=workers)
+    start, imported, rejected = default_timer(), 0, 0
+    new_rejects = not done or not os.path.exists(rejects)
     try:
-        # If everything is okay - payment cards will be added to the database
-        App.db.session.commit()
-        print("Successfully created. Card codes: {0}".format(card_codes_list))
-    except IntegrityError:
-        # If there is troubles with saving to database
-        print("Cards already exists.")
+        with open(rejects, "w" if new_rejects else "a", newline="") as rejects_file:
+            writer = csv.writer(rejects_file)
+            if new_rejects:
+                writer.writerow(("line", "username", "errors"))
+
+            rows = islice(_read_users(source, file_format), done, None)
+            for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+                chunk_imported, chunk_rejects = _import_users(chunk, hasher)
+                # the chunk is committed, the rejects and the checkpoint follow it
+                writer.writerows(chunk_rejects)
+                rejects_file.flush()
+                done, imported, rejected = done + len(chunk), imported + chunk_imported, rejected + len(chunk_rejects)
+                _save_checkpoint(checkpoint, done)
+
+                elapsed = default_timer() - start
+                print(
+                    "Processed {0} rows: imported {1}, rejected {2} ({3:.0f} rows/s)".format(
+                        done, imported, rejected, (imported + rejected) / elapsed if elapsed else 0
+                    )
+                )
+    except ValueError as e:
+        print("Unable to import: {0}. Use --resume to continue after the error is fixed.".format(e))
+        return
+    finally:
+        hasher.shutdown()
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    print(
+        "Successfully imported {0} users in {1:.2f}s, rejected {2}. Rejected rows: {3}".format(
+            imported, default_timer() - start, rejected, rejects
+        )
+    )
+
+
+def _read_users(source, file_format):
+    """
+    Yields line number and row of the file one by one. Broken rows are yielded as error messages
+    :param source: CSV file with a header or NDJSON file
+    :type source: str
+    :param file_format: 'csv' or 'ndjson'
+    :type file_format: str
+    """
+    with open(source, newline="" if file_format == "csv" else None) as source_file:
+        if file_format == "csv":
+            reader = csv.DictReader(source_file)
+            for row in reader:
+                # empty cells are missing values
+                yield reader.line_num, {key: value for key, value in row.items() if key and value}
+            return
+
+        for line_num, line in enumerate(source_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else "Invalid JSON object."
+
+
+def _import_users(chunk, hasher, retry=True) -> tuple:
+    """
+    Validates rows, checks uniqueness of usernames and phones with a few queries and inserts valid users
+    with one executemany statement. Passwords are hashed in parallel by the hasher.
+    Returns number of imported users and the rejects: (line number, username, errors) tuples.
+    :param chunk: list of line number and row pairs
+    :type chunk: list
+    :param hasher: password hasher with a pool of processes
+    :type hasher: class:'PasswordHasher'
+    :param retry: check the chunk again if some users were registered concurrently, defaults to True
+    :type retry: bool, optional
+    :raises ValueError: the ip pool is exhausted or unable to save changes to the database
+    """
+    schema = RegisterSchema(unknown=EXCLUDE)
+    valid, rejects = [], []
+    for line_num, row in chunk:
+        errors = schema.validate(row) if isinstance(row, dict) else {"_schema": [row]}
+        if errors:
+            rejects.append((line_num, row.get("username") if isinstance(row, dict) else None, json.dumps(errors)))
+        else:
+            valid.append((line_num, row))
+
+    for field in ("username", "phone"):
+        taken = _existing_values(getattr(User, field), [row[field] for _, row in valid])
+        unique = []
+        for line_num, row in valid:
+            if row[field] in taken:
+                rejects.append((line_num, row["username"], json.dumps({field: ["Already exists."]})))
+            else:
+                taken.add(row[field])  # the next rows of the file can't use it too
+                unique.append((line_num, row))
+        valid = unique
+
+    if valid:
+        session = App.db.session
+        hashes = hasher.hash_many([row["password"] for _, row in valid])
+        try:
+            ips, created_at = reserve_ips(len(valid)), datetime.utcnow()
+            session.execute(
+                User.__table__.insert(),
+                [
+                    dict(
+                        uuid=generate_uuid(),
+                        created_at=created_at,
+                        username=row["username"],
+                        password_hash=password_hash,
+                        name=row["name"],
+                        email=row.get("email"),
+                        phone=row["phone"],
+                        address=row["address"],
+                        tariff=row["tariff"],
+                        ip=ip,
+                        state=State.deactivated_state.value,
+                        balance=0,
+                        role=Role.user_role.value,
+                        suspended=False,
+                    )
+                    for (_, row), password_hash, ip in zip(valid, hashes, ips)
+                ],
+            )
+            increment(session.connection(), num_users=len(valid))
+            session.commit()
+        except IntegrityError as import_err:  # users were registered concurrently after the check
+            session.rollback()
+            if not retry:
+                raise ValueError("Unable to import users: {0}".format(import_err)) from import_err
+            return _import_users(chunk, hasher, retry=False)
+        except Exception as import_err:
+            session.rollback()
+            raise ValueError("Unable to import users: {0}".format(import_err)) from import_err
+
+    rejects.sort(key=lambda reject: reject[0])
+    return len(valid), rejects
+
+
+def _save_checkpoint(checkpoint, done) -> None:
+    """Atomically replaces the checkpoint file with the number of processed rows"""
+    with open(checkpoint + ".tmp", "w") as checkpoint_file:
+        checkpoint_file.write(str(done))
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(checkpoint + ".tmp", checkpoint)
@@ -0,0 +1,54 @@
+"""Commands to deactivate debtors"""
+import csv
+from timeit import default_timer
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from module.server.models.user import User
+
+debtors_cli = AppGroup("debtors")
+
+
+@debtors_cli.command("sweep")
+@click.option("-t", "--threshold", type=float, default=None, help="Min balance of the activated account.")
+@click.option("-c", "--chunk-size", type=int, default=None, help="Number of users checked in one transaction.")
+@click.option(
+    "-o",
+    "--output",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="CSV file to which uuids of the changed users are written.",
+)
+def sweep(threshold, chunk_size, output):
+    """
+    Deactivates activated users whose balance is less than the threshold
+    and reactivates users deactivated by the previous sweeps whose debt was paid
+
+    :param threshold: min balance of the activated account, -t or --threshold argument,
+        defaults to the 'DEBT_THRESHOLD' config value
+    :type threshold: float, optional
+    :param chunk_size: number of users checked in one transaction, -c or --chunk-size argument,
+        defaults to the 'SWEEP_CHUNK_SIZE' config value
+    :type chunk_size: int, optional
+    :param output: CSV file for uuids of the changed users, -o or --output argument, defaults to None (not written)
+    :type output: str, optional
+    """
+    threshold = current_app.config["DEBT_THRESHOLD"] if threshold is None else threshold
+    start = default_timer()
+    try:
+        summary = User.sweep_debtors(threshold, chunk_size or current_app.config["SWEEP_CHUNK_SIZE"])
+    except ValueError as e:
+        print("Unable to sweep: {0}".format(e))
+        return
+
+    if output:
+        with open(output, "w", newline="") as output_file:
+            writer = csv.writer(output_file)
+            writer.writerow(("uuid", "action"))
+            for action, uuids in summary.items():
+                writer.writerows((uuid, action) for uuid in uuids)
+    print(
+        "Deactivated: {0}, reactivated: {1}. {2:.1f}s".format(
+            len(summary["deactivated"]), len(summary["reactivated"]), default_timer() - start
+        )
+    )
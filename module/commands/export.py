@@ -0,0 +1,58 @@
+"""Commands to export users and payment history"""
+import click
+from flask.cli import AppGroup
+from module.server.models.user import State, Tariffs
+from module.server.exports import users_query, history_query, iter_export
+
+export_cli = AppGroup("export")
+
+
+def export_options(command):
+    """Adds options shared by the export commands"""
+    options = (
+        click.option(
+            "-o", "--output", default="-", type=click.File("w"), help="Output file. Defaults to the standard output."
+        ),
+        click.option("-f", "--format", "file_format", type=click.Choice(["csv", "ndjson"]), default="csv"),
+        click.option("-s", "--state", type=click.Choice([s.value for s in State]), default=None),
+        click.option("-t", "--tariff", type=click.Choice([t.value["tariff_name"] for t in Tariffs]), default=None),
+        click.option("--from", "date_from", type=click.DateTime(["%Y-%m-%d"]), default=None),
+        click.option("--to", "date_to", type=click.DateTime(["%Y-%m-%d"]), default=None),
+    )
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def _export(query_factory, output, file_format, state, tariff, date_from, date_to) -> None:
+    """Streams rows of the query to the output"""
+    query = query_factory(
+        state=state,
+        tariff=tariff,
+        date_from=date_from and date_from.date(),
+        date_to=date_to and date_to.date(),
+    )
+    for text in iter_export(query, file_format):
+        output.write(text)
+
+
+@export_cli.command("users")
+@export_options
+def users(**options):
+    """
+    Streams users as CSV (with a header) or NDJSON.
+    Options: -o/--output file, -f/--format 'csv' or 'ndjson', -s/--state and -t/--tariff of the users,
+    --from and --to dates (YYYY-MM-DD, inclusive) of the registration
+    """
+    _export(users_query, **options)
+
+
+@export_cli.command("history")
+@export_options
+def history(**options):
+    """
+    Streams payments history as CSV (with a header) or NDJSON.
+    Options: -o/--output file, -f/--format 'csv' or 'ndjson', -s/--state and -t/--tariff of the users,
+    --from and --to dates (YYYY-MM-DD, inclusive) of the payment
+    """
+    _export(history_query, **options)
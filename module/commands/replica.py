@@ -0,0 +1,33 @@
+"""Command to keep the SQLite replica in sync with the primary database"""
+from time import sleep
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from module import App
+from module.server.replica import REPLICA_BIND, copy_database
+
+replica_cli = AppGroup("replica")
+
+
+def sqlite_path(engine) -> str:
+    """Returns path of the SQLite database file of the engine"""
+    if engine.url.drivername != "sqlite" or not engine.url.database or engine.url.database == ":memory:":
+        raise click.ClickException("Only SQLite file databases can be synced, got '{0}'.".format(engine.url))
+    return engine.url.database
+
+
+@replica_cli.command("sync")
+@click.option("--once", is_flag=True, help="Copy the database once and exit.")
+def sync(once):
+    """Copies the primary database to the replica every REPLICA_SYNC_INTERVAL seconds with the SQLite backup API"""
+    app = current_app._get_current_object()
+    if not app.config["REPLICA_DATABASE_URL"]:
+        raise click.ClickException("REPLICA_DATABASE_URL isn't set.")
+    source = sqlite_path(App.db.get_engine(app))
+    target = sqlite_path(App.db.get_engine(app, bind=REPLICA_BIND))
+    while True:
+        copy_database(source, target)
+        if once:
+            break
+        sleep(app.config["REPLICA_SYNC_INTERVAL"])
+    click.echo("Replica is synced.")
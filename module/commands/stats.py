@@ -0,0 +1,20 @@
+"""Commands to maintain the admin dashboard counters"""
+from flask.cli import AppGroup
+from module.server.models.stats import Stats, COUNTERS
+
+stats_cli = AppGroup("stats")
+
+
+@stats_cli.command("check")
+def check():
+    """Compares stored dashboard counters with the actual data and rebuilds them from scratch"""
+    stored = {row.name: row.value for row in Stats.query}
+    actual = Stats.rebuild()
+
+    drifted = [name for name in COUNTERS if stored.get(name) != actual[name]]
+    for name in drifted:
+        print("{0}: stored {1}, actual {2}".format(name, stored.get(name), actual[name]))
+    if drifted:
+        print("Counters were rebuilt.")
+    else:
+        print("Counters are consistent.")
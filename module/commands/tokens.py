@@ -0,0 +1,12 @@
+"""Commands to maintain JWT tokens"""
+from flask.cli import AppGroup
+from module.server.models.jwt_tokens import TokenBlocklist
+
+tokens_cli = AppGroup("tokens")
+
+
+@tokens_cli.command("purge")
+def purge():
+    """Deletes blocklist rows of the tokens which have already expired"""
+    deleted = TokenBlocklist.purge_expired()
+    print("Successfully purged. Deleted tokens: {0}".format(deleted))
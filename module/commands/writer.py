@@ -0,0 +1,16 @@
+"""Command to run the writer process of the write queue"""
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from module import App
+from module.server.writer import run_writer
+
+writer_cli = AppGroup("writer")
+
+
+@writer_cli.command("serve")
+def serve():
+    """Applies the writes of all workers until the process is stopped, the socket is set by WRITE_QUEUE_ADDRESS"""
+    if not current_app.config["WRITE_QUEUE_ADDRESS"]:
+        raise click.ClickException("WRITE_QUEUE_ADDRESS isn't set.")
+    run_writer(current_app._get_current_object(), App.db)
@@ -4,14 +4,64 @@ Available on http://host:port.
 WARNING: don't use this file in production
 """
 import os
+import multiprocessing
 from sys import platform
 from flask import Flask
+from module import App
 from module.app import app
+from module.server.metrics import MetricsStore
+from module.server.writer import run_writer
 
 this_files_dir = os.path.dirname(os.path.abspath(__file__))
 os.chdir(this_files_dir)
 
+
+def number_of_workers():
+    """Calculate number of workers"""
+    return (multiprocessing.cpu_count() * 2) + 1
+
+
+if platform != "win32":
+    from gunicorn.app.base import BaseApplication
+
+    class StandaloneApplication(BaseApplication):
+        """
+        Application to deploy with gunicorn
+
+        Parameters:
+        app (Flask): Flask application
+        options (dict): additional arguments
+
+        :param flask_app: Flask application
+        :type flask_app: Flask
+        :param options: additional arguments, defaults to None
+        :type options: dict, optional
+        """
+
+        def __init__(self, flask_app, options=None):
+            self.options = options or {}
+            self.application = flask_app
+            super().__init__()
+
+        def load_config(self) -> None:
+            """Set options"""
+            config = {
+                key: value for key, value in self.options.items() if key in self.cfg.settings and value is not None
+            }
+            for key, value in config.items():
+                self.cfg.set(key.lower(), value)
+
+        def load(self) -> "Flask":
+            """Returns flask application"""
+            return self.application
+
+
 if __name__ == "__main__":
+    MetricsStore(app.config["METRICS_DIR"]).clear()  # metrics of the previous run
+
+    if app.config["WRITE_QUEUE_ADDRESS"]:  # writes of all workers are applied by this process
+        multiprocessing.Process(target=run_writer, args=(app, App.db), daemon=True).start()
+
     if platform == "win32":
         from waitress import serve
 
@@ -20,44 +70,6 @@ if __name__ == "__main__":
         print("Application startup on http://{0}:{1}".format(host, port))
         serve(app, host=host, port=port)  # http://127.0.0.1:8001
     elif platform != "win32":
-        import multiprocessing
-        from gunicorn.app.base import BaseApplication
-
-        def number_of_workers():
-            """Calculate number of workers"""
-            return (multiprocessing.cpu_count() * 2) + 1
-
-        class StandaloneApplication(BaseApplication):
-            """
-            Application to deploy with gunicorn
-
-            Parameters:
-            app (Flask): Flask application
-            options (dict): additional arguments
-
-            :param flask_app: Flask application
-            :type flask_app: Flask
-            :param options: additional arguments, defaults to None
-            :type options: dict, optional
-            """
-
-            def __init__(self, flask_app, options=None):
-                self.options = options or {}
-                self.application = flask_app
-                super().__init__()
-
-            def load_config(self) -> None:
-                """Set options"""
-                config = {
-                    key: value for key, value in self.options.items() if key in self.cfg.settings and value is not None
-                }
-                for key, value in config.items():
-                    self.cfg.set(key.lower(), value)
-
-            def load(self) -> "Flask":
-                """Returns flask application"""
-                return self.application
-
         custom_options = {
             "bind": "%s:%s" % ("127.0.0.1", "8080"),
             "workers": number_of_workers(),
@@ -0,0 +1,17 @@
+"""Authorization helpers based on the access token claims"""
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from module.server.models.user import Role
+
+
+def is_admin() -> bool:
+    """Returns True if the current access token belongs to the admin"""
+    return get_jwt().get("role") == Role.admin_role.value
+
+
+def is_owner_or_admin(uuid) -> bool:
+    """
+    Returns True if the current access token belongs to the account owner or the admin
+    :param uuid: uuid of the account
+    :type uuid: str
+    """
+    return get_jwt_identity() == uuid or is_admin()
@@ -0,0 +1,33 @@
+"""Helpers for conditional GET requests validated with entity tags"""
+from flask import Response, request
+from werkzeug.http import quote_etag
+
+
+def make_etag(*parts) -> str:
+    """
+    Returns entity tag (without quotes) of the representation, e.g. made of the version of the row
+    :param '*parts': values which change whenever the representation changes
+    """
+    return "-".join(str(part) for part in parts)
+
+
+def cache_headers(etag) -> dict:
+    """
+    Returns headers of the response with the representation: the client may cache it, but has to revalidate it
+    on every request. The representation depends on the access token, so the cache is private
+    :param etag: entity tag of the representation
+    :type etag: str
+    """
+    return {"ETag": quote_etag(etag, weak=True), "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+
+
+def not_modified(etag) -> "Response":
+    """
+    Returns '304 Not Modified' response if the client already has the representation (If-None-Match),
+    otherwise None. The response has no body, so nothing is loaded from the database or serialized.
+    :param etag: entity tag of the current representation
+    :type etag: str
+    """
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=cache_headers(etag))
+    return None
@@ -8,7 +8,13 @@ from module.server.api.resources.user import (
     UserHistoryResource,
     TokenRefresh,
 )
-from module.server.api.resources.admin import AdminToolsResource
+from module.server.api.resources.admin import (
+    AdminToolsResource,
+    AdminBatchResource,
+    DebtorsSweepResource,
+    ExportResource,
+    SearchResource,
+)
 
 
 api = Api(prefix="/api/v1")
@@ -19,3 +25,7 @@ api.add_resource(UsersResource, "/users", endpoint="api_users")
 api.add_resource(UserResource, "/users/<uuid>", endpoint="api_user_details")
 api.add_resource(UserHistoryResource, "/users/<uuid>/history", endpoint="api_user_history")
 api.add_resource(AdminToolsResource, "/admin/users/<uuid>", endpoint="api_admin_tools")
+api.add_resource(AdminBatchResource, "/admin/users:batch", endpoint="api_admin_batch")
+api.add_resource(DebtorsSweepResource, "/admin/debtors/sweep", endpoint="api_debtors_sweep")
+api.add_resource(ExportResource, "/admin/export/<collection>", endpoint="api_export")
+api.add_resource(SearchResource, "/admin/search", endpoint="api_search")
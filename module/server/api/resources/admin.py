@@ -1,10 +1,22 @@
 """Resource for admin tools"""
-from flask import request
+from flask import request, current_app, url_for, Response, stream_with_context
 from flask_restful import Resource
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from module.server import messages
 from module.server.models.user import User
-from module.server.api.schemas.admin import AdminChoiceSchema
+from module.server.models.search import search_users_page
+from module.server.api.schemas.admin import (
+    AdminChoiceSchema,
+    BatchItemSchema,
+    BatchSchema,
+    SweepSchema,
+    ExportSchema,
+)
+from module.server.api.schemas.pagination import SearchSchema
+from module.server.api.schemas.user import SearchUserSchema
+from module.server.api.schemas.base import get_sparse_schema
+from module.server.exports import FORMATS, users_query, history_query, iter_export
+from module.server.api.auth import is_admin
 
 
 class AdminToolsResource(Resource):
@@ -36,8 +48,7 @@ class AdminToolsResource(Resource):
     @jwt_required(fresh=True)
     def post(self, uuid):
         """Work with user account"""
-        curr_user = User.get_by_uuid(get_jwt_identity())
-        if curr_user.username != "admin":  # if current is not admin
+        if not is_admin():  # if current is not admin
             return {"message": messages["access_denied"]}, 403
 
         data = AdminChoiceSchema().load(request.get_json())
@@ -56,3 +67,202 @@ class AdminToolsResource(Resource):
                 return {"message": messages["success"]}, 200
             except Exception as e:
                 return {"message": messages["failure"] + " Error: {0}".format(e)}, 500
+
+
+class AdminBatchResource(Resource):
+    """
+    post:
+    summary: work with many user accounts at once. Available choices: ['activate', 'deactivate', 'delete']
+    parameters:
+        path: /api/v1/admin/users:batch
+        schema: BatchSchema, items: BatchItemSchema
+    responses:
+        '200':
+            description: results of the items, every result has the HTTP status of the item:
+                200 - applied, 400 - invalid or repeated item, 404 - user not found, 500 - error saving to database
+            content:
+                application/json
+        '400':
+            description: missing or too many items
+            content:
+                application/json
+        '403':
+            description: current user is not admin
+            content:
+                application/json
+    """
+
+    @jwt_required(fresh=True)
+    def post(self):
+        """Work with many user accounts. Items are applied in chunks, every chunk in one transaction"""
+        if not is_admin():  # if current is not admin
+            return {"message": messages["access_denied"]}, 403
+
+        items = BatchSchema().load(request.get_json())["items"]
+        item_schema = BatchItemSchema()
+        results, valid, seen = [], [], set()
+        for item in items:
+            errors = item_schema.validate(item) if isinstance(item, dict) else {"_schema": ["Invalid item."]}
+            if not errors and item["uuid"] in seen:
+                errors = {"uuid": ["Repeated uuid."]}
+            result = dict(uuid=item.get("uuid") if isinstance(item, dict) else None, status=400, errors=errors)
+            if not errors:
+                seen.add(item["uuid"])
+                result = dict(uuid=item["uuid"], choice=item["choice"])
+                valid.append(result)
+            results.append(result)
+
+        chunk_size = current_app.config["API_BATCH_CHUNK_SIZE"]
+        for start in range(0, len(valid), chunk_size):
+            chunk = valid[start : start + chunk_size]
+            try:
+                found = User.apply_choices([(result["uuid"], result["choice"]) for result in chunk])
+            except ValueError as e:
+                for result in chunk:
+                    result.update(status=500, message=messages["failure"] + " Error: {0}".format(e))
+                continue
+            for result in chunk:
+                if result["uuid"] in found:
+                    result.update(status=200, message=messages["success"])
+                else:
+                    result.update(status=404, message=messages["user_not_found"])
+        return {"results": results}, 200
+
+
+class DebtorsSweepResource(Resource):
+    """
+    post:
+    summary: deactivates debtors and reactivates users whose debt was paid
+    parameters:
+        path: /api/v1/admin/debtors/sweep
+        schema: SweepSchema
+    responses:
+        '200':
+            description: uuids of the deactivated and the reactivated users
+            content:
+                application/json
+        '400':
+            description: wrong arguments
+            content:
+                application/json
+        '403':
+            description: current user is not admin
+            content:
+                application/json
+        '500':
+            description: error saving to database
+            content:
+                application/json
+    """
+
+    @jwt_required(fresh=True)
+    def post(self):
+        """Deactivates debtors and reactivates users whose debt was paid"""
+        if not is_admin():  # if current is not admin
+            return {"message": messages["access_denied"]}, 403
+
+        data = SweepSchema().load(request.get_json(silent=True) or {})
+        try:
+            summary = User.sweep_debtors(
+                threshold=data.get("threshold", current_app.config["DEBT_THRESHOLD"]),
+                chunk_size=current_app.config["SWEEP_CHUNK_SIZE"],
+            )
+        except ValueError as e:
+            return {"message": messages["failure"] + " Error: {0}".format(e)}, 500
+        return summary, 200
+
+
+class ExportResource(Resource):
+    """
+    get:
+    summary: streams all users or payments history. Available collections: ['users', 'history']
+    parameters:
+        path: /api/v1/admin/export/<collection>
+        query: format, state, tariff, from, to (see ExportSchema)
+    responses:
+        '200':
+            description: rows are streamed as CSV with a header or as newline delimited json
+            content:
+                text/csv
+                application/x-ndjson
+        '400':
+            description: invalid parameters
+            content:
+                application/json
+        '403':
+            description: current user is not admin
+            content:
+                application/json
+        '404':
+            description: unknown collection
+            content:
+                application/json
+    """
+
+    queries = dict(users=users_query, history=history_query)
+
+    @jwt_required()
+    def get(self, collection):
+        """Streams the collection"""
+        if not is_admin():  # if current is not admin
+            return {"message": messages["access_denied"]}, 403
+        if collection not in self.queries:
+            return {"message": "Unknown collection."}, 404
+
+        params = ExportSchema().load(request.args)
+        file_format = params.pop("format")
+        rows = iter_export(self.queries[collection](**params), file_format)
+        return Response(
+            stream_with_context(rows),
+            mimetype=FORMATS[file_format],
+            headers={"Content-Disposition": "attachment; filename={0}.{1}".format(collection, file_format)},
+        )
+
+
+class SearchResource(Resource):
+    """
+    get:
+    summary: searches users by fragments of the username, name, phone, email or address
+    parameters:
+        path: /api/v1/admin/search
+        query: q, limit, offset, fields, links (see SearchSchema)
+        schema: SearchUserSchema
+    responses:
+        '200':
+            description: page of the users from the most to the least relevant,
+                url of the next page is in the 'Link' header. Only the first 'SEARCH_MAX_CANDIDATES' matches
+                are ranked: their number is in the 'X-Total-Count' header, 'X-Search-Truncated' is 'true'
+                if there are more matches and the search text should be refined
+            content:
+                application/json
+        '400':
+            description: invalid parameters
+            content:
+                application/json
+        '403':
+            description: current user is not admin
+            content:
+                application/json
+    """
+
+    @jwt_required()
+    def get(self):
+        """Returns page of the search results"""
+        if not is_admin():  # if current is not admin
+            return {"message": messages["access_denied"]}, 403
+
+        params = SearchSchema().load(request.args)
+        schema = get_sparse_schema(SearchUserSchema, params.get("only"), params["links"], many=True)
+        # one extra user shows if there is the next page
+        users, total, truncated = search_users_page(
+            params["q"],
+            limit=params["limit"],
+            offset=params["offset"],
+            max_candidates=current_app.config["SEARCH_MAX_CANDIDATES"],
+        )
+
+        headers = {"X-Total-Count": str(total), "X-Search-Truncated": "true" if truncated else "false"}
+        if params["offset"] + params["limit"] < total:
+            args = dict(request.args, offset=params["offset"] + params["limit"])
+            headers["Link"] = '<{0}>; rel="next"'.format(url_for("api_search", _external=True, **args))
+        return schema.dump(users), 200, headers
@@ -1,5 +1,5 @@
 """Resource to work with user"""
-from flask import request
+from flask import request, url_for
 from flask_restful import Resource
 from flask_jwt_extended import (
     jwt_required,
@@ -11,8 +11,7 @@ from flask_jwt_extended import (
 )
 from module.server import messages
 from module.server.models.user import User
-from module.server.models.payment_cards import Card
-from module.server.models.jwt_tokens import TokenBlocklist
+from module.server.models.jwt_tokens import revoke_token
 from module.server.api.schemas.user import (
     LoginSchema,
     RegisterSchema,
@@ -20,6 +19,12 @@ from module.server.api.schemas.user import (
     FullUserInfoSchema,
 )
 from module.server.api.schemas.payment_cards import UsedCardSchema, InputCardSchema
+from module.server.api.schemas.pagination import FieldsSchema, PaginationSchema, HistoryPaginationSchema
+from module.server.api.schemas.base import get_schema, get_sparse_schema
+from module.server.api.streaming import ndjson_response
+from module.server.api.conditional import make_etag, cache_headers, not_modified
+from module.server.api.auth import is_admin, is_owner_or_admin
+from module.server.replica import read_replica
 
 
 class UserAuthResource(Resource):
@@ -42,6 +47,10 @@ class UserAuthResource(Resource):
                  description: user doesn't exist or password doesn't match
                  content:
                     application/json
+            '503':
+                 description: all password hashing slots are busy
+                 content:
+                    application/json
     post:
         summary: creates and saves to the database new user
         parameters:
@@ -78,8 +87,14 @@ class UserAuthResource(Resource):
 
         user = User.get_user_by_username(login)
 
-        if user and user.check_password(password):  # if login and password from the request match - return access_token
-            access_token = create_access_token(identity=user.uuid, fresh=True)
+        try:
+            password_matches = user is not None and user.check_password(password)
+        except RuntimeError:  # all password hashing slots are busy
+            return {"message": messages["service_busy"]}, 503
+
+        if password_matches:  # if login and password from the request match - return access_token
+            # the role is embedded into the token, so authorization doesn't require loading the user
+            access_token = create_access_token(identity=user.uuid, fresh=True, additional_claims=user.get_claims())
             refresh_token = create_refresh_token(user.uuid)
             decoded = decode_token(access_token)
             return {
@@ -95,12 +110,14 @@ class UserAuthResource(Resource):
     def post(self):
         """Creates new user and save it to the database. Available only for admin"""
 
-        curr_user = User.get_by_uuid(get_jwt_identity())
-        if curr_user.username != "admin":
+        if not is_admin():
             return {"message": messages["access_denied"]}, 403
 
         data = request.get_json()
-        user = RegisterSchema().load(data)
+        try:
+            user = RegisterSchema().load(data)  # the ip of the new user is reserved from the pool here
+        except ValueError as e:  # ip pool is exhausted
+            return {"message": messages["failure"] + " Error - {0}".format(e)}, 500
 
         if User.get_user_by_username(data["username"]):
             return {"message": "This user already exists."}, 400
@@ -132,11 +149,7 @@ class LogoutUser(Resource):
     @jwt_required()
     def post(self):
         """Logout user. The user must be logged in first."""
-        jti = get_jwt()["jti"]
-        user = User.get_by_uuid(get_jwt_identity())
-
-        token = TokenBlocklist(user_id=user.id, jti=jti, reason="Logout")
-        token.save_to_db()
+        revoke_token(User.get_id_by_uuid(get_jwt_identity()), get_jwt(), reason="Logout")
         return {"message": messages["success"]}, 200
 
 
@@ -146,10 +159,17 @@ class UserResource(Resource):
         summary: returns user info
         parameters:
             path: /api/v1/users/<uuid>
+            query: fields, links (see FieldsSchema)
             schemas: AdminUserInfoSchema, FullUserInfoSchema
         responses:
             '200':
-                description: json representation of the user was returned
+                description: json representation of the user was returned, its version is in the 'ETag' header
+                content:
+                    application/json
+            '304':
+                description: the user wasn't changed since the version from the 'If-None-Match' header
+            '400':
+                description: unknown fields were requested
                 content:
                     application/json
             '403':
@@ -181,32 +201,47 @@ class UserResource(Resource):
     """
 
     @jwt_required()
+    @read_replica
     def get(self, uuid: str):
         """Returns info about user"""
-        curr_user = User.get_by_uuid(get_jwt_identity())
-        if curr_user.username != "admin" and curr_user.uuid != uuid:
+        if not is_owner_or_admin(uuid):
             # if current user is not admin or account owner return 403
             return {"message": messages["access_denied"]}, 403
 
-        user_schema = AdminUserInfoSchema() if curr_user.username == "admin" else FullUserInfoSchema()
+        params = FieldsSchema().load(request.args)
+        version = User.get_version(uuid)
+        if version is None:  # if uuid is wrong return 404
+            return {"message": messages["user_not_found"]}, 404
 
+        # admin and account owner get different representations of the user
+        viewer = "admin" if is_admin() else "owner"
+        response = not_modified(make_etag(viewer, version))
+        if response:  # the client has the current version, the user isn't loaded
+            return response
+
+        schema_class = AdminUserInfoSchema if viewer == "admin" else FullUserInfoSchema
+        user_schema = get_sparse_schema(schema_class, params.get("only"), params["links"])
         user = User.get_by_uuid(uuid)
         if user:
-            return user_schema.dump(user), 200
-        return {"message": messages["user_not_found"]}, 404  # if uuid is wrong return 404
+            return user_schema.dump(user), 200, cache_headers(make_etag(viewer, user.version))
+        return {"message": messages["user_not_found"]}, 404  # the user was deleted by a concurrent request
 
     @jwt_required()
     def post(self, uuid: str):
         """Use card"""
-        curr_user = User.get_by_uuid(get_jwt_identity())
-        if curr_user.uuid != uuid:  # if current user is not account owner return 403
+        if get_jwt_identity() != uuid:  # if current user is not account owner return 403
             return {"message": messages["access_denied"]}, 403
 
         data = InputCardSchema().load(request.get_json())
+        curr_user = User.get_by_uuid(uuid)
+        if not curr_user:  # the account was deleted after the token was issued
+            return {"message": messages["user_not_found"]}, 404
 
-        if Card.get_card_by_code(data["code"]):  # if card code is correct - replenish user account
-            curr_user.use_card(data["code"])
-            return {"message": messages["card_success_code"]}, 200
+        try:
+            if curr_user.use_card(data["code"]):  # if card code is correct - replenish user account
+                return {"message": messages["card_success_code"]}, 200
+        except ValueError as e:
+            return {"message": messages["failure"] + " Error - {0}".format(e)}, 500
         return {"message": messages["card_wrong_code"]}, 404  # if card code is wrong return 404
 
 
@@ -215,11 +250,20 @@ class UserHistoryResource(Resource):
     get:
         summary: returns user payment history
         parameters:
-            path: /api/v1/users/<uuid>
+            path: /api/v1/users/<uuid>/history
+            query: limit, before, after, from, to, fields (see HistoryPaginationSchema)
             schema: UsedCardSchema
         responses:
             '200':
-                description: user payment history was returned
+                description: page of the user payment history (from newest to oldest) was returned,
+                    urls of the older (rel="next") and newer (rel="prev") pages are in the 'Link' header,
+                    version of the history is in the 'ETag' header
+                content:
+                    application/json
+            '304':
+                description: no payments were made since the version from the 'If-None-Match' header
+            '400':
+                description: invalid pagination parameters
                 content:
                     application/json
             '404':
@@ -229,15 +273,53 @@ class UserHistoryResource(Resource):
     """
 
     @jwt_required()
+    @read_replica
     def get(self, uuid: str):
         """Returns user payment history(This route is not protected: each user can see the story of another)"""
+        version = User.get_history_version(uuid)
+        if version is None:  # if uuid is wrong return 404
+            return {"message": messages["user_not_found"]}, 404
+
+        params = HistoryPaginationSchema().load(request.args)
+        # the page depends on the query string as well, but it is a part of the url the client caches
+        etag = make_etag(version)
+        response = not_modified(etag)
+        if response:  # the client has the current version, the history isn't loaded
+            return response
+
         curr_user = User.get_by_uuid(uuid)
-        used_cards_schema = UsedCardSchema(many=True)
+        used_cards_schema = get_sparse_schema(UsedCardSchema, params.pop("only", None), params.pop("links"), many=True)
 
         if curr_user:  # if uuid is correct return history
-            history = curr_user.get_history()
-            return used_cards_schema.dump(history), 200
-        return {"message": messages["user_not_found"]}, 404  # otherwise return 404
+            limit = params.pop("limit")
+            # one extra row shows if there are more rows in the direction of the pagination
+            history = curr_user.get_history(limit=limit + 1, **params)
+
+            links = []  # (rel, cursor, id)
+            if "after" in params:  # newer rows were requested, the extra row is the newest one
+                if len(history) > limit:
+                    history = history[1:]
+                    links.append(("prev", "after", history[0].id))
+                if history:
+                    links.append(("next", "before", history[-1].id))
+            else:  # older rows were requested, the extra row is the oldest one
+                if len(history) > limit:
+                    history = history[:-1]
+                    links.append(("next", "before", history[-1].id))
+                if "before" in params and history:
+                    links.append(("prev", "after", history[0].id))
+
+            args = {key: value for key, value in request.args.items() if key not in ("before", "after")}
+            link = ", ".join(
+                '<{0}>; rel="{1}"'.format(
+                    url_for("api_user_history", uuid=uuid, _external=True, **args, **{cursor: id_}), rel
+                )
+                for rel, cursor, id_ in links
+            )
+            # payments made after the version was read could be on the page, so the client will revalidate it
+            headers = dict(cache_headers(etag), **({"Link": link} if link else {}))
+            return used_cards_schema.dump(history), 200, headers
+        return {"message": messages["user_not_found"]}, 404  # the user was deleted by a concurrent request
 
 
 class UsersResource(Resource):
@@ -246,25 +328,46 @@ class UsersResource(Resource):
         summary: returns list of user or user info if user is not admin
         parameters:
             path: /api/v1/users
+            query: limit, after, format, fields, links (see PaginationSchema)
             schema: AdminUserInfoSchema, FullUserInfoSchema
         responses:
             '200':
-                description: json list of users was returned
+                description: json list of users (one page, ordered by id) was returned,
+                    url of the next page is in the 'Link' header. With format=ndjson all users after
+                    the cursor are streamed line by line
+                content:
+                    application/json
+                    application/x-ndjson
+            '400':
+                description: invalid pagination parameters
                 content:
                     application/json
     """
 
     @jwt_required()
+    @read_replica
     def get(self):
         """Returns list of users if current user is admin, else user's account info"""
-        curr_user = User.get_by_uuid(get_jwt_identity())
-        if curr_user.username == "admin":  # if current user is admin show common user information(AdminUserInfoSchema)
-            users_schema = AdminUserInfoSchema(many=True)
-            all_users = User.query.all()
-            return users_schema.dump(all_users), 200
+        if is_admin():  # if current user is admin show common user information(AdminUserInfoSchema)
+            params = PaginationSchema().load(request.args)
+            schema = get_sparse_schema(AdminUserInfoSchema, params.get("only"), params["links"], many=True)
+            users = User.query.filter(User.id > params["after"]).order_by(User.id)
+
+            if params["format"] == "ndjson":  # stream every user after the cursor
+                return ndjson_response(users, schema)
+
+            page = users.limit(params["limit"] + 1).all()
+            headers = dict()
+            if len(page) > params["limit"]:  # there is at least one more page
+                page = page[:-1]
+                args = dict(request.args, after=page[-1].id, limit=params["limit"])
+                headers["Link"] = '<{0}>; rel="next"'.format(url_for("api_users", _external=True, **args))
+            return schema.dump(page), 200, headers
         else:  # if current user is account owner show full user information(FullUserInfoSchema)
-            user_schema = FullUserInfoSchema()
-            user = curr_user
+            user_schema = get_schema(FullUserInfoSchema)
+            user = User.get_by_uuid(get_jwt_identity())
+            if not user:  # the account was deleted after the token was issued
+                return {"message": messages["user_not_found"]}, 404
             return user_schema.dump(user), 200
 
 
@@ -284,7 +387,12 @@ class TokenRefresh(Resource):
     def post(self):
         """Refresh access token"""
         current_id = get_jwt_identity()
-        new_token = create_access_token(identity=current_id, fresh=False)
+        user = User.get_by_uuid(current_id)
+        if not user:  # the account was deleted after the token was issued
+            return {"message": messages["user_not_found"]}, 404
+
+        # claims are taken from the database, so changes of the role or state are applied on refresh
+        new_token = create_access_token(identity=current_id, fresh=False, additional_claims=user.get_claims())
         new_refresh_token = create_refresh_token(current_id)
         decoded = decode_token(new_token)
         return {
@@ -1,8 +1,55 @@
 """Marshmallow schema for admin tools"""
-from marshmallow import Schema, fields, validate
+from flask import current_app
+from marshmallow import Schema, fields, validate, validates, ValidationError
+from module.server.models.user import State, Tariffs
 
 
 class AdminChoiceSchema(Schema):
     """Scheme to get the administrator's choice"""
 
     choice = fields.Str(required=True, validate=validate.OneOf(["activate", "deactivate", "delete"]))
+
+
+class BatchItemSchema(AdminChoiceSchema):
+    """Scheme to get the administrator's choice for the user with the uuid"""
+
+    uuid = fields.Str(required=True)
+
+
+class BatchSchema(Schema):
+    """
+    Scheme to get the list of the administrator's choices.
+    Items are validated one by one with 'BatchItemSchema', so the invalid items don't reject the whole batch.
+    The number of items is limited by the 'API_BATCH_MAX_SIZE' config value.
+    """
+
+    items = fields.List(fields.Raw(), required=True, validate=validate.Length(min=1))
+
+    @validates("items")
+    def validate_size(self, items):
+        """Limits the number of items"""
+        if len(items) > current_app.config["API_BATCH_MAX_SIZE"]:
+            raise ValidationError("Max number of items is {0}.".format(current_app.config["API_BATCH_MAX_SIZE"]))
+
+
+class SweepSchema(Schema):
+    """
+    Scheme to get parameters of the debtors sweep.
+    Fields: threshold - min balance of the activated account, by default the 'DEBT_THRESHOLD' config value is used
+    """
+
+    threshold = fields.Float()
+
+
+class ExportSchema(Schema):
+    """
+    Scheme to get parameters of the export.
+    Fields: format - 'csv' or 'ndjson', state, tariff - filters by the user, from, to - dates range (inclusive)
+    of the registration (users) or the payment (history)
+    """
+
+    format = fields.Str(missing="csv", validate=validate.OneOf(["csv", "ndjson"]))
+    state = fields.Str(validate=validate.OneOf([s.value for s in State]))
+    tariff = fields.Str(validate=validate.OneOf([t.value["tariff_name"] for t in Tariffs]))
+    date_from = fields.Date(data_key="from")
+    date_to = fields.Date(data_key="to")
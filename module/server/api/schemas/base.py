@@ -0,0 +1,119 @@
+"""Fast serialization of the schemas and shared schema instances"""
+from functools import lru_cache
+from marshmallow import ValidationError, fields, missing
+from module.server.metrics import register_cache
+
+
+def get_loaded_value(obj, key, default=missing):
+    """
+    Returns attribute of the object, loaded values are read from the '__dict__' of the object
+    (where SQLAlchemy keeps the loaded columns), other attributes are read with 'getattr'
+    """
+    value = getattr(obj, "__dict__", {}).get(key, missing)
+    return getattr(obj, key, default) if value is missing else value
+
+
+class FastDumpMixin:
+    """
+    Mixin for the schemas which serializes attributes of the objects with less of the generic machinery.
+    The list of fields is prepared once per schema instance, so the instances should be reused (see 'get_schema').
+    Values are read with 'get_loaded_value', plain strings are dumped as is.
+    Fields with dotted attributes are serialized as usual. Dump processors ('pre_dump', 'post_dump') aren't run.
+    """
+
+    def _dump_plan(self) -> list:
+        """Returns (key, attribute, field, fast, text) for every dumped field"""
+        plan = self.__dict__.get("_fast_dump_plan")
+        if plan is None:
+            plan = []
+            for attr_name, field in self.dump_fields.items():
+                attribute = field.attribute or attr_name
+                default = field.dump_default if hasattr(field, "dump_default") else field.default
+                fast = "." not in attribute
+                text = type(field) is fields.String and default is missing  # strings are dumped as is
+                plan.append((field.data_key or attr_name, attribute, field, fast, text))
+            self._fast_dump_plan = plan
+        return plan
+
+    def dump(self, obj, *, many=None):
+        """
+        Serializes the object or the list of objects (the same as the 'Schema.dump').
+        Fields with the 'prepare_dump' method return a function which serializes the object,
+        it is prepared once for all objects (e.g. url templates of the request are looked up).
+        """
+        many = self.many if many is None else bool(many)
+        plan = self._dump_plan()
+        prepared = dict()
+        for _, attribute, field, fast, _ in plan:
+            prepare_dump = getattr(field, "prepare_dump", None)
+            dump = prepare_dump() if fast and prepare_dump else None
+            if dump:
+                prepared[attribute] = dump
+
+        if many and obj is not None:
+            return [self._dump_object(item, plan, prepared) for item in obj]
+        return self._dump_object(obj, plan, prepared)
+
+    def _dump_object(self, obj, plan, prepared) -> dict:
+        """Serializes a single object"""
+        result = dict()
+        for key, attribute, field, fast, text in plan:
+            if not fast:
+                value = field.serialize(attribute, obj, accessor=self.get_attribute)
+            elif attribute in prepared:
+                value = prepared[attribute](obj)
+            elif text:
+                value = get_loaded_value(obj, attribute)
+                if not (value is missing or value is None or type(value) is str):
+                    value = field.serialize(attribute, obj, accessor=get_loaded_value)
+            else:
+                value = field.serialize(attribute, obj, accessor=get_loaded_value)
+            if value is not missing:
+                result[key] = value
+        return result
+
+
+@lru_cache(maxsize=256)  # sparse fieldsets are chosen by the clients
+def _create_schema(schema_class, many, only):
+    """Returns the schema instance, arguments are always positional, so equal calls share the instance"""
+    return schema_class(many=many, only=only)
+
+
+register_cache("schemas", lambda: _create_schema.cache_info()[:2])
+
+
+def get_schema(schema_class, many=False, only=None):
+    """
+    Returns shared instance of the schema for serialization. Schemas keep no state between dumps,
+    so the instances are created once instead of on every request.
+    :param schema_class: class of the schema
+    :param many: whether the schema serializes lists, defaults to False
+    :type many: bool, optional
+    :param only: names of the serialized fields, defaults to None (all fields)
+    :type only: tuple, optional
+    """
+    return _create_schema(schema_class, bool(many), None if only is None else tuple(only))
+
+
+def get_sparse_schema(schema_class, only=None, links=True, many=False):
+    """
+    Returns shared instance of the schema which serializes only the requested fields (sparse fieldset).
+    :param schema_class: class of the schema
+    :param only: names of the requested fields, defaults to None (all fields)
+    :type only: tuple, optional
+    :param links: whether to serialize '_links', defaults to True
+    :type links: bool, optional
+    :param many: whether the schema serializes lists, defaults to False
+    :type many: bool, optional
+    :raises ValidationError: unknown field names were requested
+    """
+    available = tuple(get_schema(schema_class).dump_fields)
+    if only is None and links:
+        return get_schema(schema_class, many)
+
+    unknown = sorted(set(only or ()) - set(available))
+    if unknown:
+        raise ValidationError({"fields": ["Unknown fields: {0}.".format(", ".join(unknown))]})
+    # fields are kept in the order of the schema, so equal fieldsets share the instance
+    selected = tuple(name for name in available if (only is None or name in only) and (links or name != "_links"))
+    return get_schema(schema_class, many, selected)
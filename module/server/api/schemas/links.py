@@ -0,0 +1,131 @@
+"""Hyperlink fields which build urls from precompiled templates"""
+import re
+from urllib.parse import quote
+from flask import current_app, has_request_context, request, url_for
+from flask_marshmallow.fields import URLFor, Hyperlinks
+from marshmallow import missing
+from module.server.metrics import register_cache
+
+SAFE = "!$&'()*+,/:;=@"  # characters werkzeug leaves unquoted in the url parts
+UNSAFE = re.compile(r"[^A-Za-z0-9_.~\-{0}]".format(re.escape(SAFE)))
+MAX_TEMPLATES = 64  # max number of cached templates of the field
+ATTRIBUTE = re.compile(r"\s*<\s*(\S*)\s*>\s*")  # '<attribute>' values of the arguments, as in 'URLFor'
+
+
+def url_context() -> tuple:
+    """
+    Returns the application and the request (None outside of requests) the URLs are built for.
+    The objects are taken from the proxies once per dump, not on every serialized row.
+    """
+    return current_app._get_current_object(), request._get_current_object() if has_request_context() else None
+
+
+def url_value(value) -> str:
+    """Returns the value quoted for the URL, the same as werkzeug does"""
+    value = str(value)
+    return quote(value, safe=SAFE) if UNSAFE.search(value) else value
+
+
+class URLTemplate(URLFor):
+    """
+    Field that outputs the URL for an endpoint, the same as 'URLFor'.
+    The URL is built by Flask only once per application and root URL: values of the '<attribute>' arguments
+    are replaced with placeholders, so the other URLs are made by formatting the template.
+    Arguments are taken from the attributes of the object (dotted names and dictionaries aren't supported).
+    """
+
+    hits = misses = 0  # lookups of the templates by all fields of the process
+
+    def __init__(self, endpoint, values=None, **kwargs):
+        super().__init__(endpoint, values, **kwargs)
+        self.attributes = dict()
+        for name, value in self.values.items():
+            match = ATTRIBUTE.match(str(value))
+            if match and match.group(1):
+                self.attributes[name] = match.group(1)
+        self.external = bool(self.values.get("_external"))
+        self._templates = dict()
+
+    def get_template(self, context) -> str:
+        """
+        Returns the URL template with '{attribute}' placeholders
+        :param context: the application and the request (see 'url_context')
+        :type context: tuple
+        """
+        app, req = context
+        if req is None:
+            key = (app, None)
+        else:  # relative urls depend only on the script root, absolute ones on the host too
+            key = (app, req.script_root, req.host_url) if self.external else (app, req.script_root)
+        template = self._templates.get(key)
+        if template is not None:
+            URLTemplate.hits += 1
+        else:
+            URLTemplate.misses += 1
+            placeholders = {name: "__{0}__".format(name) for name in self.attributes}
+            url = url_for(self.endpoint, **dict(self.values, **placeholders)).replace("{", "{{").replace("}", "}}")
+            for name, placeholder in placeholders.items():
+                url = url.replace(placeholder, "{" + self.attributes[name] + "}")
+            if len(self._templates) >= MAX_TEMPLATES:  # the host comes from the request
+                self._templates.clear()
+            template = self._templates[key] = url
+        return template
+
+    def get_values(self, obj) -> dict:
+        """Returns quoted attributes of the object for the template, None if any of them is None"""
+        values = dict()
+        for attr_name in self.attributes.values():
+            value = getattr(obj, attr_name, missing)
+            if value is None:
+                return None
+            if value is missing:
+                raise AttributeError("{0!r} is not a valid attribute of {1!r}".format(attr_name, obj))
+            values[attr_name] = url_value(value)
+        return values
+
+    def _serialize(self, value, key, obj):
+        """Outputs the URL for the endpoint, attributes of the object are quoted and put into the template"""
+        values = self.get_values(obj)
+        return None if values is None else self.get_template(url_context()).format_map(values)
+
+
+class Links(Hyperlinks):
+    """
+    Field that outputs a dictionary of hyperlinks, the same as 'Hyperlinks'.
+    In flat dictionaries of 'URLTemplate' fields every attribute is quoted once for all links
+    and the templates are looked up once per dump.
+    """
+
+    def __init__(self, schema, **kwargs):
+        super().__init__(schema, **kwargs)
+        self.flat = all(isinstance(field, URLTemplate) for field in schema.values())
+        if self.flat:
+            attributes = {attr_name for field in schema.values() for attr_name in field.attributes.values()}
+            self.values_field = URLTemplate(None, values={name: "<{0}>".format(name) for name in attributes})
+
+    def prepare_dump(self):
+        """
+        Returns function which outputs the dictionary of URLs of an object (see 'FastDumpMixin'),
+        the templates are looked up once for all objects. Returns None if the dictionary isn't flat
+        """
+        if not self.flat:
+            return None
+
+        context = url_context()
+        templates = {name: field.get_template(context) for name, field in self.schema.items()}
+
+        def dump(obj):
+            values = self.values_field.get_values(obj)
+            if values is None:  # some urls can't be built, the fields handle it one by one
+                return {name: field.serialize(name, obj) for name, field in self.schema.items()}
+            return {name: template.format_map(values) for name, template in templates.items()}
+
+        return dump
+
+    def _serialize(self, value, attr, obj):
+        """Outputs the dictionary of URLs"""
+        dump = self.prepare_dump()
+        return dump(obj) if dump else super()._serialize(value, attr, obj)
+
+
+register_cache("url_templates", lambda: (URLTemplate.hits, URLTemplate.misses))
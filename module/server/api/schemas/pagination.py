@@ -0,0 +1,96 @@
+"""Marshmallow schemas for the query parameters of the collections"""
+from flask import current_app
+from marshmallow import Schema, fields, validate, post_load, validates, validates_schema, ValidationError
+
+
+class FieldsSchema(Schema):
+    """
+    Schema to parse sparse fieldset parameters.
+    Fields: fields - comma separated names of the fields to return (all fields by default),
+    links - whether to return '_links' (true by default).
+    """
+
+    only = fields.Str(data_key="fields", validate=validate.Length(min=1, max=512))
+    links = fields.Bool(missing=True)
+
+    @post_load
+    def split_fields(self, data, **kwargs):
+        """Splits the names of the fields"""
+        if "only" in data:
+            data["only"] = tuple(name.strip() for name in data["only"].split(",") if name.strip())
+        return data
+
+
+class LimitSchema(FieldsSchema):
+    """
+    Base schema for paginated collections, items can be returned as sparse fieldsets (see FieldsSchema).
+    Fields: limit - max number of items on the page. The page size is limited by 'API_MAX_PAGE_SIZE' config value,
+    by default the value of the 'page_size_config' config key is used.
+    """
+
+    page_size_config = "API_PAGE_SIZE"
+
+    limit = fields.Int(validate=validate.Range(min=1))
+
+    @post_load
+    def limit_page_size(self, data, **kwargs):
+        """Sets default page size and limits it"""
+        limit = data.get("limit", current_app.config[self.page_size_config])
+        data["limit"] = min(limit, current_app.config["API_MAX_PAGE_SIZE"])
+        return data
+
+
+class PaginationSchema(LimitSchema):
+    """
+    Schema to parse keyset pagination parameters.
+    Fields: limit - max number of items on the page, after - id of the last item from the previous page,
+    format - 'json' (one page) or 'ndjson' (all items after the cursor are streamed line by line).
+    """
+
+    after = fields.Int(missing=0, validate=validate.Range(min=0))
+    format = fields.Str(missing="json", validate=validate.OneOf(["json", "ndjson"]))
+
+
+class HistoryPaginationSchema(LimitSchema):
+    """
+    Schema to parse payment history pagination parameters. Items are ordered from newest to oldest.
+    Fields: limit - max number of items on the page, before - id of the item, older items will be returned,
+    after - id of the item, newer items will be returned, from, to - dates range (inclusive) of the payments.
+    """
+
+    page_size_config = "API_HISTORY_PAGE_SIZE"
+
+    before = fields.Int(validate=validate.Range(min=1))
+    after = fields.Int(validate=validate.Range(min=0))
+    date_from = fields.Date(data_key="from")
+    date_to = fields.Date(data_key="to")
+
+    @validates_schema
+    def validate_cursors(self, data, **kwargs):
+        """Only one cursor may be used at once"""
+        if "before" in data and "after" in data:
+            raise ValidationError("Only one of 'before' and 'after' may be used.")
+
+
+class SearchSchema(LimitSchema):
+    """
+    Schema to parse user search parameters. Users are ordered from the most to the least relevant.
+    Fields: q - search text, words shorter than 3 characters are ignored, limit - max number of users on the page,
+    offset - number of users to skip. Only the first 'SEARCH_MAX_CANDIDATES' matches are ranked and paginated,
+    so the offset must be less than it.
+    """
+
+    page_size_config = "API_SEARCH_PAGE_SIZE"
+
+    q = fields.Str(required=True, validate=validate.Length(min=3, max=128))
+    offset = fields.Int(missing=0, validate=validate.Range(min=0))
+
+    @validates("offset")
+    def validate_offset(self, value, **kwargs):
+        """Pages past the ranked matches are always empty"""
+        if value >= current_app.config["SEARCH_MAX_CANDIDATES"]:
+            raise ValidationError(
+                "Only the first {0} matches are ranked, refine the search text.".format(
+                    current_app.config["SEARCH_MAX_CANDIDATES"]
+                )
+            )
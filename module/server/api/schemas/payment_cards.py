@@ -2,6 +2,7 @@
 from marshmallow import Schema, fields
 from module import App
 from module.server.models.payment_cards import Card, UsedCard
+from module.server.api.schemas.base import FastDumpMixin
 
 
 ma = App.ma
@@ -16,7 +17,7 @@ class CardSchema(ma.SQLAlchemyAutoSchema):
         dump_only = ("uuid",)
 
 
-class UsedCardSchema(ma.SQLAlchemyAutoSchema):
+class UsedCardSchema(FastDumpMixin, ma.SQLAlchemyAutoSchema):
     """Schema for used payment card"""
 
     class Meta:
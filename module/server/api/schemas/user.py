@@ -3,12 +3,14 @@ from marshmallow import Schema, fields, validate, post_load
 from module import App
 from module.server.models.user import User, Tariffs
 from module.server.models.payment_cards import UsedCard
+from module.server.api.schemas.links import Links, URLTemplate
+from module.server.api.schemas.base import FastDumpMixin
 
 
 ma = App.ma
 
 
-class AdminUserInfoSchema(ma.SQLAlchemyAutoSchema):
+class AdminUserInfoSchema(FastDumpMixin, ma.SQLAlchemyAutoSchema):
     """Schema for full admin info"""
 
     class Meta:
@@ -29,17 +31,17 @@ class AdminUserInfoSchema(ma.SQLAlchemyAutoSchema):
         dump_only = ("created_at", "balance", "state", "ip", "_links")
         include_fk = True
 
-    _links = ma.Hyperlinks(
+    _links = Links(
         {
-            "collection": ma.URLFor("api_users"),
-            "self": ma.URLFor("api_user_details", values=dict(uuid="<uuid>")),
-            "payment history": ma.URLFor("api_user_history", values=dict(uuid="<uuid>")),
-            "moderate": ma.URLFor("api_admin_tools", values=dict(uuid="<uuid>")),
+            "collection": URLTemplate("api_users"),
+            "self": URLTemplate("api_user_details", values=dict(uuid="<uuid>")),
+            "payment history": URLTemplate("api_user_history", values=dict(uuid="<uuid>")),
+            "moderate": URLTemplate("api_admin_tools", values=dict(uuid="<uuid>")),
         }
     )
 
 
-class FullUserInfoSchema(ma.SQLAlchemyAutoSchema):
+class FullUserInfoSchema(FastDumpMixin, ma.SQLAlchemyAutoSchema):
     """Schema for full user info"""
 
     class Meta:
@@ -61,10 +63,27 @@ class FullUserInfoSchema(ma.SQLAlchemyAutoSchema):
         dump_only = ("uuid", "created_at", "balance", "state", "ip", "_links")
         include_fk = True
 
-    _links = ma.Hyperlinks(
+    _links = Links(
         {
-            "self": ma.URLFor("api_user_details", values=dict(uuid="<uuid>")),
-            "payment history": ma.URLFor("api_user_history", values=dict(uuid="<uuid>")),
+            "self": URLTemplate("api_user_details", values=dict(uuid="<uuid>")),
+            "payment history": URLTemplate("api_user_history", values=dict(uuid="<uuid>")),
+        }
+    )
+
+
+class SearchUserSchema(FastDumpMixin, ma.SQLAlchemyAutoSchema):
+    """Schema for the user search results"""
+
+    class Meta:
+        model = User
+        fields = ("uuid", "username", "name", "email", "phone", "address", "tariff", "state", "_links")
+        dump_only = fields
+        include_fk = True
+
+    _links = Links(
+        {
+            "self": URLTemplate("api_user_details", values=dict(uuid="<uuid>")),
+            "moderate": URLTemplate("api_admin_tools", values=dict(uuid="<uuid>")),
         }
     )
 
@@ -92,4 +111,8 @@ class RegisterSchema(Schema):
 
     @post_load
     def create_new_user(self, data, **kwargs):
+        """
+        Creates new user object. The ip of the user is reserved from the pool.
+        :raises ValueError: the ip pool is exhausted
+        """
         return User(**data)
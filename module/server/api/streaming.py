@@ -0,0 +1,38 @@
+"""Helpers to stream large collections without loading them into memory"""
+import json
+from flask import Response, current_app, stream_with_context
+
+
+def iter_chunks(query, chunk_size=None):
+    """
+    Yields lists of rows fetched from a server-side cursor in chunks of a fixed size.
+    :param query: query to fetch rows from
+    :param chunk_size: number of rows in the chunk, defaults to None ('API_STREAM_CHUNK_SIZE' config value)
+    :type chunk_size: int, optional
+    """
+    chunk_size = chunk_size or current_app.config["API_STREAM_CHUNK_SIZE"]
+    chunk = []
+    for row in query.execution_options(stream_results=True).yield_per(chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ndjson_response(query, schema, chunk_size=None) -> "Response":
+    """
+    Returns response which streams rows of the query as newline delimited json.
+    Rows are serialized chunk by chunk, so the memory usage doesn't depend on the number of rows.
+    :param query: query to fetch rows from
+    :param schema: schema to serialize a single row
+    :param chunk_size: number of rows serialized and sent at once, defaults to None
+    :type chunk_size: int, optional
+    """
+
+    def generate():
+        for chunk in iter_chunks(query, chunk_size):
+            yield "".join(json.dumps(item) + "\n" for item in schema.dump(chunk, many=True))
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
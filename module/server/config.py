@@ -16,6 +16,10 @@ class Config:
 
     PERMANENT_SESSION_LIFETIME = timedelta(minutes=10)
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=30)
+    # how often (in seconds) every worker loads tokens revoked by the other workers
+    JWT_BLOCKLIST_POLL_INTERVAL = float(os.environ.get("JWT_BLOCKLIST_POLL_INTERVAL", 5))
+    # how many ids before the last seen one every poll re-reads: rows may commit out of id order
+    JWT_BLOCKLIST_POLL_OVERLAP = int(os.environ.get("JWT_BLOCKLIST_POLL_OVERLAP", 500))
 
     # WARNING: keep these keys used in production secret
     SECRET_KEY = os.environ.get("SECRET_KEY", "dev")
@@ -26,6 +30,90 @@ class Config:
     # stores database file "app.db" by the ../module/server/static/ path
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL") or "sqlite:///" + os.path.join(BASEDIR, "static", "app.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite only: pragmas of every new connection. WAL lets readers work while a worker writes,
+    # 'synchronous = normal' syncs the WAL only at checkpoints, busy_timeout (ms) - how long to wait for the write lock
+    SQLITE_PRAGMAS = {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+        "cache_size": -16000,  # KiB per connection
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
+    }
+    # SQLite only: write transactions take the write lock with BEGIN IMMEDIATE, see server/sqlite.py
+    SQLITE_IMMEDIATE_WRITES = True
+
+    # Api
+    API_PAGE_SIZE = 100  # default number of items on the page of the collection
+    API_HISTORY_PAGE_SIZE = 10  # default number of payments on the page of the history
+    API_MAX_PAGE_SIZE = 1000
+    API_STREAM_CHUNK_SIZE = 500  # number of rows fetched from the database and sent at once while streaming
+    API_BATCH_MAX_SIZE = 10000  # max number of items in the batch request
+    API_BATCH_CHUNK_SIZE = 500  # number of batch items applied in one transaction
+    API_SEARCH_PAGE_SIZE = 20  # default number of users on the page of the search results
+    SEARCH_MAX_CANDIDATES = 200  # max number of matches ranked by the search, keeps common words fast
+
+    # Password hashing
+    # werkzeug method with the cost, passwords hashed with other methods are rehashed on login
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:260000")
+    # max number of concurrent hashes of all workers of the host (0 - unlimited), the slots are lock files in the folder
+    PASSWORD_HASH_SLOTS = int(os.environ.get("PASSWORD_HASH_SLOTS", os.cpu_count() or 1))
+    PASSWORD_HASH_SLOTS_DIR = os.environ.get("PASSWORD_HASH_SLOTS_DIR") or os.path.join(BASEDIR, "static", "hashing")
+    # seconds to wait for a free slot, then the login is answered with 503
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", 0.5))
+
+    # Admin dashboard
+    # if True - counters are read from the incrementally maintained table instead of aggregate queries
+    DASHBOARD_COUNTERS = True
+
+    # Debtors
+    # activated users with a balance less than the threshold are deactivated by the debtors sweep
+    DEBT_THRESHOLD = float(os.environ.get("DEBT_THRESHOLD", 0))
+    SWEEP_CHUNK_SIZE = 10000  # number of users checked in one transaction
+
+    # IP pool
+    # comma separated CIDR ranges from which addresses are issued to the users
+    IP_POOL_RANGES = os.environ.get("IP_POOL_RANGES", "10.0.0.0/8").split(",")
+
+    # Logging
+    LOGS_FOLDER = os.environ.get("LOGS_FOLDER") or os.path.join(BASEDIR, "static", "logs")
+    # records are written by a background thread, records which don't fit into the queue are dropped
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+    LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024))  # size of the log file before rotation
+    LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 10))
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")  # 'text' or 'json' (one object per line)
+    LOG_MAIL_INTERVAL = float(os.environ.get("LOG_MAIL_INTERVAL", 60))  # seconds errors are collected into a digest
+
+    # Metrics
+    # every worker writes its metrics to a file in the folder, /metrics sums the files of all workers
+    METRICS_ENABLED = True
+    METRICS_DIR = os.environ.get("METRICS_DIR") or os.path.join(BASEDIR, "static", "metrics")
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # if set, required in the 'Authorization: Bearer' header
+
+    # SQL instrumentation, disabled by default
+    # statements longer than the threshold (in seconds) are logged with their parameters and call site
+    SQL_SLOW_QUERY_THRESHOLD = (
+        float(os.environ["SQL_SLOW_QUERY_THRESHOLD"]) if os.environ.get("SQL_SLOW_QUERY_THRESHOLD") else None
+    )
+    # a statement repeated this many times within one request is logged as a possible N+1 query, 0 - disabled
+    SQL_REPEATED_QUERY_THRESHOLD = int(os.environ.get("SQL_REPEATED_QUERY_THRESHOLD", 0))
+
+    # Read replica, disabled by default
+    # if set, read-only resources and the admin dashboard read from this database, unless the client has written
+    # within the sticky period (its own writes may be not replicated yet)
+    REPLICA_DATABASE_URL = os.environ.get("REPLICA_DATABASE_URL")
+    REPLICA_STICKY_SECONDS = float(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+    # how often (in seconds) 'flask replica sync' copies the SQLite primary to the SQLite replica
+    REPLICA_SYNC_INTERVAL = float(os.environ.get("REPLICA_SYNC_INTERVAL", 1))
+
+    # Write queue, disabled by default
+    # if set, card redemptions, creation, deletion and state changes of the users and token revocations of all workers
+    # are applied in group commits by one writer process listening on this unix socket ('flask writer serve')
+    WRITE_QUEUE_ADDRESS = os.environ.get("WRITE_QUEUE_ADDRESS")
+    WRITE_QUEUE_BATCH_SIZE = int(os.environ.get("WRITE_QUEUE_BATCH_SIZE", 100))  # max number of writes in one commit
+    # how long (in seconds) the writer waits for more writes before the commit, 0 - only the already queued ones
+    WRITE_QUEUE_BATCH_WINDOW = float(os.environ.get("WRITE_QUEUE_BATCH_WINDOW", 0))
+    WRITE_QUEUE_TIMEOUT = float(os.environ.get("WRITE_QUEUE_TIMEOUT", 10))  # seconds a worker waits for the result
 
     # Mail
     # By default is configured on the Python SMTP debugging server
@@ -47,3 +135,17 @@ class TestConfig(Config):
     # Can be useful if the application needs to determine if it is running in tests or not (access via app.testing).
     TESTING = True
     DEBUG = True
+
+    # Errors of the tests aren't sent
+    ADMINS = []
+
+    # Metrics are kept in the memory of the test process
+    METRICS_DIR = None
+
+    # Writes are applied and read by the test process
+    WRITE_QUEUE_ADDRESS = None
+    REPLICA_DATABASE_URL = None
+
+    # Cheap hashes computed in the test process keep tests fast
+    PASSWORD_HASH_METHOD = "pbkdf2:sha256:1000"
+    PASSWORD_HASH_SLOTS = 0
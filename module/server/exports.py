@@ -0,0 +1,113 @@
+"""Export of users and payment history as CSV or NDJSON"""
+import io
+import csv
+import json
+from datetime import datetime, date, time, timedelta
+from module import App
+from module.server.models.user import User
+from module.server.models.payment_cards import UsedCard
+from module.server.api.streaming import iter_chunks
+
+
+db = App.db
+
+FORMATS = dict(csv="text/csv", ndjson="application/x-ndjson")  # export format and its mimetype
+
+
+def _filter(query, date_column, state=None, tariff=None, date_from=None, date_to=None):
+    """Applies filters by the user state and tariff and by the dates range (inclusive)"""
+    if state:
+        query = query.filter(User.state == state)
+    if tariff:
+        query = query.filter(User.tariff == tariff)
+    if date_from:
+        query = query.filter(date_column >= datetime.combine(date_from, time.min))
+    if date_to:
+        query = query.filter(date_column < datetime.combine(date_to, time.min) + timedelta(days=1))
+    return query
+
+
+def users_query(state=None, tariff=None, date_from=None, date_to=None):
+    """
+    Returns query of the users ordered by id. Only columns are selected, so the rows are cheap to fetch.
+    :param state: state of the users, defaults to None
+    :type state: str, optional
+    :param tariff: tariff of the users, defaults to None
+    :type tariff: str, optional
+    :param date_from: the earliest registration date (inclusive), defaults to None
+    :type date_from: date, optional
+    :param date_to: the latest registration date (inclusive), defaults to None
+    :type date_to: date, optional
+    """
+    query = db.session.query(
+        User.uuid,
+        User.username,
+        User.name,
+        User.email,
+        User.phone,
+        User.address,
+        User.tariff,
+        User.ip,
+        User.state,
+        User.balance,
+        User.created_at,
+    )
+    return _filter(query, User.created_at, state, tariff, date_from, date_to).order_by(User.id)
+
+
+def history_query(state=None, tariff=None, date_from=None, date_to=None):
+    """
+    Returns query of the payments ordered by id. Payments of the deleted users are included unless
+    the state or the tariff of the user is filtered.
+    :param state: state of the users, defaults to None
+    :type state: str, optional
+    :param tariff: tariff of the users, defaults to None
+    :type tariff: str, optional
+    :param date_from: the earliest date of the payment (inclusive), defaults to None
+    :type date_from: date, optional
+    :param date_to: the latest date of the payment (inclusive), defaults to None
+    :type date_to: date, optional
+    """
+    query = db.session.query(
+        UsedCard.uuid,
+        User.uuid.label("user_uuid"),
+        UsedCard.code,
+        UsedCard.amount,
+        UsedCard.balance_after_use,
+        UsedCard.used_at,
+    ).outerjoin(User, User.id == UsedCard.user_id)
+    return _filter(query, UsedCard.used_at, state, tariff, date_from, date_to).order_by(UsedCard.id)
+
+
+def _to_text(value):
+    """Converts dates to ISO 8601 strings, other values are left as is"""
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def iter_export(query, file_format, chunk_size=None):
+    """
+    Yields rows of the query as CSV (with a header) or NDJSON text, chunk by chunk.
+    Rows are fetched from a server-side cursor, so the memory usage doesn't depend on the number of rows.
+    The CSV header is yielded before the query is executed.
+    :param query: query of the columns
+    :param file_format: 'csv' or 'ndjson'
+    :type file_format: str
+    :param chunk_size: number of rows fetched and yielded at once, defaults to None ('API_STREAM_CHUNK_SIZE')
+    :type chunk_size: int, optional
+    """
+    columns = [column["name"] for column in query.column_descriptions]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if file_format == "csv":
+        writer.writerow(columns)
+        yield buffer.getvalue()
+
+    for chunk in iter_chunks(query, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        if file_format == "csv":
+            writer.writerows([_to_text(value) for value in row] for row in chunk)
+        else:
+            buffer.writelines(json.dumps(dict(zip(columns, map(_to_text, row)))) + "\n" for row in chunk)
+        yield buffer.getvalue()
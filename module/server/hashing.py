@@ -0,0 +1,198 @@
+"""Password hashing service limited by slots shared by all worker processes of the host"""
+import os
+from time import monotonic, sleep
+from itertools import repeat
+from threading import BoundedSemaphore, Lock
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows: waitress serves the app with threads of one process
+    fcntl = None
+
+
+class HashSlots:
+    """
+    Limit of the concurrent hashes shared by all processes of the host. A slot is an exclusive lock
+    of one of the 'size' files in the folder, the lock is released by the OS if the process dies.
+    Without 'fcntl' the slots are shared by the threads of the current process only.
+
+    :param folder: folder of the lock files, created if it doesn't exist
+    :type folder: str
+    :param size: number of slots
+    :type size: int
+    """
+
+    POLL_INTERVAL = 0.005  # seconds between the attempts to take a slot
+
+    def __init__(self, folder, size):
+        self.size = size
+        if fcntl is None:
+            self._semaphore = BoundedSemaphore(size)
+        else:
+            os.makedirs(folder, exist_ok=True)
+            self._paths = [os.path.join(folder, "slot{0}".format(i)) for i in range(size)]
+
+    def _try_acquire(self):
+        """Returns file descriptor of the locked slot, None if all slots are taken"""
+        for path in self._paths:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:  # taken by another thread or process
+                os.close(fd)
+                continue
+            return fd
+        return None
+
+    def acquire(self, timeout):
+        """
+        Takes a free slot, returns its handle to release or None if no slot was freed within the timeout
+        :param timeout: how long (in seconds) to wait for a slot
+        :type timeout: float
+        """
+        if fcntl is None:
+            return True if self._semaphore.acquire(timeout=timeout) else None
+        deadline = monotonic() + timeout
+        fd = self._try_acquire()
+        while fd is None and monotonic() < deadline:
+            sleep(self.POLL_INTERVAL)
+            fd = self._try_acquire()
+        return fd
+
+    def release(self, handle) -> None:
+        """
+        Frees the slot
+        :param handle: handle returned by acquire
+        """
+        if fcntl is None:
+            self._semaphore.release()
+            return
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            os.close(handle)
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords in the calling thread while it holds one of the slots shared by all workers
+    of the host, so a burst of logins can't take more CPUs than there are slots. Requests which don't get
+    a slot within the timeout fail fast instead of queueing up.
+
+    :param method: werkzeug hash method with the cost, e.g. 'pbkdf2:sha256:260000'
+    :type method: str
+    :param slots: max number of concurrent hashes of all processes, 0 - unlimited, defaults to 0
+    :type slots: int, optional
+    :param slots_dir: folder of the slot lock files, required if the slots are limited, defaults to None
+    :type slots_dir: str, optional
+    :param timeout: how long (in seconds) to wait for a free slot, defaults to 0.5
+    :type timeout: float, optional
+    :param workers: number of worker processes of 'hash_many', 0 - hash in the calling thread, defaults to 0
+    :type workers: int, optional
+    """
+
+    def __init__(self, method, slots=0, slots_dir=None, timeout=0.5, workers=0):
+        self.method = method
+        self.timeout = timeout
+        self.workers = workers
+        self._slots = HashSlots(slots_dir, slots) if slots else None
+        self._depth = 0
+        self._lock = Lock()
+        self._pool = None
+        self._pid = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Returns number of hashes of this process which are waiting for a slot or running"""
+        return self._depth
+
+    def _get_pool(self) -> "ProcessPoolExecutor":
+        """Returns pool of the current process. The pool is created lazily, so it isn't shared by forked workers"""
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, func, *args):
+        """
+        Runs function while holding a slot
+        :raises RuntimeError: no slot was freed within the timeout
+        """
+        if self._slots is None:
+            return func(*args)
+
+        with self._lock:
+            self._depth += 1
+        try:
+            handle = self._slots.acquire(self.timeout)
+            if handle is None:
+                raise RuntimeError("All password hashing slots are busy.")
+            try:
+                return func(*args)
+            finally:
+                self._slots.release(handle)
+        finally:
+            with self._lock:
+                self._depth -= 1
+
+    def hash(self, password) -> str:
+        """
+        Returns hash of the password made with the configured method
+        :param password: password to hash
+        :type password: str
+        """
+        return self._run(generate_password_hash, password, self.method)
+
+    def hash_many(self, passwords) -> list:
+        """
+        Returns hashes of the passwords. The list is split between all workers of the pool,
+        it isn't limited by the slots, so it's intended for the command line tools.
+        :param passwords: passwords to hash
+        :type passwords: list
+        """
+        if not self.workers:
+            return [generate_password_hash(password, self.method) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return list(self._get_pool().map(generate_password_hash, passwords, repeat(self.method), chunksize=chunksize))
+
+    def verify(self, pwhash, password) -> bool:
+        """
+        Returns True if the password matches the hash
+        :param pwhash: hash of the password
+        :type pwhash: str
+        :param password: password to check
+        :type password: str
+        """
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash) -> bool:
+        """
+        Returns True if the hash was made with other method or cost than configured
+        :param pwhash: hash of the password
+        :type pwhash: str
+        """
+        return pwhash.split("$", 1)[0] != self.method
+
+    def shutdown(self) -> None:
+        """Stops worker processes"""
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown()
+            self._pool = None
+
+
+def get_hasher() -> "PasswordHasher":
+    """Returns password hasher of the current app"""
+    hasher = current_app.extensions.get("password_hasher")
+    if hasher is None:
+        hasher = current_app.extensions["password_hasher"] = PasswordHasher(
+            method=current_app.config["PASSWORD_HASH_METHOD"],
+            slots=current_app.config["PASSWORD_HASH_SLOTS"],
+            slots_dir=current_app.config["PASSWORD_HASH_SLOTS_DIR"],
+            timeout=current_app.config["PASSWORD_HASH_TIMEOUT"],
+        )
+    return hasher
@@ -0,0 +1,204 @@
+"""Non-blocking logging: records are queued and written to the files and emails by a background thread"""
+import os
+import copy
+import json
+import queue
+import smtplib
+import logging
+import threading
+from email.message import EmailMessage
+from email.utils import localtime
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, SMTPHandler
+from flask import has_request_context, request
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]"
+REQUEST_ATTRIBUTES = ("method", "path", "remote_addr")  # attached to the records logged within requests
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON objects (one per line) for the log collectors"""
+
+    def format(self, record) -> str:
+        """Returns JSON object with the time, level, message, location, request and traceback of the record"""
+        data = dict(
+            time=datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            level=record.levelname,
+            logger=record.name,
+            message=record.getMessage(),
+            path=record.pathname,
+            line=record.lineno,
+        )
+        data.update((name, getattr(record, name)) for name in REQUEST_ATTRIBUTES if hasattr(record, name))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = record.stack_info
+        return json.dumps(data, default=str)
+
+
+class _Listener(QueueListener):
+    """Queue listener which can be stopped when the queue is full"""
+
+    def enqueue_sentinel(self) -> None:
+        """Waits for a place in the queue, so the thread is stopped after the queued records are handled"""
+        self.queue.put(self._sentinel)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Handler which puts records into a bounded queue, they are passed to the handlers by a background thread.
+    The logging thread never waits: if the queue is full the record is dropped and counted.
+    The thread is started on the first record in every process, so it works in the forked workers too.
+
+    :param handlers: handlers which write the records, e.g. to the files
+    :type handlers: list
+    :param queue_size: max number of records waiting in the queue, defaults to 10000
+    :type queue_size: int, optional
+    """
+
+    def __init__(self, handlers, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        """Returns number of records waiting in the queue"""
+        return self.queue.qsize()
+
+    def _start(self) -> None:
+        """Starts the listener thread of the current process"""
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # the queue of the parent process might have been locked by its threads at the moment of fork
+                self.queue = queue.Queue(self.queue_size)
+                self._listener = _Listener(self.queue, *self.handlers, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record) -> "logging.LogRecord":
+        """
+        Returns copy of the record with the rendered message and traceback, so it can be handled later
+        by another thread. Information about the current request is attached to the record.
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if has_request_context():
+            record.method, record.path, record.remote_addr = request.method, request.path, request.remote_addr
+        return record
+
+    def enqueue(self, record) -> None:
+        """Puts the record into the queue without waiting"""
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Handles the queued records, stops the thread and closes the handlers"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener = self._pid = None
+        for handler in self.handlers:
+            handler.close()
+        super().close()
+
+
+class DigestSMTPHandler(SMTPHandler):
+    """
+    SMTP handler which sends records in digests instead of one email per record.
+    Records logged from the same place are sent once with the number of repeats and the last message.
+    The digest is sent by a timer thread 'interval' seconds after the first record.
+
+    :param interval: how long (in seconds) records are collected before the digest is sent, defaults to 60
+    :type interval: float, optional
+    :param max_entries: max number of distinct places in the digest, other records are only counted, defaults to 100
+    :type max_entries: int, optional
+    :param '**kwargs': arguments of the 'SMTPHandler'
+    """
+
+    def __init__(self, interval=60, max_entries=100, **kwargs):
+        super().__init__(**kwargs)
+        self.interval = interval
+        self.max_entries = max_entries
+        self._entries = dict()  # (logger, level, path, line) - [number of records, the last record]
+        self._skipped = 0
+        self._timer = None
+
+    def emit(self, record) -> None:
+        """Adds the record to the digest and schedules sending of the digest"""
+        key = (record.name, record.levelname, record.pathname, record.lineno)
+        if key in self._entries:
+            self._entries[key][0] += 1
+            self._entries[key][1] = record
+        elif len(self._entries) < self.max_entries:
+            self._entries[key] = [1, record]
+        else:
+            self._skipped += 1
+
+        if self._timer is None:
+            self._timer = threading.Timer(self.interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        """Sends the collected records"""
+        with self.lock:
+            entries, skipped = list(self._entries.values()), self._skipped
+            self._entries, self._skipped = dict(), 0
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+        if not entries:
+            return
+
+        total = sum(count for count, _ in entries) + skipped
+        parts = ["{0} x {1}".format(count, self.format(record)) for count, record in entries]
+        if skipped:
+            parts.append("{0} more records from other places".format(skipped))
+        try:
+            self.send("{0}: {1} records".format(self.subject, total), "\n\n".join(parts))
+        except Exception:
+            self.handleError(entries[-1][1])
+
+    def send(self, subject, body) -> None:
+        """
+        Sends the email to the admins (the same as 'SMTPHandler.emit')
+        :param subject: subject of the email
+        :type subject: str
+        :param body: text of the email
+        :type body: str
+        """
+        smtp = smtplib.SMTP(self.mailhost, self.mailport or smtplib.SMTP_PORT, timeout=self.timeout)
+        msg = EmailMessage()
+        msg["From"] = self.fromaddr
+        msg["To"] = ",".join(self.toaddrs)
+        msg["Subject"] = subject
+        msg["Date"] = localtime()
+        msg.set_content(body)
+        if self.username:
+            if self.secure is not None:
+                smtp.ehlo()
+                smtp.starttls(*self.secure)
+                smtp.ehlo()
+            smtp.login(self.username, self.password)
+        smtp.send_message(msg)
+        smtp.quit()
+
+    def close(self) -> None:
+        """Sends the collected records and closes the handler"""
+        self.flush()
+        super().close()
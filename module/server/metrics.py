@@ -0,0 +1,593 @@
+"""
+Metrics of the requests, the database and the caches in the Prometheus text format.
+Every worker process writes its metrics to its own memory mapped file, so recording costs a few memory writes.
+The '/metrics' endpoint of any worker sums the files of all workers.
+"""
+import os
+import hmac
+import json
+import math
+import mmap
+import struct
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from module.server import messages
+from module.server.logs import BackgroundHandler
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250)  # number of queries per request
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)  # seconds
+SAMPLE_INTERVAL = 1  # how often (in seconds) requests save sizes of the queues and counts of the caches
+
+_USED = struct.Struct("q")  # header of the file: number of used bytes
+_LENGTH = struct.Struct("i")  # length of the key of the entry
+_VALUE = struct.Struct("d")
+
+CACHES = dict()  # name: function which returns (hits, misses) of the cache in the current process
+
+
+def register_cache(name, counts) -> None:
+    """
+    Adds the cache to the 'cache_requests_total' metric
+    :param name: name of the cache
+    :type name: str
+    :param counts: function which returns numbers of hits and misses of the cache in the current process
+    :type counts: callable
+    """
+    CACHES[name] = counts
+
+
+class ProcessFile:
+    """
+    Values of the metrics of one process kept in a memory mapped file (in the anonymous memory if path is None).
+    Layout: 8 bytes - number of used bytes, then entries: 4 bytes - length of the key, the key (JSON, padded
+    to 8 bytes), 8 bytes - the value. Entries are only appended and values are updated in place,
+    so other processes can read the file at any moment without locks.
+
+    :param path: path of the file, defaults to None
+    :type path: str, optional
+    """
+
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path=None):
+        self.path = path
+        self._positions = dict()  # (name, labels): position of the value
+        self._lock = threading.Lock()
+        self._fd = None
+        if path is None:
+            self._map = mmap.mmap(-1, self.INITIAL_SIZE)
+        else:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT)
+            size = os.fstat(self._fd).st_size
+            if size < self.INITIAL_SIZE:
+                os.ftruncate(self._fd, self.INITIAL_SIZE)
+            self._map = mmap.mmap(self._fd, max(size, self.INITIAL_SIZE))
+        # the file of the process with the same pid is continued
+        for name, labels, _, position in read_entries(self._map):
+            self._positions[(name, labels)] = position
+        self._used = max(_USED.unpack_from(self._map, 0)[0], _USED.size)
+
+    def add(self, key, amount) -> None:
+        """
+        Adds amount to the value
+        :param key: name of the sample and its labels as ((name, value), ...)
+        :type key: tuple
+        :param amount: added amount
+        :type amount: float
+        """
+        with self._lock:
+            position = self._positions.get(key) or self._append(key)
+            _VALUE.pack_into(self._map, position, _VALUE.unpack_from(self._map, position)[0] + amount)
+
+    def set(self, key, value) -> None:
+        """
+        Sets the value
+        :param key: name of the sample and its labels as ((name, value), ...)
+        :type key: tuple
+        :param value: new value
+        :type value: float
+        """
+        with self._lock:
+            _VALUE.pack_into(self._map, self._positions.get(key) or self._append(key), value)
+
+    def _append(self, key) -> int:
+        """Adds entry with zero value and returns position of the value"""
+        name, labels = key
+        encoded = json.dumps([name, dict(labels)]).encode()
+        encoded += b" " * (-(_LENGTH.size + len(encoded)) % 8)  # values are aligned
+        entry = _LENGTH.pack(len(encoded)) + encoded + _VALUE.pack(0.0)
+        while self._used + len(entry) > len(self._map):
+            self._grow()
+        self._map[self._used : self._used + len(entry)] = entry
+        self._used += len(entry)
+        _USED.pack_into(self._map, 0, self._used)  # the entry is visible to the readers only when it's written
+        self._positions[key] = self._used - _VALUE.size
+        return self._used - _VALUE.size
+
+    def _grow(self) -> None:
+        """Doubles size of the file"""
+        size = len(self._map) * 2
+        if self._fd is None:
+            new_map = mmap.mmap(-1, size)
+            new_map[: len(self._map)] = self._map
+        else:
+            os.ftruncate(self._fd, size)
+            new_map = mmap.mmap(self._fd, size)
+        self._map.close()
+        self._map = new_map
+
+    def read(self) -> bytes:
+        """Returns contents of the file"""
+        with self._lock:
+            return self._map[: self._used]
+
+    def close(self) -> None:
+        """Closes the file"""
+        self._map.close()
+        if self._fd is not None:
+            os.close(self._fd)
+
+
+def read_entries(data):
+    """
+    Yields (name, labels, value, position) of every entry of the metrics file
+    :param data: contents of the file
+    :type data: bytes
+    """
+    used = _USED.unpack_from(data, 0)[0] if len(data) >= _USED.size else 0
+    position = _USED.size
+    while position < min(used, len(data)):
+        length = _LENGTH.unpack_from(data, position)[0]
+        name, labels = json.loads(bytes(data[position + _LENGTH.size : position + _LENGTH.size + length]))
+        position += _LENGTH.size + length
+        yield name, tuple(labels.items()), _VALUE.unpack_from(data, position)[0], position
+        position += _VALUE.size
+
+
+def is_running(pid) -> bool:
+    """Returns True if the process exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsStore:
+    """
+    Metrics of the worker processes: every process writes its own file '<pid>.db' in the folder.
+    The file is opened on the first record in every process, so it works in the forked workers too.
+
+    :param path: folder of the files, defaults to None (metrics are kept only in the memory of the process)
+    :type path: str, optional
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_file(self) -> "ProcessFile":
+        """Returns file of the current process"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    path = None
+                    if self.path is not None:
+                        os.makedirs(self.path, exist_ok=True)
+                        path = os.path.join(self.path, "{0}.db".format(os.getpid()))
+                    self._file = ProcessFile(path)
+                    self._pid = os.getpid()
+        return self._file
+
+    def add(self, key, amount) -> None:
+        """Adds amount to the value of the current process (see 'ProcessFile.add')"""
+        self.get_file().add(key, amount)
+
+    def set(self, key, value) -> None:
+        """Sets the value of the current process (see 'ProcessFile.set')"""
+        self.get_file().set(key, value)
+
+    def collect(self, live=()) -> dict:
+        """
+        Returns sums of the values of all processes as {(name, labels): value}.
+        Files of the stopped workers are kept, so their counts aren't lost.
+        :param live: names of the samples which are summed only over the running processes (gauges)
+        :type live: set, optional
+        """
+        sources = [(os.getpid(), self.get_file().read())]
+        if self.path is not None:
+            for filename in os.listdir(self.path):
+                pid = filename[: -len(".db")]
+                if filename.endswith(".db") and pid.isdigit() and int(pid) != os.getpid():
+                    try:
+                        with open(os.path.join(self.path, filename), "rb") as file:
+                            sources.append((int(pid), file.read()))
+                    except FileNotFoundError:  # removed by 'clear'
+                        continue
+
+        totals = dict()
+        for pid, data in sources:
+            running = None
+            for name, labels, value, _ in read_entries(data):
+                if name in live:
+                    running = is_running(pid) if running is None else running
+                    if not running:
+                        continue
+                totals[(name, labels)] = totals.get((name, labels), 0) + value
+        return totals
+
+    def clear(self) -> None:
+        """Removes files of all processes, should be called before the workers are started"""
+        if self.path is not None and os.path.isdir(self.path):
+            for filename in os.listdir(self.path):
+                if filename.endswith(".db"):
+                    os.remove(os.path.join(self.path, filename))
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = self._pid = None
+
+
+def format_value(value) -> str:
+    """Returns the value in the text format"""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def format_labels(labels) -> str:
+    """Returns labels in the text format, e.g. {endpoint="api_users",status="200"}"""
+    if not labels:
+        return ""
+    escaped = (
+        '{0}="{1}"'.format(name, str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\""))
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metric:
+    """
+    Family of the samples with the same name
+
+    :param store: store of the values
+    :type store: MetricsStore
+    :param name: name of the metric
+    :type name: str
+    :param documentation: help text of the metric
+    :type documentation: str
+    :param labelnames: names of the labels, defaults to ()
+    :type labelnames: tuple, optional
+    """
+
+    type = "untyped"
+    live = False  # values of the stopped processes are excluded
+
+    def __init__(self, store, name, documentation, labelnames=()):
+        self.store = store
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def key(self, name, labels) -> tuple:
+        """Returns key of the sample in the store"""
+        return name, tuple(zip(self.labelnames, labels))
+
+    @property
+    def sample_names(self) -> tuple:
+        """Returns names of the samples of the metric"""
+        return (self.name,)
+
+    def render(self, totals) -> list:
+        """
+        Returns lines of the metric in the text format
+        :param totals: values of the samples of the metric as {name: {labels: value}}
+        :type totals: dict
+        """
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation), "# TYPE {0} {1}".format(self.name, self.type)]
+        for labels, value in sorted(totals.get(self.name, {}).items()):
+            lines.append("{0}{1} {2}".format(self.name, format_labels(labels), format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    """Value which only increases"""
+
+    type = "counter"
+
+    def inc(self, amount=1, labels=()) -> None:
+        """
+        Increases the value
+        :param amount: added amount, defaults to 1
+        :type amount: float, optional
+        :param labels: values of the labels, defaults to ()
+        :type labels: tuple, optional
+        """
+        self.store.add(self.key(self.name, labels), amount)
+
+    def set(self, value, labels=()) -> None:
+        """
+        Sets total of the current process, e.g. for the counts kept by other objects
+        :param value: the total
+        :type value: float
+        :param labels: values of the labels, defaults to ()
+        :type labels: tuple, optional
+        """
+        self.store.set(self.key(self.name, labels), value)
+
+
+class Gauge(Metric):
+    """Current value, summed over the running processes"""
+
+    type = "gauge"
+    live = True
+
+    def set(self, value, labels=()) -> None:
+        """
+        Sets the value of the current process
+        :param value: new value
+        :type value: float
+        :param labels: values of the labels, defaults to ()
+        :type labels: tuple, optional
+        """
+        self.store.set(self.key(self.name, labels), value)
+
+
+class Histogram(Metric):
+    """
+    Distribution of the observed values in buckets.
+    Every observation is added only to its own bucket, buckets are accumulated when the metric is rendered.
+
+    :param buckets: upper bounds of the buckets in ascending order
+    :type buckets: tuple
+    """
+
+    type = "histogram"
+
+    def __init__(self, store, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(store, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.bounds = tuple(format_value(bound) for bound in self.buckets) + ("+Inf",)
+        self.bucket_key = Metric(store, name + "_bucket", documentation, self.labelnames + ("le",)).key
+
+    @property
+    def sample_names(self) -> tuple:
+        """Returns names of the samples of the metric"""
+        return self.name + "_bucket", self.name + "_sum", self.name + "_count"
+
+    def observe(self, value, labels=()) -> None:
+        """
+        Adds the value to the distribution
+        :param value: observed value
+        :type value: float
+        :param labels: values of the labels, defaults to ()
+        :type labels: tuple, optional
+        """
+        process_file = self.store.get_file()
+        process_file.add(
+            self.bucket_key(self.name + "_bucket", labels + (self.bounds[bisect_left(self.buckets, value)],)), 1
+        )
+        process_file.add(self.key(self.name + "_sum", labels), value)
+        process_file.add(self.key(self.name + "_count", labels), 1)
+
+    def render(self, totals) -> list:
+        """Returns lines of the metric in the text format, buckets are cumulative"""
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation), "# TYPE {0} {1}".format(self.name, self.type)]
+        sums, counts = totals.get(self.name + "_sum", {}), totals.get(self.name + "_count", {})
+        buckets = dict()  # labels without 'le': {le: value}
+        for labels, value in totals.get(self.name + "_bucket", {}).items():
+            buckets.setdefault(labels[:-1], dict())[labels[-1][1]] = value
+
+        for labels in sorted(counts):
+            cumulative = 0
+            for bound in self.bounds:
+                cumulative += buckets.get(labels, {}).get(bound, 0)
+                bucket_labels = format_labels(labels + (("le", bound),))
+                lines.append("{0}_bucket{1} {2}".format(self.name, bucket_labels, format_value(cumulative)))
+            lines.append("{0}_sum{1} {2}".format(self.name, format_labels(labels), format_value(sums.get(labels, 0))))
+            lines.append("{0}_count{1} {2}".format(self.name, format_labels(labels), format_value(counts[labels])))
+        return lines
+
+
+class RequestStats:
+    """Database usage of the current request, collected by the SQLAlchemy events"""
+
+    __slots__ = ("start", "queries", "query_time", "checkouts")
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.checkouts = []  # seconds spent waiting for the connections from the pool
+
+
+def current_stats():
+    """Returns stats of the current request, None outside of requests"""
+    return g.get("request_stats") if has_app_context() else None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    """Saves start time of the query"""
+    conn.info["query_start"] = perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    """Adds the query to the stats of the request"""
+    stats = current_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_time += perf_counter() - conn.info.get("query_start", perf_counter())
+
+
+def instrument_pool(engine) -> None:
+    """
+    Measures how long requests wait for the connections from the pool of the engine.
+    The pool is replaced when the engine is disposed, so the new pool is instrumented too.
+    :param engine: engine of the app
+    :type engine: Engine
+    """
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        start = perf_counter()
+        connection = connect()
+        stats = current_stats()
+        if stats is not None:
+            stats.checkouts.append(perf_counter() - start)
+        return connection
+
+    pool.connect = timed_connect
+    if not event.contains(engine, "engine_disposed", instrument_pool):
+        event.listen(engine, "engine_disposed", instrument_pool)
+
+
+class Metrics:
+    """
+    Collects metrics of the requests per endpoint (resources and blueprint views): number of requests,
+    latency, number and time of SQL queries, waiting for the database connections. Also collects sizes
+    of the queues and hit rates of the caches of the workers. Latency of streamed responses doesn't include streaming.
+
+    :param path: folder where the workers write the metrics, defaults to None (only the current process)
+    :type path: str, optional
+    """
+
+    def __init__(self, path=None):
+        self.store = store = MetricsStore(path)
+        self.requests = Counter(
+            store, "http_requests_total", "Number of handled requests.", ("endpoint", "method", "status")
+        )
+        self.latency = Histogram(
+            store, "http_request_duration_seconds", "Time of handling the requests.", ("endpoint",), LATENCY_BUCKETS
+        )
+        self.queries = Histogram(
+            store,
+            "http_request_db_queries",
+            "Number of SQL queries made by the requests.",
+            ("endpoint",),
+            QUERY_BUCKETS,
+        )
+        self.query_time = Counter(
+            store, "http_request_db_seconds_total", "Time spent by the requests on SQL queries.", ("endpoint",)
+        )
+        self.checkouts = Histogram(
+            store, "db_pool_checkout_seconds", "Time of waiting for a database connection.", (), CHECKOUT_BUCKETS
+        )
+        self.cache = Counter(
+            store, "cache_requests_total", "Lookups in the caches of the workers.", ("cache", "result")
+        )
+        self.hash_queue = Gauge(
+            store, "password_hash_queue_depth", "Number of password hashes waiting for a slot or running."
+        )
+        self.log_queue = Gauge(store, "log_queue_depth", "Number of log records waiting to be written.")
+        self.log_dropped = Counter(store, "log_records_dropped_total", "Number of log records dropped on full queue.")
+        self.families = [
+            self.requests,
+            self.latency,
+            self.queries,
+            self.query_time,
+            self.checkouts,
+            self.cache,
+            self.hash_queue,
+            self.log_queue,
+            self.log_dropped,
+        ]
+        self._sampled = -math.inf
+
+    def init_app(self, app, db) -> None:
+        """
+        Records metrics of the requests of the app and adds the '/metrics' endpoint
+        :param app: flask app
+        :type app: Flask
+        :param db: database of the app
+        :type db: SQLAlchemy
+        """
+        app.extensions["metrics"] = self
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule("/metrics", "metrics", self.view)
+        with app.app_context():
+            instrument_pool(db.get_engine(app))
+
+    def before_request(self) -> None:
+        """Starts collecting stats of the request"""
+        g.request_stats = RequestStats()
+
+    def after_request(self, response) -> "Response":
+        """Records metrics of the handled request"""
+        self.record(response.status_code)
+        return response
+
+    def teardown_request(self, exc) -> None:
+        """Records metrics of the request failed with unhandled exception"""
+        if exc is not None:
+            self.record(500)
+
+    def record(self, status) -> None:
+        """
+        Records metrics of the current request
+        :param status: status code of the response
+        :type status: int
+        """
+        stats = g.pop("request_stats", None)
+        if stats is None:  # already recorded
+            return
+        labels = (request.endpoint or "unmatched",)
+        self.requests.inc(1, (labels[0], request.method, str(status)))
+        self.latency.observe(perf_counter() - stats.start, labels)
+        self.queries.observe(stats.queries, labels)
+        self.query_time.inc(stats.query_time, labels)
+        for wait in stats.checkouts:
+            self.checkouts.observe(wait)
+        if perf_counter() - self._sampled >= SAMPLE_INTERVAL:
+            self.sample()
+
+    def sample(self) -> None:
+        """Saves sizes of the queues and counts of the caches of the current process"""
+        self._sampled = perf_counter()
+        hasher = current_app.extensions.get("password_hasher")
+        self.hash_queue.set(hasher.queue_depth if hasher else 0)
+        handlers = [handler for handler in current_app.logger.handlers if isinstance(handler, BackgroundHandler)]
+        self.log_queue.set(sum(handler.queue_depth for handler in handlers))
+        self.log_dropped.set(sum(handler.dropped for handler in handlers))
+        for name, counts in CACHES.items():
+            hits, misses = counts()
+            self.cache.set(hits, (name, "hit"))
+            self.cache.set(misses, (name, "miss"))
+
+    def render(self) -> str:
+        """Returns metrics of all workers in the text format"""
+        self.sample()
+        live = {name for family in self.families if family.live for name in family.sample_names}
+        totals = dict()  # name: {labels: value}
+        for (name, labels), value in self.store.collect(live).items():
+            totals.setdefault(name, dict())[labels] = value
+
+        lines = []
+        for family in self.families:
+            lines.extend(family.render(totals))
+        return "\n".join(lines) + "\n"
+
+    def view(self) -> "Response":
+        """
+        Metrics of all workers in the Prometheus text format.
+        If 'METRICS_TOKEN' is set, the token must be sent in the 'Authorization: Bearer <token>' header.
+        Methods: GET
+        """
+        token = current_app.config["METRICS_TOKEN"]
+        if token and not hmac.compare_digest(request.headers.get("Authorization", ""), "Bearer " + token):
+            return Response(messages["access_denied"], status=401, content_type=CONTENT_TYPE)
+        return Response(self.render(), content_type=CONTENT_TYPE)
@@ -15,6 +15,15 @@ class Base:
         """
         return cls.query.filter_by(uuid=uuid).first()
 
+    @classmethod
+    def get_id_by_uuid(cls, uuid):
+        """
+        Returns id of the object by it's uuid if any, otherwise None. The object itself isn't loaded
+        :param uuid: uuid of the object
+        :type uuid: str
+        """
+        return cls.query.with_entities(cls.id).filter_by(uuid=uuid).scalar()
+
     def save_to_db(self):
         """
         Save object to db
@@ -40,6 +49,38 @@ class Base:
             raise ValueError("Unable to delete user: {0}".format(del_err)) from del_err
 
 
+def id_ranges(column, chunk_size, first_id=None, last_id=None):
+    """
+    Yields (first_id, last_id) ranges of the column values, every range contains up to 'chunk_size' rows.
+    The end of the range is found with the index of the column, so gaps in ids don't produce empty ranges.
+    :param column: indexed integer column, e.g. User.id
+    :param chunk_size: max number of rows in the range
+    :type chunk_size: int
+    :param first_id: the first value, defaults to None (the min value of the column)
+    :type first_id: int, optional
+    :param last_id: the last value (inclusive), defaults to None (the max value of the column)
+    :type last_id: int, optional
+    """
+    session = App.db.session
+    if first_id is None or last_id is None:
+        min_id, max_id = session.query(App.db.func.min(column), App.db.func.max(column)).one()
+        first_id = min_id if first_id is None else first_id
+        last_id = max_id if last_id is None else last_id
+
+    while first_id is not None and last_id is not None and first_id <= last_id:
+        range_end = (
+            session.query(column)
+            .filter(column.between(first_id, last_id))
+            .order_by(column)
+            .offset(chunk_size - 1)
+            .limit(1)
+            .scalar()
+        )
+        range_end = last_id if range_end is None else range_end
+        yield first_id, range_end
+        first_id = range_end + 1
+
+
 def generate_uuid():
     """Returns random uuid with type 'string'"""
     return str(uuid4())
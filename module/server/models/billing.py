@@ -0,0 +1,151 @@
+"""Tariff billing models"""
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from module import App
+from module.server.models import id_ranges
+from module.server.models.user import User, State, Tariffs
+from module.server.models.stats import increment
+
+
+db = App.db
+
+
+class Charge(db.Model):
+    """
+    Ledger of tariff charges, one row per user and billing period.
+    The unique (user_id, period) pair makes billing of the period idempotent.
+    Charges of the deleted users are kept without the user, like the cards they have used.
+    """
+
+    __table_args__ = (db.UniqueConstraint("user_id", "period", name="uq_charge_user_id_period"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="SET NULL"))
+    period = db.Column(db.String(7), nullable=False)  # 'YYYY-MM'
+    tariff = db.Column(db.String(32), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    charged_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self) -> str:
+        """Returns representative string that displays the user, the period and the amount of the charge"""
+        return "Charge {0}: user {1}, {2}. Amount: {3}".format(self.id, self.user_id, self.period, self.amount)
+
+
+def _tariff_cost():
+    """Returns SQL expression for the monthly cost of the user tariff (NULL for unknown tariffs)"""
+    return db.case([(User.tariff == tariff.value["tariff_name"], tariff.value["cost"]) for tariff in Tariffs])
+
+
+def _debt(balance):
+    """SQL counterpart of 'stats.debt'"""
+    return db.case([(balance < 0, balance)], else_=0)
+
+
+def charge_range(period, first_id, last_id) -> tuple:
+    """
+    Charges activated users with ids in [first_id, last_id] who weren't charged for the period yet.
+    Ledger rows, balances and the dashboard counters are changed by set-based statements in one transaction,
+    so an interrupted run can be repeated without double charges.
+    Returns number of charged users and the charged amount.
+    :param period: billing period, 'YYYY-MM'
+    :type period: str
+    :param first_id: the first id of the range
+    :type first_id: int
+    :param last_id: the last id of the range (inclusive)
+    :type last_id: int
+    :raises ValueError: unable to save changes to the database
+    """
+    try:
+        # ledger rows inserted by this transaction have greater ids, the id range keeps out parallel workers
+        last_charge_id = db.session.query(db.func.coalesce(db.func.max(Charge.id), 0)).scalar()
+        cost = _tariff_cost()
+        not_charged = ~db.exists().where(db.and_(Charge.user_id == User.id, Charge.period == period))
+        db.session.execute(
+            Charge.__table__.insert().from_select(
+                ["user_id", "period", "tariff", "amount", "charged_at"],
+                db.select([User.id, db.literal(period), User.tariff, cost, db.literal(datetime.utcnow())]).where(
+                    db.and_(
+                        User.id.between(first_id, last_id),
+                        User.state == State.activated_state.value,
+                        cost.isnot(None),
+                        not_charged,
+                    )
+                ),
+            )
+        )
+
+        new_charges = db.and_(
+            Charge.id > last_charge_id, Charge.user_id.between(first_id, last_id), Charge.period == period
+        )
+        balance = db.func.coalesce(User.balance, 0)
+        charged, amount, debt_delta = (
+            db.session.query(
+                db.func.count(Charge.id),
+                db.func.coalesce(db.func.sum(Charge.amount), 0),
+                db.func.coalesce(db.func.sum(_debt(balance - Charge.amount) - _debt(balance)), 0),
+            )
+            .join(User, User.id == Charge.user_id)
+            .filter(new_charges)
+            .one()
+        )
+        if charged:
+            db.session.execute(
+                User.__table__.update()
+                .where(User.id.in_(db.select([Charge.user_id]).where(new_charges)))
+                .values(
+                    balance=balance
+                    - db.select([Charge.amount])
+                    .where(db.and_(Charge.user_id == User.id, Charge.period == period))
+                    .as_scalar(),
+                    version=User.version + 1,
+                )
+            )
+            increment(db.session.connection(), total_debt=debt_delta)
+        db.session.commit()
+    except Exception as charge_err:  # if unable to commit make rollback
+        db.session.rollback()
+        raise ValueError("Unable to charge users: {0}".format(charge_err)) from charge_err
+    return charged, amount
+
+
+def _charge_chunks(period, first_id, last_id, chunk_size) -> tuple:
+    """Charges the id range chunk by chunk, each chunk is committed separately. Returns totals of the range"""
+    charged, amount = 0, 0
+    for chunk_first_id, chunk_last_id in id_ranges(User.id, chunk_size, first_id, last_id):
+        chunk_charged, chunk_amount = charge_range(period, chunk_first_id, chunk_last_id)
+        charged, amount = charged + chunk_charged, amount + chunk_amount
+    return charged, amount
+
+
+def charge_period(period, chunk_size=10000, workers=1) -> tuple:
+    """
+    Charges every activated user the cost of the tariff for the period.
+    Users are split into 'workers' id ranges charged in parallel threads, every thread commits chunk by chunk.
+    Users who were already charged for the period are skipped, so the billing can be resumed.
+    Returns number of charged users and the charged amount.
+    :param period: billing period, 'YYYY-MM'
+    :type period: str
+    :param chunk_size: number of users charged in one transaction, defaults to 10000
+    :type chunk_size: int, optional
+    :param workers: number of parallel workers, defaults to 1
+    :type workers: int, optional
+    :raises ValueError: unable to save changes to the database
+    """
+    datetime.strptime(period, "%Y-%m")  # raises ValueError for a malformed period
+    min_id, max_id = db.session.query(db.func.min(User.id), db.func.max(User.id)).one()
+    if min_id is None:
+        return 0, 0
+    if workers <= 1:
+        return _charge_chunks(period, min_id, max_id, chunk_size)
+
+    app = current_app._get_current_object()
+    step = (max_id - min_id) // workers + 1
+
+    def charge_worker(first_id):
+        with app.app_context():  # every thread has its own session
+            return _charge_chunks(period, first_id, min(first_id + step - 1, max_id), chunk_size)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        totals = list(executor.map(charge_worker, range(min_id, max_id + 1, step)))
+    return sum(charged for charged, _ in totals), sum(amount for _, amount in totals)
@@ -0,0 +1,164 @@
+"""IP address pool models"""
+from ipaddress import ip_address, ip_network
+from flask import current_app
+from module import App
+
+
+db = App.db
+
+
+class IpRange(db.Model):
+    """
+    Configured CIDR ranges of the pool.
+    Addresses are handed out with a bump pointer ('next_offset'), so the range doesn't have to be pre-populated.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    network = db.Column(db.String(64), nullable=False, unique=True)
+    first = db.Column(db.BigInteger, nullable=False)  # integer value of the address before the first host
+    size = db.Column(db.Integer, nullable=False)  # number of host addresses in the range
+    next_offset = db.Column(db.Integer, nullable=False, default=0)  # number of already issued addresses
+
+    @classmethod
+    def sync(cls, ranges) -> None:
+        """
+        Adds missing CIDR ranges to the table. Existing ranges are left untouched.
+        :param ranges: list of CIDR ranges, e.g. ['10.0.0.0/16']
+        :type ranges: list
+        """
+        known = {row.network for row in db.session.query(cls.network)}
+        for cidr in ranges:
+            network = ip_network(cidr.strip())
+            if str(network) in known:
+                continue
+
+            if network.num_addresses > 2:  # skip network and broadcast addresses
+                first, size = int(network.network_address), network.num_addresses - 2
+            else:
+                first, size = int(network.network_address) - 1, network.num_addresses
+            db.session.add(cls(network=str(network), first=first, size=size, next_offset=0))
+        db.session.flush()
+
+    def __contains__(self, address) -> bool:
+        """Checks if the address was issued from this range"""
+        try:
+            return self.first < int(ip_address(address)) <= self.first + self.next_offset
+        except ValueError:  # not an ip address
+            return False
+
+    def __repr__(self) -> str:
+        """Returns representative string that displays the network and its usage"""
+        return "IP range {0}: {1}/{2} used".format(self.network, self.next_offset, self.size)
+
+
+class FreeIp(db.Model):
+    """Free-list of released addresses which can be issued again"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    address = db.Column(db.String(64), nullable=False, unique=True)
+
+    def __repr__(self) -> str:
+        """Returns representative string that displays the address"""
+        return "Free IP: {0}".format(self.address)
+
+
+def _take_free_ips(num) -> list:
+    """
+    Pops up to 'num' oldest addresses from the free-list. Every address is claimed by its own delete,
+    so an address taken by a concurrent transaction after the select is skipped and the others are returned:
+    the rowcount of a bulk delete doesn't tell which addresses are missing. The free-list only keeps
+    released addresses, so it's short. Rows are locked by the select where the database supports it
+    (skipping rows locked by concurrent transactions), SQLite serializes the deletes by its write lock.
+    """
+    free = (
+        db.session.query(FreeIp.id, FreeIp.address)
+        .order_by(FreeIp.id)
+        .limit(num)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    return [
+        row.address for row in free if db.session.query(FreeIp).filter_by(id=row.id).delete(synchronize_session=False)
+    ]
+
+
+def _bump_range(num) -> list:
+    """
+    Issues up to 'num' next never used addresses from a range which still has capacity.
+    Returns None if there is no such range and an empty list if the range was just filled by a concurrent transaction
+    """
+    rng = (
+        db.session.query(IpRange.id, IpRange.first, IpRange.size - IpRange.next_offset)
+        .filter(IpRange.next_offset < IpRange.size)
+        .order_by(IpRange.id)
+        .first()
+    )
+    if rng is None:
+        return None
+
+    count = min(num, rng[2])
+    claimed = (
+        db.session.query(IpRange)
+        .filter(IpRange.id == rng.id, IpRange.next_offset + count <= IpRange.size)
+        .update({IpRange.next_offset: IpRange.next_offset + count}, synchronize_session=False)
+    )
+    if not claimed:
+        return []
+
+    # the row is locked by the update, so the offset can't be changed by another transaction
+    offset = db.session.query(IpRange.next_offset).filter_by(id=rng.id).scalar()
+    return [str(ip_address(rng.first + i)) for i in range(offset - count + 1, offset + 1)]
+
+
+def reserve_ip() -> str:
+    """
+    Reserves an address from the pool. Released addresses are reused first, then ranges are filled in order.
+    Work is constant: one free-list pop and one range update, unless the range is filled by a concurrent transaction.
+    The reservation is a part of the current transaction and will be committed along with the user.
+    :raises ValueError: the pool is exhausted
+    """
+    return reserve_ips(1)[0]
+
+
+def reserve_ips(num) -> list:
+    """
+    Reserves 'num' addresses from the pool with a few statements: one free-list pop and one update per range.
+    The reservation is a part of the current transaction and will be committed along with the users.
+    :param num: number of addresses
+    :type num: int
+    :raises ValueError: the pool is exhausted
+    """
+    addresses = _take_free_ips(num)
+    synced = False
+    while len(addresses) < num:
+        issued = _bump_range(num - len(addresses))
+        if issued is None and synced:
+            raise ValueError("IP address pool is exhausted")
+        if issued is None:  # ranges may have been added to the config since the last reservation
+            IpRange.sync(current_app.config["IP_POOL_RANGES"])
+            synced = True
+        addresses += issued or []
+    return addresses
+
+
+def release_ip(address) -> None:
+    """
+    Returns an address to the free-list. Addresses that weren't issued by the pool are ignored.
+    The release is a part of the current transaction.
+    :param address: address to release
+    :type address: str
+    """
+    release_ips([address])
+
+
+def release_ips(addresses) -> None:
+    """
+    Returns addresses to the free-list with one statement. Addresses that weren't issued by the pool are ignored.
+    The release is a part of the current transaction.
+    :param addresses: addresses to release
+    :type addresses: list
+    """
+    ranges = IpRange.query.all()
+    released = [dict(address=address) for address in addresses if address and any(address in rng for rng in ranges)]
+    if released:
+        db.session.execute(FreeIp.__table__.insert(), released)
@@ -1,7 +1,12 @@
 """Models for store jwt tokens"""
+from threading import Lock
+from time import monotonic, time
 from datetime import datetime
+from flask import current_app
 from module import App
 from module.server.models import Base
+from module.server.metrics import register_cache
+from module.server.writer import apply_write, write_operation
 
 
 db = App.db
@@ -12,14 +17,153 @@ class TokenBlocklist(Base, db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, nullable=False)
-    jti = db.Column(db.String(36), nullable=False)
+    jti = db.Column(db.String(36), nullable=False, index=True, unique=True)
     reason = db.Column(db.String, nullable=False, server_default="Token has expired.")
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True)  # when the revoked token expires by itself
+
+    @classmethod
+    def purge_expired(cls, now=None) -> int:
+        """
+        Deletes rows of the tokens which have already expired, they are rejected without the blocklist.
+        Rows without expiration time are considered expired after 'JWT_ACCESS_TOKEN_EXPIRES' since revocation.
+        Returns number of deleted rows.
+        :param now: current utc time, defaults to None (datetime.utcnow())
+        :type now: datetime, optional
+        """
+        now = now or datetime.utcnow()
+        expired = db.or_(
+            cls.expires_at < now,
+            db.and_(
+                cls.expires_at.is_(None),
+                cls.created_at < now - current_app.config["JWT_ACCESS_TOKEN_EXPIRES"],
+            ),
+        )
+        deleted = cls.query.filter(expired).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+
+class BlocklistCache:
+    """
+    Per-worker cache of the revoked tokens.
+    Keeps jti of every revoked token with its expiration timestamp. The cache is warmed by the first check
+    and then updated incrementally by polling rows with id greater than the last seen one minus
+    'JWT_BLOCKLIST_POLL_OVERLAP', at most once per 'JWT_BLOCKLIST_POLL_INTERVAL' seconds: a row with a lower id
+    may commit after a row with a greater one, so the trailing ids are re-read. Tokens revoked by this worker
+    are added instantly.
+    """
+
+    def __init__(self):
+        self._revoked = dict()  # jti: exp timestamp (None if unknown)
+        self._last_id = 0
+        self._last_poll = None
+        self._lock = Lock()
+        self.hits = self.misses = 0  # checks answered from the cache and with polling
+
+    def add(self, jti, exp=None) -> None:
+        """
+        Marks token as revoked
+        :param jti: unique identifier of the token
+        :type jti: str
+        :param exp: expiration timestamp of the token, defaults to None
+        :type exp: int, optional
+        """
+        with self._lock:  # poll rebuilds the dict
+            self._revoked[jti] = exp
+
+    def poll(self) -> None:
+        """Loads tokens revoked since the last poll and drops expired ones"""
+        with self._lock:
+            now = time()
+            overlap = current_app.config["JWT_BLOCKLIST_POLL_OVERLAP"]
+            rows = (
+                db.session.query(TokenBlocklist.id, TokenBlocklist.jti, TokenBlocklist.expires_at)
+                .filter(TokenBlocklist.id > self._last_id - overlap)
+                .order_by(TokenBlocklist.id)
+                .all()
+            )
+            for row in rows:
+                exp = _timestamp(row.expires_at)
+                if exp is None or exp > now:
+                    self._revoked[row.jti] = exp
+            if rows:
+                self._last_id = max(self._last_id, rows[-1].id)
+
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp is None or exp > now}
+            self._last_poll = monotonic()
+
+    def is_revoked(self, jti) -> bool:
+        """
+        Checks if token is revoked. Hits the database only if poll interval has passed.
+        :param jti: unique identifier of the token
+        :type jti: str
+        """
+        if jti in self._revoked:
+            self.hits += 1
+            return True
+
+        interval = current_app.config["JWT_BLOCKLIST_POLL_INTERVAL"]
+        if self._last_poll is None or monotonic() - self._last_poll >= interval:
+            self.misses += 1
+            self.poll()
+        else:
+            self.hits += 1
+        return jti in self._revoked
+
+    def __len__(self) -> int:
+        """Returns number of the cached revoked tokens"""
+        return len(self._revoked)
+
+
+def _timestamp(dt):
+    """Converts naive utc datetime to timestamp"""
+    return None if dt is None else (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+def get_blocklist_cache() -> "BlocklistCache":
+    """Returns blocklist cache of the current app"""
+    return current_app.extensions.setdefault("jwt_blocklist_cache", BlocklistCache())
+
+
+def _blocklist_counts() -> tuple:
+    """Returns numbers of hits and misses of the blocklist cache of the current app"""
+    cache = current_app.extensions.get("jwt_blocklist_cache")
+    return (0, 0) if cache is None else (cache.hits, cache.misses)
+
+
+register_cache("jwt_blocklist", _blocklist_counts)
+
+
+def revoke_token(user_id, jwt_payload, reason="Logout") -> None:
+    """
+    Saves token to the blocklist and adds it to the cache
+    :param user_id: id of the token owner
+    :type user_id: int
+    :param jwt_payload: decoded token
+    :type jwt_payload: dict
+    :param reason: reason of the revocation, defaults to 'Logout'
+    :type reason: str, optional
+    :raises ValueError: the token cannot be saved in the database
+    """
+    exp = jwt_payload.get("exp")
+    apply_write("revoke_token", user_id, jwt_payload["jti"], reason, exp)
+    get_blocklist_cache().add(jwt_payload["jti"], exp)
+
+
+@write_operation("revoke_token")
+def _save_revoked_token(user_id, jti, reason, exp) -> None:
+    """Saves the revoked token to the blocklist, see revoke_token"""
+    token = TokenBlocklist(
+        user_id=user_id,
+        jti=jti,
+        reason=reason,
+        expires_at=datetime.utcfromtimestamp(exp) if exp else None,
+    )
+    token.save_to_db()
 
 
 @App.jwt.token_in_blocklist_loader
 def check_if_token_in_blocklist(jwt_handler, jwt_payload) -> bool:
     """Callback function to check if a JWT exists in the blocklist"""
-    jti = jwt_payload["jti"]
-    token = App.db.session.query(TokenBlocklist.id).filter_by(jti=jti).scalar()
-    return token is not None
+    return get_blocklist_cache().is_revoked(jwt_payload["jti"])
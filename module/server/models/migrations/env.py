@@ -69,6 +69,10 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info("No changes in schema detected.")
 
+    # the search index is a virtual table (and its shadow tables) created by the migration, not by the models
+    def include_object(object_, name, type_, reflected, compare_to):
+        return not (type_ == "table" and reflected and compare_to is None and name.startswith("user_search"))
+
     connectable = current_app.extensions["migrate"].db.engine
 
     with connectable.connect() as connection:
@@ -76,6 +80,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions["migrate"].configure_args
         )
 
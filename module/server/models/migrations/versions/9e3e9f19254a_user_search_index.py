@@ -0,0 +1,57 @@
+"""user search index
+
+Revision ID: 9e3e9f19254a
+Revises: 57d710a9f3b4
+Create Date: 2026-10-18 17:31:02.158411
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "9e3e9f19254a"
+down_revision = "57d710a9f3b4"
+branch_labels = None
+depends_on = None
+
+COLUMNS = "username, name, phone, email, address"
+NEW_VALUES = "new.username, new.name, new.phone, new.email, new.address"
+OLD_VALUES = "old.username, old.name, old.phone, old.email, old.address"
+
+
+def upgrade():
+    # FTS5 trigram index is available only in SQLite, other databases are searched without the index
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    op.execute(
+        "CREATE VIRTUAL TABLE user_search USING fts5({0}, content='user', content_rowid='id', "
+        "tokenize='trigram')".format(COLUMNS)
+    )
+    op.execute(
+        'CREATE TRIGGER user_search_insert AFTER INSERT ON "user" BEGIN '
+        "INSERT INTO user_search(rowid, {0}) VALUES (new.id, {1}); END".format(COLUMNS, NEW_VALUES)
+    )
+    op.execute(
+        'CREATE TRIGGER user_search_delete AFTER DELETE ON "user" BEGIN '
+        "INSERT INTO user_search(user_search, rowid, {0}) VALUES ('delete', old.id, {1}); END".format(
+            COLUMNS, OLD_VALUES
+        )
+    )
+    op.execute(
+        'CREATE TRIGGER user_search_update AFTER UPDATE OF {0} ON "user" BEGIN '
+        "INSERT INTO user_search(user_search, rowid, {0}) VALUES ('delete', old.id, {1}); "
+        "INSERT INTO user_search(rowid, {0}) VALUES (new.id, {2}); END".format(COLUMNS, OLD_VALUES, NEW_VALUES)
+    )
+    op.execute("INSERT INTO user_search(user_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    op.execute("DROP TRIGGER IF EXISTS user_search_update")
+    op.execute("DROP TRIGGER IF EXISTS user_search_delete")
+    op.execute("DROP TRIGGER IF EXISTS user_search_insert")
+    op.execute("DROP TABLE IF EXISTS user_search")
@@ -0,0 +1,35 @@
+"""charge user set null
+
+Revision ID: b5d1c2e8f0a7
+Revises: 103b413fb243
+Create Date: 2026-10-18 19:12:05.318420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b5d1c2e8f0a7"
+down_revision = "103b413fb243"
+branch_labels = None
+depends_on = None
+
+# the foreign key was created without a name
+naming_convention = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def upgrade():
+    with op.batch_alter_table("charge", schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.alter_column("user_id", existing_type=sa.Integer(), nullable=True)
+        batch_op.drop_constraint("fk_charge_user_id_user", type_="foreignkey")
+        batch_op.create_foreign_key("fk_charge_user_id_user", "user", ["user_id"], ["id"], ondelete="SET NULL")
+
+
+def downgrade():
+    # charges of the deleted users have no user, they are removed
+    op.execute("DELETE FROM charge WHERE user_id IS NULL")
+    with op.batch_alter_table("charge", schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint("fk_charge_user_id_user", type_="foreignkey")
+        batch_op.create_foreign_key("fk_charge_user_id_user", "user", ["user_id"], ["id"])
+        batch_op.alter_column("user_id", existing_type=sa.Integer(), nullable=False)
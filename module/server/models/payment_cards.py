@@ -2,6 +2,7 @@
 from datetime import datetime
 from module import App
 from module.server.models import Base, generate_uuid
+from module.server.models.stats import increment
 
 
 db = App.db
@@ -32,6 +33,9 @@ class Card(Base, db.Model):
 class UsedCard(Base, db.Model):
     """Used payment cards table"""
 
+    # payment history of the user is paginated by id
+    __table_args__ = (db.Index("ix_used_card_user_id_id", "user_id", "id"),)
+
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String, index=True, unique=True, default=generate_uuid)
     amount = db.Column(db.Integer, nullable=False, default=0)
@@ -53,3 +57,15 @@ class UsedCard(Base, db.Model):
     def __repr__(self) -> str:
         """Returns representative string that displays code, amount of the card, when and by whom it was used"""
         return "Card {0}: used by {1} at {2}. Code: {3}".format(self.uuid, self.user_id, self.used_at, self.code)
+
+
+@db.event.listens_for(Card, "after_insert")
+def count_inserted_card(mapper, connection, target) -> None:
+    """Updates dashboard counters after a card was created"""
+    increment(connection, num_non_used_cards=1)
+
+
+@db.event.listens_for(Card, "after_delete")
+def count_deleted_card(mapper, connection, target) -> None:
+    """Updates dashboard counters after a card was deleted"""
+    increment(connection, num_non_used_cards=-1)
@@ -0,0 +1,61 @@
+"""Times of the last writes of the users, shared by all workers for the read-your-writes routing to the replica"""
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from module import App
+from module.server.writer import apply_write, write_operation
+
+
+db = App.db
+
+
+class LastWrite(db.Model):
+    """Time of the last write of every user who has written, one row per user"""
+
+    identity = db.Column(db.String(36), primary_key=True)  # uuid of the user, the identity of the JWT
+    written_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def has_written(cls, identity, seconds) -> bool:
+        """
+        Checks if the user has written within the last 'seconds'
+        :param identity: uuid of the user
+        :type identity: str
+        :param seconds: length of the period
+        :type seconds: float
+        """
+        since = datetime.utcnow() - timedelta(seconds=seconds)
+        return (
+            db.session.query(cls.identity).filter(cls.identity == identity, cls.written_at >= since).first() is not None
+        )
+
+    def __repr__(self) -> str:
+        """Returns representative string that displays the user and the time of the write"""
+        return "Last write of {0} at {1}".format(self.identity, self.written_at)
+
+
+def mark_write(identity) -> None:
+    """
+    Saves the current time as the time of the last write of the user
+    :param identity: uuid of the user
+    :type identity: str
+    :raises ValueError: unable to save the time to the database
+    """
+    apply_write("mark_write", identity)
+
+
+@write_operation("mark_write")
+def _save_last_write(identity) -> None:
+    """Updates or inserts the time of the last write of the user, see mark_write"""
+    now = datetime.utcnow()
+    try:
+        try:
+            if not LastWrite.query.filter_by(identity=identity).update({LastWrite.written_at: now}):
+                db.session.add(LastWrite(identity=identity, written_at=now))
+            db.session.commit()
+        except IntegrityError:  # the first write of the user was saved by a concurrent request
+            db.session.rollback()
+            LastWrite.query.filter_by(identity=identity).update({LastWrite.written_at: now})
+            db.session.commit()
+    except Exception as save_err:  # if unable to commit make rollback
+        db.session.rollback()
+        raise ValueError("Unable to save the last write: {0}".format(save_err)) from save_err
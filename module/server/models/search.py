@@ -0,0 +1,130 @@
+"""Search index of the users"""
+from module import App
+from module.server.models.user import User
+
+
+db = App.db
+
+SEARCH_TABLE = "user_search"
+# bm25 weights of the indexed columns, matches in the username are the most relevant
+SEARCH_COLUMNS = dict(username=10.0, name=5.0, phone=3.0, email=2.0, address=1.0)
+MIN_WORD_LENGTH = 3  # trigrams can't match shorter words
+
+_columns = ", ".join(SEARCH_COLUMNS)
+_new_values = ", ".join("new." + column for column in SEARCH_COLUMNS)
+_old_values = ", ".join("old." + column for column in SEARCH_COLUMNS)
+
+# SQLite FTS5 index with the trigram tokenizer. The index doesn't store the values (content="user"),
+# it is maintained by the triggers, so the users inserted and changed by bulk statements are indexed too.
+CREATE_INDEX = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5({1}, content='user', content_rowid='id', "
+    "tokenize='trigram')".format(SEARCH_TABLE, _columns),
+    'CREATE TRIGGER IF NOT EXISTS {0}_insert AFTER INSERT ON "user" BEGIN '
+    "INSERT INTO {0}(rowid, {1}) VALUES (new.id, {2}); END".format(SEARCH_TABLE, _columns, _new_values),
+    'CREATE TRIGGER IF NOT EXISTS {0}_delete AFTER DELETE ON "user" BEGIN '
+    "INSERT INTO {0}({0}, rowid, {1}) VALUES ('delete', old.id, {2}); END".format(SEARCH_TABLE, _columns, _old_values),
+    'CREATE TRIGGER IF NOT EXISTS {0}_update AFTER UPDATE OF {1} ON "user" BEGIN '
+    "INSERT INTO {0}({0}, rowid, {1}) VALUES ('delete', old.id, {2}); "
+    "INSERT INTO {0}(rowid, {1}) VALUES (new.id, {3}); END".format(SEARCH_TABLE, _columns, _old_values, _new_values),
+    "INSERT INTO {0}({0}) VALUES ('rebuild')".format(SEARCH_TABLE),  # indexes the existing users
+)
+DROP_INDEX = (
+    "DROP TRIGGER IF EXISTS {0}_insert".format(SEARCH_TABLE),
+    "DROP TRIGGER IF EXISTS {0}_delete".format(SEARCH_TABLE),
+    "DROP TRIGGER IF EXISTS {0}_update".format(SEARCH_TABLE),
+    "DROP TABLE IF EXISTS {0}".format(SEARCH_TABLE),
+)
+
+for _statement in CREATE_INDEX:
+    db.event.listen(User.__table__, "after_create", db.DDL(_statement).execute_if(dialect="sqlite"))
+for _statement in DROP_INDEX:
+    db.event.listen(User.__table__, "before_drop", db.DDL(_statement).execute_if(dialect="sqlite"))
+
+
+def _words(text) -> list:
+    """Returns words of the search text which can be matched"""
+    return [word for word in text.split() if len(word) >= MIN_WORD_LENGTH]
+
+
+def _score(row, words) -> float:
+    """
+    Returns relevance of the user: sum of the weights of the columns containing the words.
+    Matches at the beginning of the value count twice, the whole value - three times.
+    """
+    score = 0
+    for column, weight in SEARCH_COLUMNS.items():
+        value = (getattr(row, column) or "").lower()
+        for word in words:
+            if value == word:
+                score += weight * 3
+            elif value.startswith(word):
+                score += weight * 2
+            elif word in value:
+                score += weight
+    return score
+
+
+def _search_ids(words, max_candidates) -> tuple:
+    """
+    Returns ids of the users matching every word with the FTS5 index, from the most to the least relevant,
+    and whether there are more matches than 'max_candidates'. Only the first 'max_candidates' matches are ranked:
+    the index returns them without visiting the other matches, so the time doesn't depend on how common the words are
+    (unlike bm25, which needs statistics of all matches).
+    """
+    match = " AND ".join('"{0}"'.format(word.replace('"', '""')) for word in words)
+    statement = db.text(
+        'SELECT u.id, {1} FROM "user" AS u JOIN '
+        "(SELECT rowid FROM {0} WHERE {0} MATCH :match LIMIT :max_candidates) AS found ON u.id = found.rowid".format(
+            SEARCH_TABLE, ", ".join("u." + column for column in SEARCH_COLUMNS)
+        )
+    )
+    # one extra match shows if the matches were truncated
+    rows = db.session.execute(statement, dict(match=match, max_candidates=max_candidates + 1)).fetchall()
+    truncated = len(rows) > max_candidates
+    rows = sorted(rows, key=lambda row: row.id)[:max_candidates] if truncated else rows
+    words = [word.lower() for word in words]
+    rows.sort(key=lambda row: (-_score(row, words), row.id))
+    return [row.id for row in rows], truncated
+
+
+def search_users_page(text, limit=20, offset=0, max_candidates=200) -> tuple:
+    """
+    Returns page of the users whose username, name, phone, email or address contain every word of the text
+    (case insensitive), the number of the ranked matches and whether there are more matches than 'max_candidates'.
+    Words shorter than 3 characters are ignored. Users are ordered from the most to the least relevant.
+    Only the first 'max_candidates' matches are ranked and paginated, so the pages past them are empty
+    and the text should be refined to find the other users. Other databases than SQLite are searched without the index.
+    :param text: search text, e.g. fragment of the name or the last digits of the phone
+    :type text: str
+    :param limit: max number of users, defaults to 20
+    :type limit: int, optional
+    :param offset: number of users to skip, defaults to 0
+    :type offset: int, optional
+    :param max_candidates: max number of matches which are ranked, defaults to 200
+    :type max_candidates: int, optional
+    """
+    words = _words(text)
+    if not words:
+        return [], 0, False
+
+    if db.engine.dialect.name != "sqlite":
+        columns = [getattr(User, column) for column in SEARCH_COLUMNS]
+        condition = db.and_(*(db.or_(*(column.ilike("%{0}%".format(word)) for column in columns)) for word in words))
+        query = db.session.query(User.id).filter(condition).order_by(User.id).limit(max_candidates + 1)
+        ids = [row.id for row in query]
+        truncated = len(ids) > max_candidates
+        ids = ids[:max_candidates]
+    else:
+        ids, truncated = _search_ids(words, max_candidates)
+
+    page = ids[offset : offset + limit]
+    users = {usr.id: usr for usr in User.query.filter(User.id.in_(page))} if page else {}
+    return [users[id_] for id_ in page if id_ in users], len(ids), truncated
+
+
+def search_users(text, limit=20, offset=0, max_candidates=200) -> list:
+    """
+    Returns users whose username, name, phone, email or address contain every word of the text,
+    see search_users_page for the parameters
+    """
+    return search_users_page(text, limit, offset, max_candidates)[0]
@@ -0,0 +1,82 @@
+"""Counters for the admin dashboard"""
+from module import App
+from module.server.replica import use_primary
+
+
+db = App.db
+
+COUNTERS = ("num_users", "num_active_users", "num_non_used_cards", "total_debt")
+
+
+class Stats(db.Model):
+    """
+    Incrementally maintained counters (one row per counter).
+    Counters are updated in the same transaction as the rows they count: by the User and Card mapper events
+    and by the set-based operations which bypass them (e.g. 'User.use_card').
+    """
+
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Float, nullable=False, default=0)
+
+    @staticmethod
+    def compute() -> dict:
+        """Computes counters from scratch with aggregate queries"""
+        from module.server.models.user import User, State
+        from module.server.models.payment_cards import Card
+
+        num_users, num_active_users, total_debt = db.session.query(
+            db.func.count(User.id),
+            db.func.coalesce(db.func.sum(db.case([(User.state == State.activated_state.value, 1)], else_=0)), 0),
+            db.func.coalesce(db.func.sum(db.case([(User.balance < 0, User.balance)], else_=0)), 0),
+        ).one()
+        return dict(
+            num_users=num_users,
+            num_active_users=num_active_users,
+            num_non_used_cards=db.session.query(db.func.count(Card.id)).scalar(),
+            total_debt=total_debt,
+        )
+
+    @classmethod
+    def rebuild(cls) -> dict:
+        """Recomputes and saves all counters. Returns the new values"""
+        values = cls.compute()
+        cls.query.delete()
+        db.session.add_all(cls(name=name, value=value) for name, value in values.items())
+        db.session.commit()
+        return values
+
+    @classmethod
+    def get(cls) -> dict:
+        """
+        Returns stored counters. They are built from scratch if they don't exist yet,
+        on the primary even if the request reads from the replica
+        """
+        values = {row.name: row.value for row in cls.query}
+        if set(values) != set(COUNTERS):
+            with use_primary():
+                values = cls.rebuild()
+        return dict(values, **{name: int(values[name]) for name in COUNTERS if name.startswith("num_")})
+
+    def __repr__(self) -> str:
+        """Returns representative string that displays the name and the value of the counter"""
+        return "Counter {0}: {1}".format(self.name, self.value)
+
+
+def increment(connection, **deltas) -> None:
+    """
+    Adds deltas to the counters within the transaction of the connection.
+    Bulk and core statements bypass the mapper events which keep the counters in sync,
+    so the code which runs them calls this function itself.
+    Counters which weren't built yet are left as is.
+    :param connection: connection of the current transaction
+    :param '**deltas': counter name and value to add, e.g. num_users=1
+    """
+    table = Stats.__table__
+    for name, delta in deltas.items():
+        if delta:
+            connection.execute(table.update().where(table.c.name == name).values(value=table.c.value + delta))
+
+
+def debt(balance) -> float:
+    """Returns part of the balance which counts as a debt"""
+    return min(balance or 0, 0)
@@ -1,14 +1,14 @@
 """User database model"""
 from enum import Enum
-from random import randint
-from datetime import datetime, timezone
-from flask import flash
+from datetime import datetime, time, timezone, timedelta
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from module import App
-from module.server import messages
-from module.server.models import generate_uuid, Base
+from module.server.hashing import get_hasher
+from module.server.writer import apply_write, get_writer, write_operation
+from module.server.models import generate_uuid, id_ranges, Base
 from module.server.models.payment_cards import Card, UsedCard
+from module.server.models.ip_pool import reserve_ip, release_ip, release_ips
+from module.server.models.stats import increment, debt
 
 
 db = App.db
@@ -24,6 +24,13 @@ class Tariffs(Enum):
     tariff_500m = dict(tariff_name="500m", cost=500)
 
 
+class Role(Enum):
+    """Available roles of the account"""
+
+    user_role = "user"
+    admin_role = "admin"
+
+
 class State(Enum):
     """Available states for the account"""
 
@@ -51,6 +58,8 @@ class User(Base, UserMixin, db.Model):
     :type tariff: class:'Tariffs', optional
     :param state: user account state, defaults to None
     :type state: class:'State', optional
+    :param role: user account role, defaults to None (class:'Role' user_role)
+    :type role: class:'Role', optional
     :param uuid: custom uuid of the user, defaults to None
     :type uuid: str, optional
     """
@@ -64,10 +73,18 @@ class User(Base, UserMixin, db.Model):
     username = db.Column(db.String(64), index=True, unique=True)
     password_hash = db.Column(db.String(128))
     tariff = db.Column(db.String(32))
-    ip = db.Column(db.String(64))
+    ip = db.Column(db.String(64), index=True, unique=True)
     address = db.Column(db.String(64))
-    state = db.Column(db.String(64), server_default=State.deactivated_state.value)
-    balance = db.Column(db.Float, default=0)
+    # previous values are loaded on change to keep the dashboard counters up to date
+    state = db.column_property(
+        db.Column(db.String(64), server_default=State.deactivated_state.value), active_history=True
+    )
+    balance = db.column_property(db.Column(db.Float, default=0), active_history=True)
+    role = db.Column(db.String(32), nullable=False, default=Role.user_role.value, server_default=Role.user_role.value)
+    # True if the account was deactivated by the debtors sweep, such accounts are reactivated once the debt is paid
+    suspended = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    # incremented on every change of the user, it is the validator (ETag) of the cached user info
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     used_cards = db.relationship("UsedCard", backref="user", lazy="dynamic")
 
@@ -82,6 +99,7 @@ class User(Base, UserMixin, db.Model):
         tariff=None,
         state=None,
         uuid=None,
+        role=None,
     ):
         self.uuid = uuid
         self.username = username
@@ -92,7 +110,9 @@ class User(Base, UserMixin, db.Model):
         self.tariff = tariff
         self.address = address
         self.state = state
-        self.set_ip()
+        self.role = role or Role.user_role.value
+        if get_writer() is None:  # otherwise the ip is reserved by the writer process along with the user
+            self.set_ip()
 
     def get_info(self) -> list:
         """Returns list of user information"""
@@ -107,6 +127,15 @@ class User(Base, UserMixin, db.Model):
             self.state,
         ]
 
+    @property
+    def is_admin(self) -> bool:
+        """Returns True if the user has admin role"""
+        return self.role == Role.admin_role.value
+
+    def get_claims(self) -> dict:
+        """Returns claims embedded into the access token, so authorization doesn't require loading the user"""
+        return dict(role=self.role)
+
     def change_state(self, deactivate=False) -> None:
         """
         Change state of the account.
@@ -114,35 +143,209 @@ class User(Base, UserMixin, db.Model):
             defaults to False
         :type deactivate: bool, optional
         """
+        writer = get_writer()
+        if writer is not None:
+            writer.submit("change_state", self.id, deactivate)
+            db.session.expire(self)  # the state changed by the writer process is loaded on access
+            return
         self.state = State.activated_state.value if not deactivate else State.deactivated_state.value
+        self.suspended = False  # the state set by the admin isn't changed by the debtors sweep
         db.session.commit()
 
-    def use_card(self, card_code) -> None:
+    @classmethod
+    def apply_choices(cls, choices) -> set:
+        """
+        Activates, deactivates and deletes users with a few grouped statements in one transaction.
+        Returns uuids of the users which were found.
+        :param choices: pairs of uuid and choice ('activate', 'deactivate' or 'delete'), every uuid at most once
+        :type choices: list
+        :raises ValueError: unable to save changes to the database
+        """
+        rows = (
+            db.session.query(cls.id, cls.uuid, cls.state, cls.balance, cls.ip)
+            .filter(cls.uuid.in_([uuid for uuid, _ in choices]))
+            .all()
+        )
+        rows_by_uuid = {row.uuid: row for row in rows}
+        grouped = dict(activate=[], deactivate=[], delete=[])
+        for uuid, choice in choices:
+            if uuid in rows_by_uuid:
+                grouped[choice].append(rows_by_uuid[uuid])
+
+        try:
+            connection = db.session.connection()
+            was_active = cls.state == State.activated_state.value
+            was_inactive = db.or_(cls.state.is_(None), cls.state != State.activated_state.value)
+            for choice, state in (
+                ("activate", State.activated_state.value),
+                ("deactivate", State.deactivated_state.value),
+            ):
+                if grouped[choice]:
+                    chosen = db.session.query(cls).filter(cls.id.in_([row.id for row in grouped[choice]]))
+                    values = {cls.state: state, cls.suspended: False, cls.version: cls.version + 1}
+                    activate = _is_active(state)
+                    # the states selected above may have been changed by concurrent requests since then,
+                    # so the counter is updated by the number of rows the statement has changed the state of.
+                    # Rows which keep the state go first: after the update they match the other condition
+                    chosen.filter(was_active if activate else was_inactive).update(values, synchronize_session=False)
+                    changed = chosen.filter(was_inactive if activate else was_active).update(
+                        values, synchronize_session=False
+                    )
+                    increment(connection, num_active_users=changed if activate else -changed)
+
+            if grouped["delete"]:
+                ids = [row.id for row in grouped["delete"]]
+                # the same as the relationship does on delete of the user
+                db.session.query(UsedCard).filter(UsedCard.user_id.in_(ids)).update(
+                    {UsedCard.user_id: None}, synchronize_session=False
+                )
+                # the users selected above may have been changed or deleted by concurrent requests since then,
+                # so they are selected again within the transaction and locked until the delete
+                deleted = (
+                    db.session.query(cls.state, cls.balance, cls.ip).filter(cls.id.in_(ids)).with_for_update().all()
+                )
+                release_ips([row.ip for row in deleted])
+                detach_charges(ids)
+                num_deleted = db.session.query(cls).filter(cls.id.in_(ids)).delete(synchronize_session=False)
+                increment(
+                    connection,
+                    num_users=-num_deleted,
+                    num_active_users=-sum(_is_active(row.state) for row in deleted),
+                    total_debt=-sum(debt(row.balance) for row in deleted),
+                )
+            db.session.commit()
+        except Exception as apply_err:  # if unable to commit make rollback
+            db.session.rollback()
+            raise ValueError("Unable to apply choices: {0}".format(apply_err)) from apply_err
+        return set(rows_by_uuid)
+
+    @classmethod
+    def _sweep_range(cls, first_id, last_id, condition, state) -> list:
+        """
+        Sets the state of the users with ids in [first_id, last_id] matching the condition in one short transaction.
+        Deactivated users are marked as suspended. Returns uuids of the changed users.
+        :raises ValueError: unable to save changes to the database
+        """
+        in_range = cls.id.between(first_id, last_id)
+        rows = db.session.query(cls.id, cls.uuid).filter(in_range, condition).all()
+        if not rows:  # nothing to change - the write lock isn't taken at all
+            return []
+
+        try:
+            ids = [row.id for row in rows]
+            changed = (
+                db.session.query(cls)
+                .filter(cls.id.in_(ids), condition)
+                .update(
+                    {cls.state: state, cls.suspended: not _is_active(state), cls.version: cls.version + 1},
+                    synchronize_session=False,
+                )
+            )
+            if changed != len(rows):  # some users were changed by concurrent requests after they were selected
+                rows = db.session.query(cls.id, cls.uuid).filter(cls.id.in_(ids), cls.state == state).all()
+            increment(db.session.connection(), num_active_users=changed if _is_active(state) else -changed)
+            db.session.commit()
+        except Exception as sweep_err:  # if unable to commit make rollback
+            db.session.rollback()
+            raise ValueError("Unable to change state: {0}".format(sweep_err)) from sweep_err
+        return [row.uuid for row in rows]
+
+    @classmethod
+    def sweep_debtors(cls, threshold=0, chunk_size=10000) -> dict:
+        """
+        Deactivates activated users whose balance is less than the threshold and reactivates users
+        deactivated by the previous sweeps whose balance has recovered (e.g. after a card was used).
+        Users are changed chunk by chunk with set-based statements, every chunk is a separate short transaction,
+        so card redemptions aren't stalled by the sweep.
+        Returns uuids of the deactivated and the reactivated users.
+        :param threshold: min balance of the activated account, defaults to 0
+        :type threshold: float, optional
+        :param chunk_size: number of users checked in one transaction, defaults to 10000
+        :type chunk_size: int, optional
+        :raises ValueError: unable to save changes to the database
+        """
+        balance = db.func.coalesce(cls.balance, 0)
+        actions = dict(
+            deactivated=(
+                db.and_(cls.state == State.activated_state.value, balance < threshold),
+                State.deactivated_state.value,
+            ),
+            reactivated=(
+                db.and_(cls.suspended.is_(True), cls.state == State.deactivated_state.value, balance >= threshold),
+                State.activated_state.value,
+            ),
+        )
+        summary = {action: [] for action in actions}
+        for first_id, last_id in id_ranges(cls.id, chunk_size):
+            for action, (condition, state) in actions.items():
+                summary[action] += cls._sweep_range(first_id, last_id, condition, state)
+        return summary
+
+    def use_card(self, card_code) -> bool:
         """
         Add money to the user's balance and makes the card inactive if the card code exists in the database.
+        The card is claimed, moved to the used cards and the balance is replenished in a single transaction,
+        so the same card can't be used twice even by concurrent requests. If the write queue is enabled,
+        the card is used by the writer process.
+        Returns True if the balance was replenished, False if the card code is wrong or the card was already used.
         :param card_code: card code to activate it.
         :type card_code: str
+        :raises ValueError: unable to save changes to the database
         """
-        card = Card.get_card_by_code(code=card_code)
-        if card:  # if code is correct
-            self.balance += card.amount
-            used = UsedCard(
-                amount=card.amount,
-                code=card_code,
-                balance_after_use=self.balance,
-                used_at=datetime.now(timezone.utc),
-                user_id=self.id,
-            )
+        replenished = apply_write("use_card", self.id, card_code)
+        if replenished:
+            db.session.expire(self)  # the new balance will be loaded on access
+        return replenished
 
-            used.save_to_db()
-            card.delete_from_db()
-            flash(messages["card_success_code"], "info")
-        else:
-            flash(messages["card_wrong_code"], "warning")
+    @classmethod
+    def get_version(cls, uuid) -> int:
+        """
+        Returns version of the user by it's uuid if any, otherwise None. The user itself isn't loaded
+        :param uuid: uuid of the user
+        :type uuid: str
+        """
+        return db.session.query(cls.version).filter_by(uuid=uuid).scalar()
 
-    def get_history(self) -> list:
-        """Returns payments history (last 10 rows)"""
-        return self.used_cards.order_by(UsedCard.id.desc()).limit(10)
+    @classmethod
+    def get_history_version(cls, uuid) -> int:
+        """
+        Returns id of the last used card of the user (0 if the history is empty) by the user's uuid,
+        None if the user doesn't exist. Payments are never changed, so the id is the version of the history.
+        The (user_id, id) index is used, so neither the user nor the history is loaded
+        :param uuid: uuid of the user
+        :type uuid: str
+        """
+        last_card_id = db.select([db.func.coalesce(db.func.max(UsedCard.id), 0)]).where(UsedCard.user_id == cls.id)
+        row = db.session.query(cls.id, last_card_id.as_scalar()).filter(cls.uuid == uuid).first()
+        return row[1] if row else None
+
+    def get_history(self, limit=10, before=None, after=None, date_from=None, date_to=None) -> list:
+        """
+        Returns page of the payments history, from newest to oldest (last 10 rows by default).
+        Pages are selected by id with the (user_id, id) index, so any page is fetched with the same cost.
+        :param limit: max number of rows, defaults to 10
+        :type limit: int, optional
+        :param before: id of the row, only older rows will be returned, defaults to None
+        :type before: int, optional
+        :param after: id of the row, only the closest newer rows will be returned, defaults to None
+        :type after: int, optional
+        :param date_from: the earliest date of the payment (inclusive), defaults to None
+        :type date_from: date, optional
+        :param date_to: the latest date of the payment (inclusive), defaults to None
+        :type date_to: date, optional
+        """
+        history = UsedCard.query.filter(UsedCard.user_id == self.id)
+        if date_from:
+            history = history.filter(UsedCard.used_at >= datetime.combine(date_from, time.min))
+        if date_to:
+            history = history.filter(UsedCard.used_at < datetime.combine(date_to, time.min) + timedelta(days=1))
+
+        if after is not None:
+            page = history.filter(UsedCard.id > after).order_by(UsedCard.id).limit(limit).all()
+            return page[::-1]
+        if before is not None:
+            history = history.filter(UsedCard.id < before)
+        return history.order_by(UsedCard.id.desc()).limit(limit).all()
 
     def set_password(self, password) -> None:
         """
@@ -151,31 +354,67 @@ class User(Base, UserMixin, db.Model):
         :param password: the password by which the user will be logged in in the future
         :type password: str
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_hasher().hash(password)
 
     def check_password(self, password) -> bool:
         """
         Compare password hash with string "password".
         Returns true if they match. Otherwise - false.
+        If the hash was made with outdated method or cost, the password is rehashed and saved.
         :param password: the password you need to compare with the current user password
         :type password: str
+        :raises RuntimeError: all password hashing slots are busy
         """
-        return check_password_hash(self.password_hash, password)
+        hasher = get_hasher()
+        if not hasher.verify(self.password_hash, password):
+            return False
+
+        if hasher.needs_rehash(self.password_hash):
+            self.set_password(password)
+            try:
+                db.session.commit()
+            except Exception:  # the old hash is still valid, so login doesn't fail
+                db.session.rollback()
+        return True
 
-    def set_ip(self, test_ip=None) -> None:
+    def set_ip(self) -> None:
         """
-        Generates and sets a random ip.
-        :param test_ip: ip address that can be entered manually, defaults to None
-        :type test_ip:str, optional
+        Reserves a new ip from the pool and releases the previous one (if any).
+        Changes are committed along with the user.
+        :raises ValueError: the ip pool is exhausted
         """
-        rand_ip = ".".join([str(randint(0, 255)) for _ in range(4)]) if not test_ip else test_ip
-        # if such ip doesn't yet exist and there is no test ip
-        if not db.session.query(User).filter_by(ip=rand_ip).first() and not test_ip:
-            self.ip = rand_ip
-            db.session.commit()
-            return
+        prev_ip = self.ip
+        self.ip = reserve_ip()
+        release_ip(prev_ip)
+
+    def save_to_db(self):
+        """
+        Save user to db. If the write queue is enabled, a new user is created by the writer process
+        with the ip reserved there, and this object becomes the persistent user.
+        :raises ValueError: the user cannot be saved in the database
+        """
+        writer = get_writer()
+        if writer is None or db.inspect(self).persistent:
+            return super().save_to_db()
+        values = {attr.key: getattr(self, attr.key) for attr in db.inspect(User).column_attrs if attr.key in vars(self)}
+        self.id = writer.submit("create_user", values)
+        db.make_transient_to_detached(self)
+        db.session.add(self)
+        db.session.expire(self)
 
-        self.set_ip()  # otherwise run this function again
+    def delete_from_db(self):
+        """
+        Delete user from db and return his ip to the pool
+        :raises ValueError: the user cannot be deleted from the database
+        """
+        writer = get_writer()
+        if writer is not None:
+            writer.submit("delete_user", self.id)
+            db.session.expunge(self)
+            return
+        release_ip(self.ip)
+        detach_charges([self.id])
+        super().delete_from_db()
 
     @classmethod
     def get_user_by_username(cls, username) -> "User":
@@ -191,6 +430,121 @@ class User(Base, UserMixin, db.Model):
         return "User: {}".format(self.username)
 
 
+def _is_active(state) -> int:
+    """Returns 1 if the state is activated, otherwise 0"""
+    return int(state == State.activated_state.value)
+
+
+@write_operation("use_card")
+def _use_card(user_id, card_code) -> bool:
+    """Replenishes the balance of the user with the card, see User.use_card"""
+    card = db.session.query(Card.id, Card.amount).filter_by(code=card_code).first()
+    if not card:  # if code is wrong
+        return False
+
+    try:
+        if not db.session.query(Card).filter_by(id=card.id).delete(synchronize_session=False):
+            # the card has just been used by a concurrent request
+            db.session.rollback()
+            return False
+
+        db.session.query(User).filter_by(id=user_id).update(
+            {User.balance: db.func.coalesce(User.balance, 0) + card.amount, User.version: User.version + 1},
+            synchronize_session=False,
+        )
+        balance = db.session.query(User.balance).filter_by(id=user_id).scalar()
+        increment(
+            db.session.connection(),
+            num_non_used_cards=-1,
+            total_debt=debt(balance) - debt(balance - card.amount),
+        )
+        db.session.add(
+            UsedCard(
+                amount=card.amount,
+                code=card_code,
+                balance_after_use=balance,
+                used_at=datetime.now(timezone.utc),
+                user_id=user_id,
+            )
+        )
+        db.session.commit()
+    except Exception as use_err:  # if unable to commit make rollback
+        db.session.rollback()
+        raise ValueError("Unable to use card: {0}".format(use_err)) from use_err
+    return True
+
+
+@write_operation("change_state")
+def _change_state(user_id, deactivate) -> None:
+    """Changes state of the user, see User.change_state"""
+    user = db.session.query(User).get(user_id)
+    if user is None:
+        raise ValueError("Unable to change state: the user doesn't exist")
+    user.change_state(deactivate)
+
+
+@write_operation("create_user")
+def _create_user(values) -> int:
+    """Creates the user with the column values, the ip is reserved from the pool. Returns id of the user"""
+    user = db.inspect(User).class_manager.new_instance()
+    for key, value in values.items():
+        setattr(user, key, value)
+    user.set_ip()
+    user.save_to_db()
+    return user.id
+
+
+def detach_charges(ids) -> None:
+    """
+    Keeps charges of the users who are deleted in the ledger without the user, so their ids may be reused
+    :param ids: ids of the users
+    :type ids: list
+    """
+    from module.server.models.billing import Charge  # the billing models depend on the user model
+
+    db.session.query(Charge).filter(Charge.user_id.in_(ids)).update({Charge.user_id: None}, synchronize_session=False)
+
+
+@write_operation("delete_user")
+def _delete_user(user_id) -> None:
+    """Deletes the user and returns the ip to the pool, see User.delete_from_db"""
+    user = db.session.query(User).get(user_id)
+    if user is None:
+        raise ValueError("Unable to delete user: the user doesn't exist")
+    user.delete_from_db()
+
+
+@db.event.listens_for(User, "after_insert")
+def count_inserted_user(mapper, connection, target) -> None:
+    """Updates dashboard counters after a user was created"""
+    increment(connection, num_users=1, num_active_users=_is_active(target.state), total_debt=debt(target.balance))
+
+
+@db.event.listens_for(User, "before_update")
+def bump_version(mapper, connection, target) -> None:
+    """Increments the version of a user whose columns were changed"""
+    if db.object_session(target).is_modified(target, include_collections=False):
+        target.version = User.version + 1
+
+
+@db.event.listens_for(User, "after_update")
+def count_updated_user(mapper, connection, target) -> None:
+    """Updates dashboard counters after the state or the balance of a user was changed"""
+    state, balance = db.inspect(target).attrs.state.history, db.inspect(target).attrs.balance.history
+    deltas = dict()
+    if state.deleted:
+        deltas["num_active_users"] = _is_active(target.state) - _is_active(state.deleted[0])
+    if balance.deleted:
+        deltas["total_debt"] = debt(target.balance) - debt(balance.deleted[0])
+    increment(connection, **deltas)
+
+
+@db.event.listens_for(User, "before_delete")
+def count_deleted_user(mapper, connection, target) -> None:
+    """Updates dashboard counters when a user is deleted"""
+    increment(connection, num_users=-1, num_active_users=-_is_active(target.state), total_debt=-debt(target.balance))
+
+
 @login_manager.user_loader
 def load_user(id_) -> "User":
     """Flask-Login user loader function"""
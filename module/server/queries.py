@@ -0,0 +1,121 @@
+"""SQL instrumentation: slow query log, detector of repeated queries (N+1) and query capturing for the tests"""
+import os
+import sys
+from time import perf_counter
+from contextlib import contextmanager
+from flask import g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # ../module
+MAX_PARAMETERS_LENGTH = 1000  # longer parameters (e.g. of bulk statements) are truncated in the log
+
+
+def call_site() -> str:
+    """Returns 'path:line in function' of the innermost frame of the project code (or template) which made the query"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if path.startswith(PROJECT_DIR) and path != __file__:
+            return "{0}:{1} in {2}".format(os.path.relpath(path, PROJECT_DIR), frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+    return "unknown"
+
+
+def format_parameters(parameters) -> str:
+    """Returns bound parameters of the statement for the log"""
+    text = repr(parameters)
+    if len(text) > MAX_PARAMETERS_LENGTH:
+        text = text[:MAX_PARAMETERS_LENGTH] + "... ({0} characters)".format(len(text))
+    return text
+
+
+class SqlMonitor:
+    """
+    Opt-in instrumentation of the engine of the app. Logs warnings about:
+    - statements slower than the threshold, with their bound parameters and the call site;
+    - statements repeated within one request, e.g. lazy loads in a loop (N+1 queries).
+    Statements are compared by their text, bound parameters are not included.
+
+    :param slow_threshold: statements longer than threshold (in seconds) are logged, defaults to None (disabled)
+    :type slow_threshold: float, optional
+    :param repeat_threshold: statement is logged when it's repeated this many times within one request,
+        defaults to None (disabled)
+    :type repeat_threshold: int, optional
+    """
+
+    def __init__(self, slow_threshold=None, repeat_threshold=None):
+        self.slow_threshold = slow_threshold
+        self.repeat_threshold = repeat_threshold
+        self.logger = None
+
+    def init_app(self, app, db) -> None:
+        """
+        Instruments the engine of the app
+        :param app: flask app
+        :type app: Flask
+        :param db: database of the app
+        :type db: SQLAlchemy
+        """
+        self.logger = app.logger
+        app.extensions["sql_monitor"] = self
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+        with app.app_context():
+            engine = db.get_engine(app)
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+
+    def before_request(self) -> None:
+        """Starts counting statements of the request"""
+        g.sql_statements = dict()
+
+    def teardown_request(self, exc) -> None:
+        """Stops counting statements of the request"""
+        g.pop("sql_statements", None)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        """Saves start time of the statement"""
+        conn.info["sql_monitor_start"] = perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        """Logs the statement if it's slow or repeated"""
+        elapsed = perf_counter() - conn.info.pop("sql_monitor_start", perf_counter())
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            self.logger.warning(
+                "Slow query (%.3f s) at %s: %s; parameters: %s",
+                elapsed,
+                call_site(),
+                statement,
+                format_parameters(parameters),
+            )
+
+        statements = g.get("sql_statements") if self.repeat_threshold and has_app_context() else None
+        if statements is not None:
+            count = statements[statement] = statements.get(statement, 0) + 1
+            if count == self.repeat_threshold:
+                self.logger.warning(
+                    "Possible N+1 query: repeated %s times by %s at %s: %s",
+                    count,
+                    request.endpoint if has_request_context() else None,
+                    call_site(),
+                    statement,
+                )
+
+
+@contextmanager
+def capture_queries(engine):
+    """
+    Collects text of every statement executed by the engine within the block
+    :param engine: engine of the database
+    :type engine: Engine
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "after_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "after_cursor_execute", record)
@@ -0,0 +1,185 @@
+"""Routing of the read-only queries to a replica database with read-your-writes stickiness"""
+import sqlite3
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_app_context, request
+from flask_login import current_user
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.sql.expression import SelectBase, TextClause
+
+REPLICA_BIND = "replica"  # key of the replica engine in SQLALCHEMY_BINDS
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")  # requests which don't change the database
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session which reads from the replica when the request allows it. Only SELECT statements are routed:
+    flushes, bulk and core statements use the primary, and so do the rest of the statements of the request,
+    so the request reads its own writes
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        self._replica = None
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        """Returns the replica engine for reads of the requests routed to the replica, otherwise the primary one"""
+        if has_app_context() and g.get("read_replica"):
+            if not self._flushing and is_select(clause):
+                if self._replica is None:
+                    self._replica = self.db.get_engine(self.app, bind=REPLICA_BIND)
+                return self._replica
+            g.read_replica = False  # the request has written
+        return super().get_bind(mapper, clause)
+
+
+def is_select(clause) -> bool:
+    """
+    Returns True if the statement only reads. Under SQLAlchemy 1.3 bulk updates and deletes of the Query
+    are plain Update and Delete constructs, so the statements are checked by their type
+    :param clause: statement passed to 'Session.get_bind', None if unknown
+    """
+    if isinstance(clause, SelectBase):
+        return True
+    return isinstance(clause, TextClause) and clause.text.lstrip()[:6].upper() == "SELECT"
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with sessions routing reads to the replica"""
+
+    def create_session(self, options):
+        """Returns factory of the routing sessions"""
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class Replica:
+    """
+    Read replica of the app database. Reads of the requests which called 'use_replica' go to the replica,
+    unless the request may change the database or the user has changed it within the sticky period:
+    the user's own writes may be not replicated yet. The time of the last write of the user (the JWT identity
+    or the logged in user of the views) is saved in the primary database after every successful unsafe request,
+    so every worker routes the next reads of the user to the primary, whether the client keeps cookies or not.
+
+    :param sticky_seconds: how long (in seconds) the user reads from the primary after their write, defaults to 5
+    :type sticky_seconds: float, optional
+    """
+
+    def __init__(self, sticky_seconds=5):
+        self.sticky_seconds = sticky_seconds
+
+    def init_app(self, app, db) -> None:
+        """
+        Registers request hooks, connections to the SQLite replica are made read-only
+        :param app: flask app, the replica url must be in SQLALCHEMY_BINDS
+        :type app: Flask
+        :param db: database of the app
+        :type db: RoutingSQLAlchemy
+        """
+        app.extensions["replica"] = self
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        with app.app_context():
+            engine = db.get_engine(app, bind=REPLICA_BIND)
+        if engine.url.drivername == "sqlite":
+            event.listen(engine, "connect", self.connect)
+
+    @staticmethod
+    def connect(dbapi_connection, connection_record) -> None:
+        """Forbids writes to the replica"""
+        dbapi_connection.execute("PRAGMA query_only = 1")
+
+    def is_sticky(self, identity) -> bool:
+        """
+        Returns True if the user has changed the database within the sticky period, the time is read from the primary
+        :param identity: uuid of the user, None for anonymous clients
+        :type identity: str
+        """
+        from module.server.models.replica import LastWrite  # models depend on the app
+
+        if identity is None or self.sticky_seconds <= 0:
+            return False
+        return LastWrite.has_written(identity, self.sticky_seconds)
+
+    def after_request(self, response):
+        """Saves the time of the user's write"""
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            identity = get_identity()
+            if identity is not None:
+                from module.server.models.replica import mark_write
+
+                try:
+                    mark_write(identity)
+                except ValueError as mark_err:  # the write itself has succeeded, only the next reads may be stale
+                    current_app.logger.warning("Unable to save the last write of %s: %s", identity, mark_err)
+        return response
+
+    @staticmethod
+    def teardown_request(exc) -> None:
+        """Routes the queries of the next request to the primary"""
+        g.pop("read_replica", None)
+
+
+def get_identity():
+    """Returns uuid of the user: the JWT identity of the API requests or the logged in user of the views, if any"""
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:  # the endpoint doesn't verify JWT
+        identity = None
+    if identity is None and current_user.is_authenticated:
+        identity = current_user.uuid
+    return identity
+
+
+def use_replica() -> bool:
+    """
+    Routes the rest of the request reads (including the streamed response) to the replica if it's configured,
+    the request doesn't change the database and the user hasn't changed it within the sticky period.
+    Returns True if the reads are routed to the replica.
+    """
+    replica = current_app.extensions.get("replica")
+    if replica is None or request.method not in SAFE_METHODS or replica.is_sticky(get_identity()):
+        return False
+    g.read_replica = True
+    return True
+
+
+@contextmanager
+def use_primary():
+    """Routes the reads within the block to the primary, e.g. the reads whose results are written back"""
+    routed = g.pop("read_replica", None) if has_app_context() else None
+    try:
+        yield
+    finally:
+        if routed:
+            g.read_replica = routed
+
+
+def read_replica(func):
+    """Decorator of the read-only views, their reads are routed to the replica, see use_replica"""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        use_replica()
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def copy_database(source, target) -> None:
+    """
+    Copies the SQLite database with the backup API. The copy is consistent even if the source is written meanwhile,
+    readers of the target see either the previous copy or the new one.
+    :param source: path of the primary database
+    :type source: str
+    :param target: path of the replica
+    :type target: str
+    """
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
@@ -0,0 +1,81 @@
+"""SQLite profile for a file database shared by several worker processes"""
+from sqlalchemy import event
+
+# the first statement of these kinds makes the transaction a write transaction
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER", "SAVEPOINT")
+
+
+def is_write(statement) -> bool:
+    """Returns True if the statement changes the database"""
+    return statement.lstrip()[:9].upper().startswith(WRITE_STATEMENTS)
+
+
+class SqliteProfile:
+    """
+    Applies pragmas to every new connection of the engine and controls how transactions begin.
+    pysqlite begins a deferred transaction right before INSERT, UPDATE, DELETE and REPLACE statements only,
+    so savepoints and DDL statements begin their own deferred transactions whose lock upgrades may fail
+    immediately ("database is locked") regardless of the busy timeout. With 'immediate_writes' the profile
+    begins transactions itself: like pysqlite, reads outside a write transaction run in autocommit mode and see
+    the latest commits, but the first write of any kind takes the write lock with BEGIN IMMEDIATE, waiting for it
+    up to the busy timeout.
+
+    :param pragmas: pragmas executed on every new connection, e.g. {"journal_mode": "wal"}, defaults to None
+    :type pragmas: dict, optional
+    :param immediate_writes: begin write transactions with BEGIN IMMEDIATE, defaults to True
+    :type immediate_writes: bool, optional
+    """
+
+    def __init__(self, pragmas=None, immediate_writes=True):
+        self.pragmas = pragmas or dict()
+        self.immediate_writes = immediate_writes
+
+    def init_app(self, app, db) -> None:
+        """
+        Configures the engine of the app, connections opened before aren't changed
+        :param app: flask app
+        :type app: Flask
+        :param db: database of the app
+        :type db: SQLAlchemy
+        """
+        app.extensions["sqlite_profile"] = self
+        with app.app_context():
+            engine = db.get_engine(app)
+        event.listen(engine, "connect", self.connect)
+        if self.immediate_writes:
+            event.listen(engine, "begin", self.begin)
+            event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(engine, "commit", self.end)
+            event.listen(engine, "rollback", self.end)
+            event.listen(engine, "checkin", self.checkin)
+
+    def connect(self, dbapi_connection, connection_record) -> None:
+        """Applies the pragmas to the new connection"""
+        if self.immediate_writes:
+            dbapi_connection.isolation_level = None  # pysqlite doesn't begin transactions itself
+        cursor = dbapi_connection.cursor()
+        for name, value in self.pragmas.items():
+            cursor.execute("PRAGMA {0} = {1}".format(name, value))
+        cursor.close()
+
+    @staticmethod
+    def begin(conn) -> None:
+        """Postpones the BEGIN until the first write"""
+        conn.info["sqlite_transaction"] = "pending"
+
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        """Begins the transaction with BEGIN IMMEDIATE before its first write"""
+        if conn.info.get("sqlite_transaction") == "pending" and is_write(statement):
+            cursor.execute("BEGIN IMMEDIATE")
+            conn.info["sqlite_transaction"] = "write"
+
+    @staticmethod
+    def end(conn) -> None:
+        """Forgets the finished transaction"""
+        conn.info.pop("sqlite_transaction", None)
+
+    @staticmethod
+    def checkin(dbapi_connection, connection_record) -> None:
+        """Forgets the transaction rolled back by the pool"""
+        connection_record.info.pop("sqlite_transaction", None)
@@ -2,6 +2,7 @@
 Init blueprint for the admin view.
 Routes:
     /admin/ - admin cabinet
+    /admin/search - typeahead for the user search
     /admin/register - register form
 """
 from flask import Blueprint
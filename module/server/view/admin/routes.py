@@ -2,6 +2,7 @@
 from uuid import uuid4
 from flask import (
     render_template,
+    jsonify,
     redirect,
     url_for,
     request,
@@ -18,7 +19,9 @@ from module.server.view.admin.forms import (
     RegisterForm,
 )
 from module.server.models.user import User, Tariffs, State
-from module.server.models.payment_cards import Card
+from module.server.models.stats import Stats
+from module.server.models.search import search_users
+from module.server.replica import use_replica
 
 
 @bp.route("/", methods=["GET", "POST"])
@@ -32,7 +35,7 @@ def admin_view():
     he will be automatically redirected to the cabinet page.
     Methods: GET, POST
     """
-    if current_user.username != "admin":  # If current user is not admin redirect him to the cabinet
+    if not current_user.is_admin:  # If current user is not admin redirect him to the cabinet
         return redirect(url_for("cabinet.cabinet_view"))
 
     search_form = SearchUserForm()
@@ -58,13 +61,10 @@ def admin_view():
             user.delete_from_db()
             flash(messages["success"], "info")
 
-    # Data for the table with main info
-    data_general_table = dict(
-        num_users=len(User.query.all()),
-        num_active_users=len(User.query.filter_by(state=State.activated_state.value).all()),
-        num_non_used_cards=len(Card.query.all()),
-        total_debt=sum(debt_acc.balance for debt_acc in User.query.filter(User.balance < 0).all()),
-    )
+    # Data for the table with main info, aggregates of GET requests may be a bit stale and are read from the replica
+    use_replica()
+    # stored counters don't depend on the number of users, aggregate queries are used if they are disabled
+    data_general_table = Stats.get() if current_app.config["DASHBOARD_COUNTERS"] else Stats.compute()
 
     return render_template(
         "admin/admin.html",
@@ -76,6 +76,23 @@ def admin_view():
     )
 
 
+@bp.route("/search", methods=["GET"])
+@login_required
+def search_view():
+    """
+    Typeahead for the user search field. Returns usernames of the most relevant users as json.
+    Access only for admin.
+    Methods: GET
+    """
+    if not current_user.is_admin:  # If current user is not admin
+        return jsonify(message=messages["access_denied"]), 403
+
+    users = search_users(
+        request.args.get("q", ""), limit=10, max_candidates=current_app.config["SEARCH_MAX_CANDIDATES"]
+    )
+    return jsonify([usr.username for usr in users])
+
+
 @bp.route("/register", methods=["GET", "POST"])
 @login_required
 def register_view():
@@ -87,7 +104,7 @@ def register_view():
     he will be automatically redirected to the cabinet page.
     Methods: GET, POST
     """
-    if current_user.username != "admin":  # If current user is not admin redirect him to the cabinet
+    if not current_user.is_admin:  # If current user is not admin redirect him to the cabinet
         return redirect(url_for("cabinet.cabinet_view"))
 
     register_form = RegisterForm()
@@ -98,25 +115,25 @@ def register_view():
         data = request.form
         if register_form.validate_on_submit() or (data and current_app.testing):
             # if admin click the 'Register' button or there is data in the request while testing app
-            # Create new user
-            new_user = User(
-                name=data.get("name"),
-                phone=data.get("phone"),
-                email=data.get("email"),
-                username=data.get("username"),
-                password=data.get("password"),
-                tariff=data.get("tariff_select"),
-                address=data.get("address"),
-                state=State.activated_state.value,
-            )
-
             try:
+                # Create new user (ip is reserved from the pool)
+                new_user = User(
+                    name=data.get("name"),
+                    phone=data.get("phone"),
+                    email=data.get("email"),
+                    username=data.get("username"),
+                    password=data.get("password"),
+                    tariff=data.get("tariff_select"),
+                    address=data.get("address"),
+                    state=State.activated_state.value,
+                )
+
                 # if everything is okay - admin will be redirected to the admin page
                 # and user will be created
                 new_user.save_to_db()
                 flash(messages["success_register"], "info")
                 return redirect(url_for("admin.admin_view"))
-            except ValueError as e:  # error saving to the database
+            except ValueError as e:  # ip pool is exhausted or error saving to the database
                 # otherwise admin will be redirected to the register page
                 # the user will not be created
                 current_app.logger.info("Error while saving new user to the database - {0}".format(e))
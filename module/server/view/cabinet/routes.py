@@ -1,6 +1,7 @@
 """Define the route of the user cabinet"""
-from flask import render_template, redirect, url_for, request, current_app
+from flask import render_template, redirect, url_for, request, current_app, flash
 from flask_login import login_required, current_user
+from module.server import messages
 from module.server.view.cabinet import bp, forms as f
 
 
@@ -13,7 +14,7 @@ def cabinet_view():
     If the user tries to enter this route without logging in, he will be automatically redirected to the login page.
     Methods: GET, POST
     """
-    if current_user.username == "admin":  # If current user is admin redirect him to the admin interface
+    if current_user.is_admin:  # If current user is admin redirect him to the admin interface
         return redirect(url_for("admin.admin_view"))
 
     payment_card_form = f.PaymentCardForm()
@@ -21,7 +22,14 @@ def cabinet_view():
         data = request.form
         if payment_card_form.validate_on_submit() or (data and current_app.testing):
             # if user clicked the "Enter" button or there is data in the request while testing app
-            current_user.use_card(card_code=data.get("code"))
+            try:
+                if current_user.use_card(card_code=data.get("code")):
+                    flash(messages["card_success_code"], "info")
+                else:
+                    flash(messages["card_wrong_code"], "warning")
+            except ValueError as e:  # error saving to the database
+                current_app.logger.info("Error while using payment card - {0}".format(e))
+                flash(messages["failure"], "warning")
 
     return render_template(
         "cabinet/cabinet.html",
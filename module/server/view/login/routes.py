@@ -23,7 +23,7 @@ def login_view():
     Methods: GET, POST
     """
     if current_user.is_authenticated:  # if the user is already logged in - redirect to his cabinet
-        if current_user.username == "admin":  # If current user is admin
+        if current_user.is_admin:  # If current user is admin
             return redirect(url_for("admin.admin_view"))
         return redirect(url_for("cabinet.cabinet_view"))
 
@@ -37,12 +37,18 @@ def login_view():
             password = data.get("password")
 
             user = User.query.filter_by(username=username).first()
-            if user and user.check_password(password):  # If such login exists, login and password match - login user
+            try:
+                password_matches = user is not None and user.check_password(password)
+            except RuntimeError:  # all password hashing slots are busy
+                flash(messages["service_busy"], "warning")
+                return redirect(url_for("login.login_view"))
+
+            if password_matches:  # If such login exists, login and password match - login user
                 session.clear()
                 login_user(user)
                 flash(messages["success_login"], "info")
 
-                if user.username == "admin":  # If user is admin - redirect him to the admin interface
+                if user.is_admin:  # If user is admin - redirect him to the admin interface
                     return redirect(url_for("admin.admin_view"))
                 return redirect(url_for("cabinet.cabinet_view"))
             return redirect(url_for("login.login_view"))
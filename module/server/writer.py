@@ -0,0 +1,245 @@
+"""Write queue: the writes of all workers are applied by a single writer process in group commits"""
+import os
+from queue import Queue, Empty
+from threading import Thread, local
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from flask import current_app
+
+OPERATIONS = dict()  # name: function which applies the write and returns a picklable result
+
+
+def write_operation(name):
+    """
+    Registers function as a write operation. The function gets picklable arguments, changes the database
+    and commits like any other model method, its result must be picklable too.
+    :param name: name of the operation
+    :type name: str
+    """
+
+    def decorator(func):
+        OPERATIONS[name] = func
+        return func
+
+    return decorator
+
+
+class WriteQueue:
+    """
+    Client of the writer process. Every thread of every worker process has its own connection,
+    the connection is opened on the first write.
+
+    :param address: path of the unix socket of the writer
+    :type address: str
+    :param authkey: key the writer authenticates clients with
+    :type authkey: bytes
+    :param timeout: how long (in seconds) to wait for the result, defaults to 10
+    :type timeout: float, optional
+    """
+
+    def __init__(self, address, authkey, timeout=10):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._local = local()
+
+    def _get_connection(self):
+        """Returns connection of the current thread. Connections aren't shared by forked workers"""
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.connection = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def _drop_connection(self) -> None:
+        """Closes connection of the current thread, the next write opens a new one"""
+        connection, self._local.pid = getattr(self._local, "connection", None), None
+        if connection is not None:
+            try:
+                connection.close()
+            except OSError:
+                pass
+
+    def submit(self, name, *args):
+        """
+        Sends the operation to the writer and returns its result after the commit
+        :param name: name of the operation
+        :type name: str
+        :raises ValueError: the operation has failed, the writer is unavailable or hasn't answered in time
+            (the operation may still be applied in the last case)
+        """
+        try:
+            connection = self._get_connection()
+            connection.send((name, args))
+            if not connection.poll(self.timeout):
+                raise TimeoutError("no result in {0} s".format(self.timeout))
+            succeeded, result = connection.recv()
+        except (OSError, EOFError, AuthenticationError) as queue_err:  # TimeoutError is an OSError
+            self._drop_connection()
+            raise ValueError("Write queue is unavailable: {0}".format(queue_err)) from queue_err
+        if not succeeded:
+            raise ValueError(result)
+        return result
+
+
+def get_writer():
+    """Returns client of the writer of the current app, None if the writes are applied by the calling process"""
+    return current_app.extensions.get("write_queue")
+
+
+def apply_write(name, *args):
+    """
+    Applies the write operation in the writer process if the write queue is enabled, otherwise in this process
+    :param name: name of the operation
+    :type name: str
+    :raises ValueError: the operation has failed
+    """
+    writer = get_writer()
+    if writer is None:
+        return OPERATIONS[name](*args)
+    return writer.submit(name, *args)
+
+
+class Writer:
+    """
+    The writer process. Operations sent by the clients are queued and applied in batches: every operation
+    within its own savepoint, so a failed one doesn't affect the others, and the whole batch with one commit.
+    Results are sent back after the commit. While a batch is committed the next one is collected,
+    so the batches grow with the load instead of workers waiting for the write lock of the database.
+
+    :param app: flask app, the writes of this process aren't sent to the queue
+    :type app: Flask
+    :param db: database of the app
+    :type db: SQLAlchemy
+    :param batch_size: max number of operations in one commit, defaults to 100
+    :type batch_size: int, optional
+    :param batch_window: how long (in seconds) to wait for more operations before the commit, defaults to 0
+    :type batch_window: float, optional
+    :raises ValueError: savepoints don't work with the SQLite driver without SQLITE_IMMEDIATE_WRITES
+    """
+
+    def __init__(self, app, db, batch_size=100, batch_window=0):
+        profile = app.extensions.get("sqlite_profile")
+        with app.app_context():
+            is_sqlite = db.get_engine(app).url.drivername == "sqlite"
+        if is_sqlite and not (profile and profile.immediate_writes):
+            raise ValueError("The writer requires SQLITE_IMMEDIATE_WRITES for the savepoints to work.")
+        app.extensions["write_queue"] = None
+        self.app = app
+        self.db = db
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.queue = Queue()
+
+    def serve_forever(self, address, authkey) -> None:
+        """
+        Accepts clients on the unix socket and applies their operations
+        :param address: path of the unix socket, a file left by the previous run is removed
+        :type address: str
+        :param authkey: key clients are authenticated with
+        :type authkey: bytes
+        """
+        if os.path.exists(address):
+            os.remove(address)
+        listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        Thread(target=self._accept, args=(listener,), daemon=True).start()
+        self.app.logger.info("Writer is listening on %s", address)
+        try:
+            batch = self.next_batch()
+            while batch is not None:
+                self.apply(batch)
+                batch = self.next_batch()
+        finally:
+            listener.close()
+
+    def stop(self) -> None:
+        """Stops serving after the operations queued before"""
+        self.queue.put(None)
+
+    def _accept(self, listener) -> None:
+        """Starts a reading thread for every new client until the listener is closed"""
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, EOFError) as accept_err:
+                self.app.logger.warning("Writer has refused a client: %s", accept_err)
+                continue
+            except OSError:
+                return
+            Thread(target=self._read, args=(connection,), daemon=True).start()
+
+    def _read(self, connection) -> None:
+        """Queues operations of the client until it disconnects"""
+        while True:
+            try:
+                name, args = connection.recv()
+            except (OSError, EOFError):
+                connection.close()
+                return
+            self.queue.put((connection, name, args))
+
+    def next_batch(self) -> list:
+        """Waits for an operation and returns it with the operations queued meanwhile, None if the writer is stopped"""
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get(timeout=self.batch_window) if self.batch_window else self.queue.get_nowait()
+            except Empty:
+                break
+            if item is None:  # stopped, the batch is applied first
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def apply(self, batch) -> list:
+        """
+        Applies the operations with one commit and sends the results to the clients.
+        Returns pairs of success flag and result (or error message) of every operation.
+        :param batch: triples of the client connection (None - don't send the result), operation name and arguments
+        :type batch: list
+        """
+        db = self.db
+        with self.app.app_context():
+            results = []
+            for _, name, args in batch:
+                savepoint = db.session.begin_nested()
+                try:
+                    results.append((True, OPERATIONS[name](*args)))
+                    if savepoint.is_active:  # the operation hasn't committed it itself
+                        savepoint.commit()
+                except Exception as op_err:
+                    if savepoint.is_active:
+                        savepoint.rollback()
+                    results.append((False, str(op_err) if isinstance(op_err, ValueError) else repr(op_err)))
+            try:
+                db.session.commit()
+            except Exception as commit_err:
+                db.session.rollback()
+                self.app.logger.error("Writer has failed to commit %s operations: %s", len(batch), commit_err)
+                results = [(False, "Unable to commit: {0}".format(commit_err))] * len(batch)
+            finally:
+                db.session.remove()
+
+        for (connection, _, _), result in zip(batch, results):
+            if connection is not None:
+                try:
+                    connection.send(result)
+                except OSError:  # the client has gone, e.g. it hasn't waited for the result
+                    pass
+        return results
+
+
+def run_writer(app, db) -> None:
+    """
+    Runs the writer of the app configured by WRITE_QUEUE_* settings until the process is stopped
+    :param app: flask app
+    :type app: Flask
+    :param db: database of the app
+    :type db: SQLAlchemy
+    """
+    config = app.config
+    writer = Writer(app, db, config["WRITE_QUEUE_BATCH_SIZE"], config["WRITE_QUEUE_BATCH_WINDOW"])
+    writer.serve_forever(config["WRITE_QUEUE_ADDRESS"], config["SECRET_KEY"].encode())
@@ -3,11 +3,12 @@ import pytest
 from flask import template_rendered, url_for
 from contextlib import contextmanager
 from module import App
-from module.server.models.user import User
+from module.server.models.user import User, Role
 from module.server.models.payment_cards import Card
 from module.server.view.login import bp as login_bp
 from module.server.view.cabinet import bp as cabinet_bp
 from module.server.view.admin import bp as admin_bp
+from module.server.queries import capture_queries
 
 
 @contextmanager
@@ -26,6 +27,20 @@ def captured_templates(app):
         template_rendered.disconnect(record, app)
 
 
+@contextmanager
+def assert_max_queries(maximum):
+    """
+    Fails the test if more than 'maximum' SQL statements are executed within the block, e.g. by a request
+    :param maximum: max number of statements
+    :type maximum: int
+    """
+    with capture_queries(App.db.engine) as statements:
+        yield statements
+    assert len(statements) <= maximum, "{0} queries instead of at most {1}:\n{2}".format(
+        len(statements), maximum, "\n".join(statements)
+    )
+
+
 @pytest.fixture
 def init_app():
     """Init and return app in test mode with in-memory database"""
@@ -41,7 +56,7 @@ def init_app():
     app_context.push()
     db.create_all()
 
-    adm_usr = User(username="admin", password="test")
+    adm_usr = User(username="admin", password="test", role=Role.admin_role.value)
     db.session.add(adm_usr)
 
     to_test_del = User(username="test_del", password="test")
@@ -1,6 +1,7 @@
 """Tests for admin resource"""
 import json
 from flask import url_for
+from module import App
 from module.tests import init_app, get_access_token
 from module.server.models.user import User, State
 
@@ -74,3 +75,166 @@ def test_admin_tools_resource(init_app):
             data=json.dumps({"choice": "delete"}),
         )
         assert response_get_route_admin_delete_no_user.status_code == 500
+
+
+def test_debtors_sweep_resource(init_app):
+    """Tests DebtorsSweepResource"""
+    app = init_app
+    user = User.get_user_by_username("john")
+    user.state, user.balance = State.activated_state.value, -10
+    App.db.session.commit()
+
+    with app.test_client() as client:
+        assert client.post(url_for("api_debtors_sweep")).status_code == 401
+
+        access_token_john = get_access_token(client, json.dumps({"login": "john", "password": "test"}))
+        response = client.post(
+            url_for("api_debtors_sweep"), headers={"Authorization": "Bearer {0}".format(access_token_john)}
+        )
+        assert response.status_code == 403
+
+        access_token_admin = get_access_token(client, json.dumps({"login": "admin", "password": "test"}))
+        headers = {"Authorization": "Bearer {0}".format(access_token_admin), "Content-Type": "application/json"}
+
+        response = client.post(url_for("api_debtors_sweep"), headers=headers, data=json.dumps({"threshold": "x"}))
+        assert response.status_code == 400
+
+        response = client.post(url_for("api_debtors_sweep"), headers=headers)
+        assert response.status_code == 200
+        assert response.json == dict(deactivated=[user.uuid], reactivated=[])
+        assert user.state == State.deactivated_state.value
+
+        response = client.post(url_for("api_debtors_sweep"), headers=headers, data=json.dumps({"threshold": -20}))
+        assert response.json == dict(deactivated=[], reactivated=[user.uuid])
+
+
+def test_admin_batch_resource(init_app):
+    """Tests AdminBatchResource"""
+    app = init_app
+    app.config["API_BATCH_CHUNK_SIZE"] = 2
+    john, andre = User.get_user_by_username("john"), User.get_user_by_username("andre")
+    user_to_del = User.get_user_by_username("test_del")
+    uuids = dict(john=john.uuid, andre=andre.uuid, test_del=user_to_del.uuid)
+
+    with app.test_client() as client:
+        assert client.post(url_for("api_admin_batch")).status_code == 401
+
+        access_token_john = get_access_token(client, json.dumps({"login": "john", "password": "test"}))
+        response = client.post(
+            url_for("api_admin_batch"), headers={"Authorization": "Bearer {0}".format(access_token_john)}
+        )
+        assert response.status_code == 403
+
+        access_token_admin = get_access_token(client, json.dumps({"login": "admin", "password": "test"}))
+        headers = {"Authorization": "Bearer {0}".format(access_token_admin), "Content-Type": "application/json"}
+
+        response = client.post(url_for("api_admin_batch"), headers=headers, data=json.dumps({"items": []}))
+        assert response.status_code == 400
+
+        app.config["API_BATCH_MAX_SIZE"] = 1
+        items = [{"uuid": uuids["john"], "choice": "activate"}] * 2
+        response = client.post(url_for("api_admin_batch"), headers=headers, data=json.dumps({"items": items}))
+        assert response.status_code == 400
+        app.config["API_BATCH_MAX_SIZE"] = 100
+
+        items = [
+            {"uuid": uuids["john"], "choice": "activate"},
+            {"uuid": uuids["andre"], "choice": "deactivate"},
+            {"uuid": uuids["test_del"], "choice": "delete"},
+            {"uuid": "not-exists", "choice": "delete"},
+            {"uuid": uuids["john"], "choice": "delete"},
+            {"uuid": uuids["andre"], "choice": "wrong"},
+            "wrong",
+        ]
+        response = client.post(url_for("api_admin_batch"), headers=headers, data=json.dumps({"items": items}))
+        assert response.status_code == 200
+        results = response.json["results"]
+        assert [result["status"] for result in results] == [200, 200, 200, 404, 400, 400, 400]
+        assert results[0] == dict(uuid=uuids["john"], choice="activate", status=200, message="Successfull.")
+        assert results[4]["errors"] == {"uuid": ["Repeated uuid."]} and "choice" in results[5]["errors"]
+
+        assert User.get_user_by_username("john").state == State.activated_state.value
+        assert User.get_user_by_username("andre").state == State.deactivated_state.value
+        assert not User.get_user_by_username("test_del")
+
+
+def test_export_resource(init_app):
+    """Tests ExportResource"""
+    app = init_app
+    app.config["API_STREAM_CHUNK_SIZE"] = 2
+    john = User.get_user_by_username("john")
+    john.state = State.activated_state.value
+    App.db.session.commit()
+    john.use_card("000000")
+
+    with app.test_client() as client:
+        assert client.get(url_for("api_export", collection="users")).status_code == 401
+
+        access_token_john = get_access_token(client, json.dumps({"login": "john", "password": "test"}))
+        headers = {"Authorization": "Bearer {0}".format(access_token_john)}
+        assert client.get(url_for("api_export", collection="users"), headers=headers).status_code == 403
+
+        access_token_admin = get_access_token(client, json.dumps({"login": "admin", "password": "test"}))
+        headers = {"Authorization": "Bearer {0}".format(access_token_admin)}
+        assert client.get(url_for("api_export", collection="cards"), headers=headers).status_code == 404
+        response = client.get(url_for("api_export", collection="users", state="unknown"), headers=headers)
+        assert response.status_code == 400
+
+        response = client.get(url_for("api_export", collection="users"), headers=headers)
+        assert response.status_code == 200 and response.mimetype == "text/csv"
+        assert response.headers["Content-Disposition"] == "attachment; filename=users.csv"
+        lines = response.get_data(as_text=True).splitlines()
+        assert lines[0] == "uuid,username,name,email,phone,address,tariff,ip,state,balance,created_at"
+        assert len(lines) == 1 + User.query.count()
+
+        response = client.get(
+            url_for("api_export", collection="users", format="ndjson", state="activated"), headers=headers
+        )
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert response.mimetype == "application/x-ndjson"
+        assert [row["username"] for row in rows] == ["john"] and rows[0]["balance"] == 200
+
+        response = client.get(
+            url_for("api_export", collection="history", format="ndjson", **{"from": "2000-01-01"}), headers=headers
+        )
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [(row["user_uuid"], row["code"], row["amount"]) for row in rows] == [(john.uuid, "000000", 200)]
+
+        response = client.get(url_for("api_export", collection="history", to="2000-01-01"), headers=headers)
+        assert response.get_data(as_text=True).splitlines() == ["uuid,user_uuid,code,amount,balance_after_use,used_at"]
+
+
+def test_search_resource(init_app):
+    """Tests SearchResource"""
+    app = init_app
+    for i in range(3):
+        App.db.session.add(User(username="search{0}".format(i), password="test", name="Found User"))
+    App.db.session.commit()
+
+    with app.test_client() as client:
+        assert client.get(url_for("api_search", q="found")).status_code == 401
+
+        access_token_john = get_access_token(client, json.dumps({"login": "john", "password": "test"}))
+        headers = {"Authorization": "Bearer {0}".format(access_token_john)}
+        assert client.get(url_for("api_search", q="found"), headers=headers).status_code == 403
+
+        access_token_admin = get_access_token(client, json.dumps({"login": "admin", "password": "test"}))
+        headers = {"Authorization": "Bearer {0}".format(access_token_admin)}
+        assert client.get(url_for("api_search", q="fo"), headers=headers).status_code == 400
+
+        response = client.get(url_for("api_search", q="found", limit=2), headers=headers)
+        assert response.status_code == 200
+        assert [usr["username"] for usr in response.json] == ["search0", "search1"]
+        assert "uuid" in response.json[0] and "moderate" in response.json[0]["_links"]
+        assert 'offset=2>; rel="next"' in response.headers["Link"]
+        assert response.headers["X-Total-Count"] == "3" and response.headers["X-Search-Truncated"] == "false"
+
+        response = client.get(url_for("api_search", q="found", limit=2, offset=2), headers=headers)
+        assert [usr["username"] for usr in response.json] == ["search2"] and "Link" not in response.headers
+
+        # only the first matches are ranked and paginated
+        app.config["SEARCH_MAX_CANDIDATES"] = 2
+        response = client.get(url_for("api_search", q="found", limit=1, offset=1), headers=headers)
+        assert [usr["username"] for usr in response.json] == ["search1"] and "Link" not in response.headers
+        assert response.headers["X-Total-Count"] == "2" and response.headers["X-Search-Truncated"] == "true"
+        assert client.get(url_for("api_search", q="found", offset=2), headers=headers).status_code == 400
@@ -3,8 +3,9 @@ import json
 from uuid import uuid4
 from flask import url_for
 from flask_jwt_extended import decode_token
+from module import App
 from module.tests import init_app, get_access_token
-from module.server.models.user import User
+from module.server.models.user import User, Role
 from module.server.models.jwt_tokens import TokenBlocklist
 
 
@@ -169,6 +170,25 @@ def test_user_resource(init_app):
         for key_ in ["name", "email", "phone"]:
             assert key_ in response_get_user_route_john_uuid_john.json.keys()
 
+        # Conditional GET
+        etag = response_get_user_route_john_uuid_john.headers["ETag"]
+        response_get_not_modified = client.get(
+            url_for("api_user_details", uuid=user_john.uuid),
+            headers={"Authorization": "Bearer {0}".format(access_token), "If-None-Match": etag},
+        )
+        assert response_get_not_modified.status_code == 304 and not response_get_not_modified.data
+        assert response_get_not_modified.headers["ETag"] == etag
+
+        user_john.name = "John"
+        App.db.session.commit()
+        response_get_modified = client.get(
+            url_for("api_user_details", uuid=user_john.uuid),
+            headers={"Authorization": "Bearer {0}".format(access_token), "If-None-Match": etag},
+        )
+        assert response_get_modified.status_code == 200 and response_get_modified.json["name"] == "John"
+        assert response_get_modified.headers["ETag"] != etag
+        etag = response_get_modified.headers["ETag"]
+
         login_payload_admin = json.dumps({"login": "admin", "password": "test"})
         access_token = get_access_token(client, login_payload_admin)
 
@@ -179,6 +199,7 @@ def test_user_resource(init_app):
         assert response_get_user_route_admin_uuid_john.status_code == 200
         for key_ in ["name", "email", "phone"]:
             assert key_ not in response_get_user_route_admin_uuid_john.json.keys()
+        assert response_get_user_route_admin_uuid_john.headers["ETag"] != etag  # other representation
 
         response_get_user_route_admin_uuid_john = client.get(
             url_for("api_user_details", uuid=uuid4()),
@@ -252,6 +273,47 @@ def test_user_history_resource(init_app):
         )
         assert response_get_user_history_wrong_uuid.status_code == 200
 
+        # Pagination
+        for code in ("000000", "000001", "000002"):
+            user_john.use_card(code)
+        headers = {"Authorization": "Bearer {0}".format(access_token)}
+
+        response_get_first_page = client.get(url_for("api_user_history", uuid=user_john.uuid, limit=2), headers=headers)
+        assert response_get_first_page.status_code == 200
+        assert [crd["code"] for crd in response_get_first_page.json] == ["000002", "000001"]
+        links = dict(reversed(link.split("; ")) for link in response_get_first_page.headers["Link"].split(", "))
+        assert set(links) == {'rel="next"'}
+
+        response_get_next_page = client.get(links['rel="next"'].strip("<>"), headers=headers)
+        assert [crd["code"] for crd in response_get_next_page.json] == ["000000"]
+        links = dict(reversed(link.split("; ")) for link in response_get_next_page.headers["Link"].split(", "))
+        assert set(links) == {'rel="prev"'}
+
+        response_get_prev_page = client.get(links['rel="prev"'].strip("<>"), headers=headers)
+        assert [crd["code"] for crd in response_get_prev_page.json] == ["000002", "000001"]
+
+        # Conditional GET
+        url = url_for("api_user_history", uuid=user_john.uuid, limit=2)
+        etag = response_get_first_page.headers["ETag"]
+        response_get_not_modified = client.get(url, headers=dict(headers, **{"If-None-Match": etag}))
+        assert response_get_not_modified.status_code == 304 and not response_get_not_modified.data
+
+        user_john.use_card("000003")
+        response_get_modified = client.get(url, headers=dict(headers, **{"If-None-Match": etag}))
+        assert response_get_modified.status_code == 200 and response_get_modified.headers["ETag"] != etag
+        assert [crd["code"] for crd in response_get_modified.json] == ["000003", "000002"]
+
+        response_get_wrong_dates = client.get(
+            url_for("api_user_history", uuid=user_john.uuid, **{"from": "2000-01-01", "to": "2000-12-31"}),
+            headers=headers,
+        )
+        assert response_get_wrong_dates.status_code == 200 and response_get_wrong_dates.json == []
+
+        response_get_both_cursors = client.get(
+            url_for("api_user_history", uuid=user_john.uuid, before=2, after=1), headers=headers
+        )
+        assert response_get_both_cursors.status_code == 400
+
 
 def test_users_resource(init_app):
     """Tests UsersResource"""
@@ -282,6 +344,53 @@ def test_users_resource(init_app):
         )
         assert response_get_users_admin.status_code == 200
         assert isinstance(response_get_users_admin.json, list)
+        assert len(response_get_users_admin.json) == 4 and "Link" not in response_get_users_admin.headers
+
+        # Pagination
+        users = User.query.order_by(User.id).all()
+        headers_admin = {"Authorization": "Bearer {0}".format(access_token_admin)}
+        response_get_users_first_page = client.get(url_for("api_users", limit=3), headers=headers_admin)
+        assert response_get_users_first_page.status_code == 200
+        assert [usr["ip"] for usr in response_get_users_first_page.json] == [usr.ip for usr in users[:3]]
+        assert 'rel="next"' in response_get_users_first_page.headers["Link"]
+
+        next_url = response_get_users_first_page.headers["Link"].split(";")[0].strip("<>")
+        response_get_users_next_page = client.get(next_url, headers=headers_admin)
+        assert response_get_users_next_page.status_code == 200
+        assert [usr["ip"] for usr in response_get_users_next_page.json] == [users[3].ip]
+        assert "Link" not in response_get_users_next_page.headers
+
+        response_get_users_invalid_limit = client.get(url_for("api_users", limit=0), headers=headers_admin)
+        assert response_get_users_invalid_limit.status_code == 400
+
+        # Streaming
+        response_get_users_stream = client.get(url_for("api_users", format="ndjson", after=1), headers=headers_admin)
+        assert response_get_users_stream.status_code == 200
+        assert response_get_users_stream.mimetype == "application/x-ndjson"
+        lines = response_get_users_stream.get_data(as_text=True).splitlines()
+        assert [json.loads(line)["ip"] for line in lines] == [usr.ip for usr in users[1:]]
+
+        # Sparse fieldsets
+        response_get_users_sparse = client.get(
+            url_for("api_users", limit=3, fields="ip,state,_links", links="false"), headers=headers_admin
+        )
+        assert response_get_users_sparse.status_code == 200
+        assert [usr for usr in response_get_users_sparse.json] == [
+            dict(ip=usr.ip, state=usr.state) for usr in users[:3]
+        ]
+        next_url = response_get_users_sparse.headers["Link"].split(";")[0].strip("<>")
+        assert client.get(next_url, headers=headers_admin).json == [dict(ip=users[3].ip, state=users[3].state)]
+
+        response_get_user_sparse = client.get(
+            url_for("api_user_details", uuid=user_john.uuid, fields="_links"), headers=headers_admin
+        )
+        assert response_get_user_sparse.status_code == 200 and list(response_get_user_sparse.json) == ["_links"]
+        assert response_get_user_sparse.json["_links"]["self"] == url_for("api_user_details", uuid=user_john.uuid)
+
+        response_get_users_unknown_fields = client.get(
+            url_for("api_users", fields="ip,password_hash"), headers=headers_admin
+        )
+        assert response_get_users_unknown_fields.status_code == 400
 
 
 def test_refresh_token(init_app):
@@ -308,3 +417,51 @@ def test_refresh_token(init_app):
         for key_ in ["access_token", "refresh_token", "fresh", "expires_in"]:
             assert key_ in response_get_refresh.json.keys()
         assert not response_get_refresh.json.get("fresh")
+
+
+def test_authorization_claims(init_app):
+    """Role is embedded into the access token and used for authorization"""
+    app = init_app
+    user_john = User.get_user_by_username("john")
+
+    with app.test_client() as client:
+        access_token = get_access_token(client, json.dumps({"login": "john", "password": "test"}))
+        decoded = decode_token(access_token)
+        assert decoded["role"] == Role.user_role.value and "state" not in decoded
+
+        # Admin is recognized by the role, not by the username
+        user_john.role = Role.admin_role.value
+        user_john.save_to_db()
+        response_get_users = client.get(
+            url_for("api_users"), headers={"Authorization": "Bearer {0}".format(access_token)}
+        )
+        assert isinstance(response_get_users.json, dict)  # claims of the old token are used
+
+        access_token = get_access_token(client, json.dumps({"login": "john", "password": "test"}))
+        response_get_users = client.get(
+            url_for("api_users"), headers={"Authorization": "Bearer {0}".format(access_token)}
+        )
+        assert isinstance(response_get_users.json, list)
+
+        # Claims are updated on refresh
+        response_login = client.get(
+            url_for("api_auth"),
+            headers={"Content-Type": "application/json"},
+            data=json.dumps({"login": "andre", "password": "test"}),
+        )
+        user_andre = User.get_user_by_username("andre")
+        user_andre.role = Role.admin_role.value
+        user_andre.save_to_db()
+        response_refresh = client.post(
+            url_for("api_refresh"),
+            headers={"Authorization": "Bearer {0}".format(response_login.json.get("refresh_token"))},
+        )
+        assert decode_token(response_refresh.json["access_token"])["role"] == Role.admin_role.value
+
+        # Deleted user can't refresh token
+        user_andre.delete_from_db()
+        response_refresh = client.post(
+            url_for("api_refresh"),
+            headers={"Authorization": "Bearer {0}".format(response_login.json.get("refresh_token"))},
+        )
+        assert response_refresh.status_code == 404
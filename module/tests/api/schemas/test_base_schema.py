@@ -0,0 +1,55 @@
+"""Tests for the fast serialization of the schemas"""
+import pytest
+from flask import url_for
+from marshmallow import ValidationError
+from module import App
+from module.tests import init_app
+from module.server.models.user import User
+from module.server.api.schemas.base import get_schema, get_sparse_schema
+from module.server.api.schemas.user import AdminUserInfoSchema, FullUserInfoSchema
+
+
+def legacy(schema_class):
+    """Returns the schema class with the same fields serialized by the generic marshmallow and Flask code"""
+    links = schema_class().declared_fields["_links"].schema
+    return type(
+        "Legacy" + schema_class.__name__,
+        (App.ma.SQLAlchemyAutoSchema,),
+        dict(
+            Meta=schema_class.Meta,
+            _links=App.ma.Hyperlinks(
+                {name: App.ma.URLFor(fld.endpoint, values=fld.values) for name, fld in links.items()}
+            ),
+        ),
+    )
+
+
+def test_fast_dump(init_app):
+    """Users are serialized the same as by the generic schemas"""
+    users = User.query.order_by(User.id).all()
+    users[0].uuid = "a b/c?"  # quoted in the urls
+    for schema_class in (AdminUserInfoSchema, FullUserInfoSchema):
+        assert get_schema(schema_class, many=True).dump(users) == legacy(schema_class)(many=True).dump(users)
+        assert get_schema(schema_class).dump(users[1]) == legacy(schema_class)().dump(users[1])
+    assert get_schema(AdminUserInfoSchema) is get_schema(AdminUserInfoSchema)
+
+    # links are built outside of the request too
+    with init_app.app_context():
+        links = get_schema(FullUserInfoSchema).dump(users[1])["_links"]
+        assert links["self"] == url_for("api_user_details", uuid=users[1].uuid)
+
+
+def test_sparse_schema(init_app):
+    """Only requested fields are serialized"""
+    usr = User.get_user_by_username("john")
+    assert get_sparse_schema(FullUserInfoSchema, ("phone", "name")).dump(usr) == dict(name=usr.name, phone=usr.phone)
+    assert "_links" not in get_sparse_schema(FullUserInfoSchema, links=False).dump(usr)
+    assert get_sparse_schema(FullUserInfoSchema, ("name", "phone")) is get_sparse_schema(
+        FullUserInfoSchema, ("phone", "name")
+    )
+    assert get_sparse_schema(FullUserInfoSchema) is get_schema(FullUserInfoSchema)
+
+    with pytest.raises(ValidationError):
+        get_sparse_schema(FullUserInfoSchema, ("name", "password_hash"))
+    with pytest.raises(ValidationError):  # load only field
+        get_sparse_schema(AdminUserInfoSchema, ("name",))
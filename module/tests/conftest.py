@@ -0,0 +1,10 @@
+"""Settings shared by all tests"""
+import pytest
+from module.server.config import Config
+
+
+@pytest.fixture(autouse=True)
+def runtime_folders(tmp_path, monkeypatch):
+    """Logs and hashing slots of the test apps are kept in the temporary folder of the test, not in the source tree"""
+    monkeypatch.setattr(Config, "LOGS_FOLDER", str(tmp_path / "logs"))
+    monkeypatch.setattr(Config, "PASSWORD_HASH_SLOTS_DIR", str(tmp_path / "hashing"))
@@ -0,0 +1,109 @@
+"""Test the tariff billing"""
+import pytest
+from module import App
+from module.server.config import TestConfig
+from module.tests import setup_database
+from module.server.models.user import User, State
+from module.server.models.stats import Stats
+from module.server.models.billing import Charge, charge_period, charge_range
+
+
+def add_users(db, num):
+    """Adds activated users with every tariff, every fifth user is deactivated"""
+    tariffs = ("50m", "100m", "200m", "500m", None)
+    users = [
+        User(
+            username="user{0}".format(i),
+            password="test",
+            tariff=tariffs[i % len(tariffs)],
+            state=State.deactivated_state.value if i % 5 == 4 else State.activated_state.value,
+        )
+        for i in range(num)
+    ]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def test_charge_period(setup_database):
+    """Activated users are charged once per period, the ledger and the counters are kept in sync"""
+    db = setup_database
+    users = add_users(db, 12)
+    users[0].balance = 150
+    db.session.commit()
+    Stats.rebuild()
+
+    charged, amount = charge_period("2026-10", chunk_size=5)
+    # every fifth user is deactivated and has no tariff
+    assert (charged, amount) == (10, 3 * 100 + 3 * 200 + 2 * 300 + 2 * 500)
+    assert Charge.query.filter_by(period="2026-10").count() == 10
+    assert User.query.get(users[0].id).balance == 50
+    assert User.query.get(users[3].id).balance == -500
+    assert User.query.get(users[3].id).version == 2  # the charge is a change of the user info
+    assert User.query.get(users[4].id).balance == 0
+    assert Stats.get() == Stats.compute()
+
+    # Idempotent per period
+    assert charge_period("2026-10", chunk_size=5) == (0, 0)
+    assert User.query.get(users[3].id).balance == -500
+
+    # Next period
+    assert charge_period("2026-11", chunk_size=100)[0] == 10
+    assert User.query.get(users[3].id).balance == -1000
+    assert Stats.get() == Stats.compute()
+    assert Charge.query.first().__repr__().startswith("Charge 1: user")
+
+    with pytest.raises(ValueError):
+        charge_period("october")
+
+
+def test_resume_charge(setup_database):
+    """A range charged before the interruption is skipped by the next run"""
+    db = setup_database
+    users = add_users(db, 10)
+
+    assert charge_range("2026-10", users[0].id, users[4].id) == (4, 100 + 200 + 300 + 500)
+    assert charge_period("2026-10", chunk_size=3) == (4, 100 + 200 + 300 + 500)
+    assert all(usr.balance == -usr_charge.amount for usr, usr_charge in db.session.query(User, Charge).join(Charge))
+
+
+def test_delete_charged_users(setup_database):
+    """Charges of the deleted users are kept without the user, a new user with the same id is charged"""
+    db = setup_database
+    db.session.execute("PRAGMA foreign_keys = ON")  # like any other database
+    users = add_users(db, 3)
+    assert charge_period("2026-10") == (3, 100 + 200 + 300)
+    first_id, last_id = users[0].id, users[2].id
+
+    users[0].delete_from_db()
+    User.apply_choices([(users[2].uuid, "delete")])
+    assert Charge.query.filter(Charge.user_id.is_(None)).count() == 2  # the ledger isn't changed otherwise
+
+    for user_id in (first_id, last_id):  # the ids are reused
+        new_user = User(
+            username="new{0}".format(user_id), password="test", tariff="50m", state=State.activated_state.value
+        )
+        new_user.id = user_id
+        db.session.add(new_user)
+    db.session.commit()
+    assert charge_period("2026-10") == (2, 2 * 100)
+    assert Charge.query.count() == 5
+
+
+def test_charge_in_parallel(tmp_path):
+    """Id ranges are charged by parallel workers"""
+
+    class FileConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + str(tmp_path / "billing.db")
+
+    runner = App(config_obj=FileConfig)
+    app, db = runner.get_flask_app(), runner.db
+
+    with app.app_context():
+        db.create_all()
+        add_users(db, 50)
+        assert charge_period("2026-10", chunk_size=4, workers=4)[0] == 40
+        assert Charge.query.count() == 40
+        assert charge_period("2026-10", chunk_size=4, workers=3) == (0, 0)
+        db.session.remove()
+        db.drop_all()
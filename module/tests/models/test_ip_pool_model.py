@@ -0,0 +1,92 @@
+"""Tests IP pool models"""
+import pytest
+from flask import current_app
+from module.tests import setup_database
+from module.server.models.user import User
+from module.server.models.ip_pool import IpRange, FreeIp, reserve_ip, reserve_ips, release_ip
+
+
+def test_sync_ranges(setup_database):
+    """Ranges from config are added once"""
+    db = setup_database
+
+    IpRange.sync(["192.168.0.0/24", "192.168.1.0/31"])
+    IpRange.sync(["192.168.0.0/24"])
+    assert db.session.query(IpRange).count() == 2
+
+    rng = IpRange.query.filter_by(network="192.168.0.0/24").first()
+    assert rng.size == 254 and rng.next_offset == 0
+    assert rng.__repr__() == "IP range 192.168.0.0/24: 0/254 used"
+    assert IpRange.query.filter_by(network="192.168.1.0/31").first().size == 2
+
+
+def test_reserve_and_release(setup_database):
+    """Addresses are unique, released addresses are reused and pool exhaustion is reported"""
+    db = setup_database
+    current_app.config["IP_POOL_RANGES"] = ["192.168.0.0/30"]  # 2 host addresses
+
+    first, second = reserve_ip(), reserve_ip()
+    assert (first, second) == ("192.168.0.1", "192.168.0.2")
+    with pytest.raises(ValueError):
+        reserve_ip()
+
+    # Addresses which weren't issued by the pool are ignored
+    release_ip("8.8.8.8")
+    release_ip(None)
+    release_ip("not-an-ip")
+    assert db.session.query(FreeIp).count() == 0
+
+    release_ip(first)
+    assert db.session.query(FreeIp).count() == 1
+    assert reserve_ip() == first
+    assert db.session.query(FreeIp).count() == 0
+
+    # New ranges from config are picked up when the pool is exhausted
+    current_app.config["IP_POOL_RANGES"] = ["192.168.0.0/30", "192.168.1.0/30"]
+    assert reserve_ip() == "192.168.1.1"
+
+
+def test_concurrent_claim(setup_database):
+    """Addresses taken from the free-list by a concurrent transaction are skipped, the others aren't lost"""
+    db = setup_database
+    current_app.config["IP_POOL_RANGES"] = ["192.168.0.0/29"]  # 6 host addresses
+    addresses = [reserve_ip() for _ in range(4)]
+    for address in addresses[:3]:
+        release_ip(address)
+    db.session.commit()
+    stolen = []
+
+    def claim_concurrently(conn, cursor, statement, parameters, context, executemany):
+        """Another transaction takes the first free address after the free-list was selected"""
+        if statement.startswith("DELETE FROM free_ip") and not stolen:
+            stolen.append(addresses[0])
+            cursor.execute("DELETE FROM free_ip WHERE address = ?", (addresses[0],))
+
+    db.event.listen(db.engine, "before_cursor_execute", claim_concurrently)
+    try:
+        reserved = reserve_ips(2)
+    finally:
+        db.event.remove(db.engine, "before_cursor_execute", claim_concurrently)
+    free = [row.address for row in FreeIp.query]
+    assert stolen and reserved[0] == addresses[1] and reserved[1] not in addresses
+    assert sorted(stolen + reserved[:1] + free) == sorted(addresses[:3])  # every released address is accounted for
+
+
+def test_user_ip_lifecycle(setup_database):
+    """Users get unique addresses which are returned to the pool on delete"""
+    db = setup_database
+
+    users = [User(username="user{0}".format(i), password="test") for i in range(5)]
+    for usr in users:
+        db.session.add(usr)
+    db.session.commit()
+    assert len({usr.ip for usr in users}) == 5
+
+    deleted_ip = users[0].ip
+    users[0].delete_from_db()
+    assert FreeIp.query.filter_by(address=deleted_ip).first()
+
+    usr = User(username="new", password="test")
+    usr.save_to_db()
+    assert usr.ip == deleted_ip
+    assert not FreeIp.query.filter_by(address=deleted_ip).first()
@@ -1,7 +1,15 @@
 """Test jwt_token model and methods"""
+from datetime import datetime, timedelta
+from flask import current_app
 from flask_jwt_extended import create_access_token, decode_token
 from module.tests import setup_database, dataset
-from module.server.models.jwt_tokens import check_if_token_in_blocklist, TokenBlocklist
+from module.server.models.jwt_tokens import (
+    check_if_token_in_blocklist,
+    get_blocklist_cache,
+    revoke_token,
+    BlocklistCache,
+    TokenBlocklist,
+)
 
 
 def test_check_if_token_in_blocklist(dataset):
@@ -14,3 +22,68 @@ def test_check_if_token_in_blocklist(dataset):
     token.save_to_db()
 
     assert check_if_token_in_blocklist(jwt_handler=None, jwt_payload={"jti": decoded["jti"]})
+
+
+def test_blocklist_cache(dataset):
+    """Revoked tokens are cached, tokens revoked by another worker are loaded by poll"""
+    current_app.config["JWT_BLOCKLIST_POLL_INTERVAL"] = 3600
+
+    decoded = decode_token(create_access_token(identity=1))
+    assert not check_if_token_in_blocklist(jwt_handler=None, jwt_payload=decoded)  # warms the cache
+
+    # Revoked by this worker - visible without poll
+    revoke_token(1, decoded)
+    assert TokenBlocklist.query.filter_by(jti=decoded["jti"]).first().expires_at is not None
+    assert check_if_token_in_blocklist(jwt_handler=None, jwt_payload=decoded)
+
+    # Revoked by another worker - visible after poll
+    another_worker = BlocklistCache()
+    another_worker.poll()
+    assert len(another_worker) == 1
+
+    other = decode_token(create_access_token(identity=1))
+    revoke_token(1, other)
+    assert not another_worker.is_revoked(other["jti"])  # poll interval hasn't passed yet
+    another_worker.poll()
+    assert another_worker.is_revoked(other["jti"]) and len(another_worker) == 2
+    assert len(get_blocklist_cache()) == 2
+
+    # Expired tokens are dropped from the cache
+    expired = decode_token(create_access_token(identity=1, expires_delta=timedelta(seconds=-1)), allow_expired=True)
+    revoke_token(1, expired)
+    another_worker.poll()
+    assert not another_worker.is_revoked(expired["jti"])
+
+
+def test_purge_expired(dataset):
+    """Only expired tokens are deleted"""
+    now = datetime.utcnow()
+    TokenBlocklist(user_id=1, jti="live", expires_at=now + timedelta(minutes=5)).save_to_db()
+    TokenBlocklist(user_id=1, jti="expired", expires_at=now - timedelta(minutes=5)).save_to_db()
+    TokenBlocklist(user_id=1, jti="legacy", created_at=now - timedelta(days=1)).save_to_db()
+    TokenBlocklist(user_id=1, jti="legacy-live", created_at=now).save_to_db()
+
+    assert TokenBlocklist.purge_expired() == 2
+    assert {token.jti for token in TokenBlocklist.query.all()} == {"live", "legacy-live"}
+
+
+def test_blocklist_cache_late_commit(dataset):
+    """A row committed after a row with a greater id is loaded by the next poll"""
+    db = dataset
+    worker = BlocklistCache()
+    for id_, jti in ((1, "first"), (3, "third")):
+        db.session.add(TokenBlocklist(id=id_, user_id=1, jti=jti))
+    db.session.commit()
+    worker.poll()
+    assert len(worker) == 2
+
+    db.session.add(TokenBlocklist(id=2, user_id=1, jti="late"))  # its transaction has committed after the poll
+    db.session.commit()
+    worker.poll()
+    assert worker.is_revoked("late") and len(worker) == 3
+
+    current_app.config["JWT_BLOCKLIST_POLL_OVERLAP"] = 0  # the cursor alone misses such rows
+    db.session.add(TokenBlocklist(id=0, user_id=1, jti="lost"))
+    db.session.commit()
+    worker.poll()
+    assert "lost" not in worker._revoked
@@ -0,0 +1,51 @@
+"""Tests user search index"""
+from module.tests import setup_database
+from module.server.models.user import User
+from module.server.models.search import search_users, search_users_page
+
+
+def test_search_users(setup_database):
+    """Users are found by fragments of the indexed columns, the index follows inserts, updates and deletes"""
+    db = setup_database
+    ivan = User(username="ivanov", password="test", name="Ivan Petrov", phone="+380961122333", address="Kyiv")
+    petro = User(username="petro", password="test", name="Petro Ivanenko", phone="+380501234567", email="p@mail.com")
+    db.session.add_all([ivan, petro])
+    db.session.commit()
+
+    # Matches in the username are the most relevant
+    assert search_users("ivan") == [ivan, petro]
+    assert search_users("IVAN petr") == [ivan, petro]
+    assert search_users("2333") == [ivan]
+    assert search_users("mail.com") == [petro]
+    assert search_users("ivan kyiv") == [ivan]
+    assert search_users("ivan", limit=1, offset=1) == [petro]
+    assert search_users("iv") == [] and search_users("nobody") == []
+    assert search_users('"ivan') == []
+
+    # The index is maintained on update and delete, including bulk statements
+    petro.address = "Lviv"
+    db.session.commit()
+    assert search_users("lviv") == [petro]
+    db.session.query(User).filter_by(id=ivan.id).update({User.name: "John"}, synchronize_session=False)
+    db.session.commit()
+    assert search_users("petrov") == []
+    assert search_users("john") == [ivan]
+
+    petro.delete_from_db()
+    assert search_users("ivan") == [ivan]
+    assert search_users("lviv") == []
+
+
+def test_search_users_page(setup_database):
+    """Only the first matches are ranked, the page reports their number and whether there are more matches"""
+    db = setup_database
+    db.session.add_all([User(username="match{0}".format(i), password="test") for i in range(5)])
+    db.session.commit()
+
+    users, total, truncated = search_users_page("match", limit=2, offset=1, max_candidates=10)
+    assert [usr.username for usr in users] == ["match1", "match2"] and total == 5 and not truncated
+
+    users, total, truncated = search_users_page("match", limit=10, max_candidates=3)
+    assert [usr.username for usr in users] == ["match0", "match1", "match2"] and total == 3 and truncated
+    assert search_users_page("match", offset=3, max_candidates=3) == ([], 3, True)
+    assert search_users_page("ma", max_candidates=3) == ([], 0, False)
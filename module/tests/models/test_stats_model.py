@@ -0,0 +1,59 @@
+"""Tests dashboard counters"""
+from module.tests import setup_database, dataset
+from module.server.models.user import User, State
+from module.server.models.payment_cards import Card
+from module.server.models.stats import Stats
+
+
+def test_compute_and_rebuild(dataset):
+    """Counters are computed with aggregate queries and built on the first read"""
+    db = dataset
+    db.session.add(Card(amount=200, code="000001"))
+    john = User.get_user_by_username("john")
+    john.balance = -150
+    john.state = State.activated_state.value
+    db.session.commit()
+
+    expected = dict(num_users=2, num_active_users=1, num_non_used_cards=1, total_debt=-150)
+    assert Stats.compute() == expected
+    assert not Stats.query.count()
+    assert Stats.get() == expected
+    assert Stats.query.count() == len(expected)
+    assert Stats.query.get("num_users").__repr__() == "Counter num_users: 2.0"
+
+
+def test_counters_are_maintained(dataset):
+    """Every change of users and cards keeps stored counters equal to the actual data"""
+    db = dataset
+    Stats.rebuild()
+
+    def consistent():
+        return Stats.get() == Stats.compute()
+
+    # Create
+    usr = User(username="michael", password="test", state=State.activated_state.value)
+    usr.save_to_db()
+    db.session.add_all([Card(amount=200, code="000001"), Card(amount=400, code="000002")])
+    db.session.commit()
+    assert consistent() and Stats.get()["num_users"] == 3 and Stats.get()["num_non_used_cards"] == 2
+
+    # State and balance changes
+    usr.change_state(deactivate=True)
+    User.get_user_by_username("john").change_state()
+    usr.balance = -500
+    db.session.commit()
+    assert consistent() and Stats.get()["total_debt"] == -500
+
+    # Card redemption
+    usr.use_card("000001")
+    assert consistent() and Stats.get()["total_debt"] == -300
+    usr.use_card("000002")
+    assert consistent() and Stats.get()["total_debt"] == 0
+
+    # Delete
+    usr.balance = -10
+    db.session.commit()
+    usr.delete_from_db()
+    Card(amount=200, code="000003").save_to_db()
+    Card.get_card_by_code("000003").delete_from_db()
+    assert consistent() and Stats.get() == dict(num_users=2, num_active_users=1, num_non_used_cards=0, total_debt=0)
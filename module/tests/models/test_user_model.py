@@ -1,6 +1,14 @@
 """Test the User model"""
+from threading import Barrier, Thread
+from datetime import date, datetime
+from module import App
+from module.server.config import TestConfig
+from module.server.hashing import get_hasher
 from module.tests import setup_database, dataset
-from module.server.models.user import User, State, load_user
+from module.server.models.user import User, State, Role, load_user
+from module.server.models.payment_cards import Card, UsedCard
+from module.server.models.stats import Stats
+from module.server.models.ip_pool import FreeIp
 
 
 def test_create_and_add_user(dataset):
@@ -68,14 +76,13 @@ def test_change_state_and_set_ip(setup_database):
 
     # Set new ip
     prev_ip = usr.ip
-    assert not usr.ip or prev_ip
+    assert prev_ip
     usr.set_ip()
     assert usr.ip and usr.ip != prev_ip and len(usr.ip.split(".")) == 4
 
-    # Set new UNIQUE ip
-    test_ip = usr.ip
-    usr.set_ip(test_ip=test_ip)
-    assert usr.ip != test_ip
+    # Previous ip was returned to the pool and is reused
+    another = User(username="andre", password="test")
+    assert another.ip == prev_ip
 
 
 def test_saving_deleting_to_db(setup_database):
@@ -107,3 +114,266 @@ def test_load_user(dataset):
     """Load user by id"""
     test_user = load_user("1")
     assert test_user.__repr__() == "User: john"
+
+
+def test_use_card(dataset):
+    """Card is moved to the used cards and the balance is replenished"""
+    db = dataset
+    usr = User.get_user_by_username("john")
+    db.session.add(Card(amount=200, code="000001"))
+    db.session.commit()
+
+    assert not usr.use_card("invalid")
+    assert usr.use_card("000001")
+    assert usr.balance == 200
+    assert not Card.get_card_by_code("000001")
+    assert UsedCard.get_card_by_code("000001").balance_after_use == 200
+    assert usr.get_history()[0].user_id == usr.id
+
+    # The card was already used
+    assert not usr.use_card("000001")
+    assert usr.balance == 200
+
+
+def test_use_card_concurrently(tmp_path):
+    """The same card is fired from many workers at once, exactly one of them wins and no update is lost"""
+    num_workers = 8
+
+    class FileConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + str(tmp_path / "stress.db")
+
+    runner = App(config_obj=FileConfig)
+    app, db = runner.get_flask_app(), runner.db
+
+    with app.app_context():
+        db.create_all()
+        users = [User(username="user{0}".format(i), password="test") for i in range(num_workers)]
+        db.session.add_all(users)
+        db.session.add(Card(amount=200, code="shared"))
+        db.session.add_all(Card(amount=100, code="own{0}".format(i)) for i in range(num_workers))
+        db.session.commit()
+        user_ids = [usr.id for usr in users]
+        owner_id = user_ids[0]
+
+    def redeem(user_id, code, results, barrier):
+        with app.app_context():
+            usr = User.query.get(user_id)
+            barrier.wait()
+            results.append(usr.use_card(code))
+            db.session.remove()
+
+    def fire(jobs):
+        results, barrier = [], Barrier(len(jobs))
+        threads = [Thread(target=redeem, args=(user_id, code, results, barrier)) for user_id, code in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    # Same code from every worker
+    results = fire([(user_id, "shared") for user_id in user_ids])
+    assert results.count(True) == 1 and len(results) == num_workers
+
+    # Different codes for the same user - every top up is applied
+    results = fire([(owner_id, "own{0}".format(i)) for i in range(num_workers)])
+    assert all(results) and len(results) == num_workers
+
+    with app.app_context():
+        assert UsedCard.query.filter_by(code="shared").count() == 1
+        assert not Card.query.count()
+        total = db.session.query(db.func.sum(User.balance)).scalar()
+        assert total == 200 + 100 * num_workers
+        assert User.query.get(owner_id).balance in (100 * num_workers, 200 + 100 * num_workers)
+        db.session.remove()
+        db.drop_all()
+
+
+def test_get_history(dataset):
+    """Payment history is paginated by id and filtered by dates"""
+    db = dataset
+    usr = User.get_user_by_username("john")
+    for day in range(1, 8):
+        db.session.add(UsedCard(amount=day, code=str(day), user_id=usr.id, used_at=datetime(2021, 5, day, 12)))
+    db.session.add(UsedCard(amount=100, code="another", user_id=User.get_user_by_username("andre").id))
+    db.session.commit()
+
+    assert [crd.amount for crd in usr.get_history()] == [7, 6, 5, 4, 3, 2, 1]
+    assert [crd.amount for crd in usr.get_history(limit=3)] == [7, 6, 5]
+    assert [crd.amount for crd in usr.get_history(limit=3, before=5)] == [4, 3, 2]
+    assert [crd.amount for crd in usr.get_history(limit=3, after=2)] == [5, 4, 3]
+    assert [crd.amount for crd in usr.get_history(limit=3, after=6)] == [7]
+    assert [crd.amount for crd in usr.get_history(date_from=date(2021, 5, 3), date_to=date(2021, 5, 5))] == [5, 4, 3]
+
+
+def test_role_and_claims(dataset):
+    """Users have role, admin is recognized by the role"""
+    usr = User.get_user_by_username("john")
+    assert usr.role == Role.user_role.value and not usr.is_admin
+    assert usr.get_claims() == dict(role=Role.user_role.value)
+
+    admin = User(username="root", password="test", role=Role.admin_role.value)
+    admin.save_to_db()
+    assert admin.is_admin and admin.get_claims()["role"] == Role.admin_role.value
+    assert User.get_id_by_uuid(admin.uuid) == admin.id
+
+
+def test_rehash_password(dataset, monkeypatch):
+    """Password hashed with outdated cost is rehashed on successful check"""
+    usr = User.get_user_by_username("john")
+    hasher = get_hasher()
+    monkeypatch.setattr(hasher, "method", "pbkdf2:sha256:500")
+    usr.set_password("test")
+    usr.save_to_db()
+    monkeypatch.undo()
+
+    assert hasher.needs_rehash(usr.password_hash)
+    assert not usr.check_password("wrong") and usr.password_hash.startswith("pbkdf2:sha256:500$")
+    assert usr.check_password("test")
+
+    App.db.session.expire_all()
+    usr = User.get_user_by_username("john")
+    assert usr.password_hash.startswith(TestConfig.PASSWORD_HASH_METHOD + "$")
+    assert not hasher.needs_rehash(usr.password_hash) and usr.check_password("test")
+
+
+def test_sweep_debtors(dataset):
+    """Debtors are deactivated, suspended users are reactivated after the debt was paid"""
+    db = dataset
+    Stats.rebuild()
+    john, andre = User.get_user_by_username("john"), User.get_user_by_username("andre")
+    manual = User(username="manual", password="test", state=State.deactivated_state.value)
+    db.session.add(manual)
+    for usr in (john, andre):
+        usr.state = State.activated_state.value
+    john.balance, andre.balance = -100, 50
+    db.session.add(Card(amount=200, code="000001"))
+    db.session.commit()
+    john_uuid = john.uuid
+
+    assert User.sweep_debtors(chunk_size=1) == dict(deactivated=[john_uuid], reactivated=[])
+    db.session.expire_all()
+    assert john.state == State.deactivated_state.value and john.suspended
+    assert andre.state == State.activated_state.value
+    assert Stats.get() == Stats.compute()
+
+    # Nothing to change
+    assert User.sweep_debtors() == dict(deactivated=[], reactivated=[])
+
+    # The debt was paid, but the user deactivated by the admin stays deactivated
+    assert john.use_card("000001")
+    assert User.sweep_debtors(threshold=50) == dict(deactivated=[], reactivated=[john_uuid])
+    assert john.state == State.activated_state.value and not john.suspended
+    assert manual.state == State.deactivated_state.value
+    assert Stats.get() == Stats.compute()
+
+    # The state set by the admin isn't changed by the sweep
+    assert User.sweep_debtors(threshold=200) == dict(deactivated=[john_uuid, andre.uuid], reactivated=[])
+    andre.change_state(deactivate=True)
+    assert not andre.suspended
+    assert User.sweep_debtors() == dict(deactivated=[], reactivated=[john_uuid])
+    assert andre.state == State.deactivated_state.value
+
+
+def test_apply_choices(dataset):
+    """Users are activated, deactivated and deleted with grouped statements"""
+    db = dataset
+    Stats.rebuild()
+    john, andre = User.get_user_by_username("john"), User.get_user_by_username("andre")
+    john.balance = -50
+    db.session.add(Card(amount=200, code="000001"))
+    db.session.commit()
+    john.use_card("000001")
+    john_uuid, john_ip, andre_uuid = john.uuid, john.ip, andre.uuid
+
+    found = User.apply_choices([(andre_uuid, "activate"), (john_uuid, "delete"), ("not-exists", "deactivate")])
+    assert found == {andre_uuid, john_uuid}
+    assert User.get_by_uuid(andre_uuid).state == State.activated_state.value
+    assert not User.get_by_uuid(john_uuid)
+    assert UsedCard.get_card_by_code("000001").user_id is None
+    assert FreeIp.query.filter_by(address=john_ip).count() == 1
+    assert Stats.get() == Stats.compute()
+
+    assert User.apply_choices([(andre_uuid, "deactivate")]) == {andre_uuid}
+    assert User.get_by_uuid(andre_uuid).state == State.deactivated_state.value
+    assert Stats.get() == Stats.compute()
+
+
+def test_apply_choices_concurrent_change(dataset):
+    """The counters are updated by the states the users have when the choices are applied, not when selected"""
+    db = dataset
+    Stats.rebuild()
+    andre = User.get_user_by_username("andre")
+    assert andre.state == State.deactivated_state.value
+    andre_uuid = andre.uuid
+
+    activated = []
+
+    def activate_concurrently(conn, cursor, statement, parameters, context, executemany):
+        """Another request activates the user after the choices have selected it"""
+        if statement.startswith("UPDATE user") and not activated:
+            activated.append(andre_uuid)
+            cursor.execute("UPDATE user SET state = ? WHERE uuid = ?", (State.activated_state.value, andre_uuid))
+            cursor.execute("UPDATE stats SET value = value + 1 WHERE name = 'num_active_users'")
+
+    db.event.listen(db.engine, "before_cursor_execute", activate_concurrently)
+    try:
+        assert User.apply_choices([(andre_uuid, "activate")]) == {andre_uuid}
+    finally:
+        db.event.remove(db.engine, "before_cursor_execute", activate_concurrently)
+    assert activated
+    assert User.get_by_uuid(andre_uuid).state == State.activated_state.value
+    assert Stats.get() == Stats.compute()
+
+
+def test_apply_choices_concurrent_delete(dataset):
+    """The counters are updated by the users as they are when they are deleted, not when they were selected"""
+    db = dataset
+    Stats.rebuild()
+    andre, john = User.get_user_by_username("andre"), User.get_user_by_username("john")
+    andre_uuid, john_uuid, john_id = andre.uuid, john.uuid, john.id
+    changed = []
+
+    def change_concurrently(conn, cursor, statement, parameters, context, executemany):
+        """Another request activates andre and deletes john after the choices have selected them"""
+        if statement.startswith("UPDATE used_card") and not changed:
+            changed.append(statement)
+            cursor.execute("UPDATE user SET state = ?, balance = -50 WHERE uuid = ?", ("activated", andre_uuid))
+            cursor.execute("DELETE FROM user WHERE id = ?", (john_id,))
+            cursor.execute("UPDATE stats SET value = value + 1 WHERE name = 'num_active_users'")
+            cursor.execute("UPDATE stats SET value = value - 50 WHERE name = 'total_debt'")
+            cursor.execute("UPDATE stats SET value = value - 1 WHERE name = 'num_users'")
+
+    db.event.listen(db.engine, "before_cursor_execute", change_concurrently)
+    try:
+        assert User.apply_choices([(andre_uuid, "delete"), (john_uuid, "delete")]) == {andre_uuid, john_uuid}
+    finally:
+        db.event.remove(db.engine, "before_cursor_execute", change_concurrently)
+    assert changed and not User.get_by_uuid(andre_uuid)
+    assert Stats.get() == Stats.compute()
+
+
+def test_versions(dataset):
+    """Version of the user is incremented on every change, version of the history is the id of the last payment"""
+    db = dataset
+    john = User.get_user_by_username("john")
+    db.session.add(Card(amount=200, code="000001"))
+    db.session.commit()
+    assert User.get_version(john.uuid) == 1 and User.get_history_version(john.uuid) == 0
+    assert User.get_version("not-exists") is None and User.get_history_version("not-exists") is None
+
+    db.session.commit()  # nothing was changed
+    assert User.get_version(john.uuid) == 1
+
+    john.name = "John"
+    db.session.commit()
+    assert User.get_version(john.uuid) == 2
+
+    assert john.use_card("000001")
+    assert User.get_version(john.uuid) == 3
+    assert User.get_history_version(john.uuid) == UsedCard.get_card_by_code("000001").id
+
+    User.apply_choices([(john.uuid, "activate")])
+    assert User.get_version(john.uuid) == 4
+    john.change_state(deactivate=True)
+    assert User.get_version(john.uuid) == 5
@@ -1,11 +1,22 @@
 """Tests the creation of a copy of the app"""
 import os
+import csv
+import json
 import logging
 from flask import Flask
 from module import App
-from module.commands.common import populate_cli
-from module.server.models.user import User
-from module.server.models.payment_cards import Card
+from module.server.config import Config
+from module.tests import setup_database
+from module.commands.common import populate_cli, _insert_cards
+from module.commands.tokens import tokens_cli
+from module.commands.stats import stats_cli
+from module.commands.billing import billing_cli
+from module.commands.debtors import debtors_cli
+from module.commands.export import export_cli
+from module.commands.bench import bench_cli
+from module.server.models.user import User, State
+from module.server.models.stats import Stats
+from module.server.models.payment_cards import Card, UsedCard
 from module.server.view.login import bp as login_bp
 from module.server.view.admin import bp as admin_bp
 
@@ -40,7 +51,7 @@ def test_create_testing_app():
     assert populate_cli in app.cli.commands.values()
 
 
-def test_cli_commands():
+def test_cli_commands(tmp_path):
     """Test custom cli commands"""
     app_runner = App(testing=True)
     app = app_runner.get_flask_app()
@@ -59,9 +70,182 @@ def test_cli_commands():
         result = cli_runner.invoke(populate_cli, ["admin"])
         assert "Already exists." in result.output
 
-        result = cli_runner.invoke(populate_cli, ["cards", "-n", "15"])
-        assert "Successfully created. Card codes:" in result.output
+        output = str(tmp_path / "cards.csv")
+        result = cli_runner.invoke(populate_cli, ["cards", "-n", "15", "-o", output, "-c", "4"])
+        assert "Successfully created 15 cards" in result.output
         assert len(db.session.query(Card).all()) == 15
+        with open(output) as output_file:
+            rows = list(csv.DictReader(output_file))
+        assert len(rows) == 15 and len({row["code"] for row in rows}) == 15
+        assert {row["amount"] for row in rows} == {"200", "400"}
+        assert all(Card.get_card_by_code(row["code"]) for row in rows)
 
-        result = cli_runner.invoke(populate_cli, ["cards"])
-        assert "Cards already exists." in result.output
+        result = cli_runner.invoke(populate_cli, ["cards", "-o", output])
+        assert "already exists. Use --resume" in result.output
+        assert len(db.session.query(Card).all()) == 15
+
+        # Interrupted after the codes were saved, but before the commit
+        with open(output, "a", newline="") as output_file:
+            csv.writer(output_file).writerow(("123456789012", "200"))
+        result = cli_runner.invoke(populate_cli, ["cards", "-n", "20", "-o", output, "-c", "4", "--resume"])
+        assert "Successfully created 20 cards" in result.output
+        assert Card.get_card_by_code("123456789012")
+        with open(output) as output_file:
+            assert len(list(csv.DictReader(output_file))) == db.session.query(Card).count() == 20
+
+        # Test 'tokens'
+
+        result = cli_runner.invoke(tokens_cli, ["purge"])
+        assert "Successfully purged. Deleted tokens: 0" in result.output
+
+        # Test 'stats'
+
+        result = cli_runner.invoke(stats_cli, ["check"])
+        assert "num_users: stored None, actual 1" in result.output
+        assert "Counters were rebuilt." in result.output
+
+        result = cli_runner.invoke(stats_cli, ["check"])
+        assert "Counters are consistent." in result.output
+
+        # Test 'billing'
+
+        result = cli_runner.invoke(billing_cli, ["run", "-p", "2026-10"])
+        assert "Period 2026-10: charged 0 users" in result.output
+
+        result = cli_runner.invoke(billing_cli, ["run", "-p", "10.2026"])
+        assert "Unable to charge" in result.output
+
+        # Test 'debtors'
+
+        output = str(tmp_path / "debtors.csv")
+        result = cli_runner.invoke(debtors_cli, ["sweep", "-t", "1", "-o", output])
+        assert "Deactivated: 0, reactivated: 0." in result.output
+        with open(output) as output_file:
+            assert output_file.read().strip() == "uuid,action"
+
+        # Test 'export'
+
+        output = str(tmp_path / "users.ndjson")
+        result = cli_runner.invoke(export_cli, ["users", "-o", output, "-f", "ndjson", "--from", "2000-01-01"])
+        assert result.exit_code == 0
+        with open(output) as output_file:
+            assert [json.loads(line)["username"] for line in output_file] == ["admin"]
+
+        result = cli_runner.invoke(export_cli, ["history", "-s", "activated"])
+        assert result.output == "uuid,user_uuid,code,amount,balance_after_use,used_at\n"
+
+
+def test_insert_cards_collisions(setup_database):
+    """Codes used by the other cards and duplicates are replaced while inserting cards"""
+    db = setup_database
+    db.session.add(Card(amount=200, code="000001"))
+    db.session.add(UsedCard(amount=200, code="000002"))
+    db.session.commit()
+
+    rows = [dict(code=code, amount=100) for code in ("000001", "000002", "000003", "000003")]
+    _insert_cards(rows, 6)
+
+    codes = [row["code"] for row in rows]
+    assert len(set(codes)) == 4 and "000001" not in codes and "000002" not in codes
+    assert db.session.query(Card).count() == 5
+
+
+def test_populate_users(tmp_path):
+    """Users are imported from CSV and NDJSON files, invalid and repeated rows are rejected"""
+    app_runner = App(testing=True)
+    app = app_runner.get_flask_app()
+    db = app_runner.db
+    with app.app_context():
+        db.create_all()
+        cli_runner = app.test_cli_runner()
+        db.session.add(User(username="taken", password="test"))
+        db.session.commit()
+
+        fields = ("username", "password", "name", "email", "phone", "address", "tariff")
+        source = tmp_path / "users.csv"
+        with open(source, "w", newline="") as source_file:
+            writer = csv.writer(source_file)
+            writer.writerow(fields)
+            for i in range(6):
+                writer.writerow(("user{0}".format(i), "pass", "Name", "", "+38000{0}".format(i), "Street", "50m"))
+            writer.writerow(("taken", "pass", "Name", "", "+38010", "Street", "50m"))  # existing username
+            writer.writerow(("user_phone", "pass", "Name", "", "+380003", "Street", "50m"))  # repeated phone
+            writer.writerow(
+                ("user_tariff", "pass", "Name", "user@example.com", "+38011", "Street", "1g")
+            )  # wrong tariff
+
+        # Interrupted after the first chunk
+        with open(str(source) + ".checkpoint", "w") as checkpoint_file:
+            checkpoint_file.write("2")
+        result = cli_runner.invoke(populate_cli, ["users", "--from", str(source), "-c", "4", "-w", "0"])
+        assert "Use --resume to continue it." in result.output
+
+        result = cli_runner.invoke(populate_cli, ["users", "--from", str(source), "-c", "4", "-w", "2", "--resume"])
+        assert "Successfully imported 4 users" in result.output and "rejected 3" in result.output
+        assert not User.get_user_by_username("user0") and User.get_user_by_username("user5").check_password("pass")
+        assert not os.path.exists(str(source) + ".checkpoint")
+        with open(str(source) + ".rejects.csv") as rejects_file:
+            rejects = list(csv.DictReader(rejects_file))
+        assert [(reject["line"], reject["username"]) for reject in rejects] == [
+            ("8", "taken"),
+            ("9", "user_phone"),
+            ("10", "user_tariff"),
+        ]
+        assert "Already exists." in rejects[0]["errors"] and "tariff" in rejects[2]["errors"]
+
+        source = tmp_path / "users.ndjson"
+        with open(source, "w") as source_file:
+            source_file.write(
+                json.dumps(dict(zip(fields, ("user0", "pass", "Name", "user@example.com", "+1", "Street", "50m"))))
+            )
+            source_file.write("\n\n[1, 2]\n{broken\n")
+        result = cli_runner.invoke(populate_cli, ["users", "--from", str(source), "-w", "0"])
+        assert "Successfully imported 1 users" in result.output and "rejected 2" in result.output
+        usr = User.get_user_by_username("user0")
+        assert usr.ip and usr.email == "user@example.com" and usr.state == State.deactivated_state.value
+        assert Stats.get() == Stats.compute()
+
+
+def test_bench_command(tmp_path):
+    """Benchmarks run on their own dataset, results are saved and compared with the baseline"""
+    app = App(testing=True).get_flask_app()
+    cli_runner = app.test_cli_runner()
+    output, baseline = str(tmp_path / "bench.json"), str(tmp_path / "baseline.json")
+    options = ["run", "-d", str(tmp_path / "bench.db"), "-n", "20", "--cards", "200", "--tokens", "10", "-r", "2"]
+    options += ["-t", "0.001", "-k", "get_by_uuid", "-k", "token_blocklist", "-k", "admin_schema_dump"]
+
+    result = cli_runner.invoke(bench_cli, options + ["-o", output])
+    assert result.exit_code == 0, result.output
+    with open(output) as output_file:
+        results = json.load(output_file)
+    assert set(results["benchmarks"]) == {"get_by_uuid", "token_blocklist", "admin_schema_dump"}
+    assert results["dataset"]["users"] == 20 and results["machine"]["cpu_count"]
+    assert all(result["best_us"] <= result["median_us"] for result in results["benchmarks"].values())
+
+    for result in results["benchmarks"].values():
+        result["best_us"] /= 100  # much faster baseline
+    results["benchmarks"].pop("token_blocklist")
+    with open(baseline, "w") as baseline_file:
+        json.dump(results, baseline_file)
+    result = cli_runner.invoke(bench_cli, options + ["-b", baseline])
+    assert result.exit_code == 1
+    assert "token_blocklist: no baseline" in result.output
+    assert "Regressed by more than 25%: get_by_uuid, admin_schema_dump" in result.output
+
+    result = cli_runner.invoke(bench_cli, options + ["-b", baseline, "--tolerance", "1000"])
+    assert result.exit_code == 0, result.output
+
+    options = ["run", "-n", "5", "--cards", "3", "--tokens", "1", "-r", "3", "-t", "0.05", "-k", "use_card"]
+    result = cli_runner.invoke(bench_cli, options)
+    assert result.exit_code == 1 and "All 3 cards are used by the use_card benchmark, raise --cards." in result.output
+
+
+def test_bench_command_ignores_services(tmp_path, monkeypatch):
+    """Benchmarks don't send writes to the write queue and reads to the replica of the application"""
+    monkeypatch.setattr(Config, "WRITE_QUEUE_ADDRESS", str(tmp_path / "writer.sock"))
+    monkeypatch.setattr(Config, "REPLICA_DATABASE_URL", "sqlite:///" + str(tmp_path / "replica.db"))
+    app = App(testing=True).get_flask_app()
+    options = ["run", "-n", "5", "--cards", "50", "--tokens", "5", "-r", "1", "-t", "0.001", "-k", "use_card"]
+    result = app.test_cli_runner().invoke(bench_cli, options)
+    assert result.exit_code == 0, result.output
+    assert not os.path.exists(tmp_path / "replica.db")
@@ -0,0 +1,47 @@
+"""Test the password hashing service"""
+import multiprocessing
+from timeit import default_timer
+import pytest
+from module.server.hashing import HashSlots, PasswordHasher
+
+
+def test_hash_and_verify(tmp_path):
+    """Passwords are hashed and checked within the slots, lists are hashed in worker processes"""
+    hasher = PasswordHasher("pbkdf2:sha256:1000", slots=2, slots_dir=str(tmp_path), workers=1)
+    try:
+        pwhash = hasher.hash("test")
+        assert pwhash.startswith("pbkdf2:sha256:1000$")
+        assert hasher.verify(pwhash, "test") and not hasher.verify(pwhash, "cat")
+        assert not hasher.needs_rehash(pwhash)
+        assert PasswordHasher("pbkdf2:sha256:2000").needs_rehash(pwhash)
+        assert hasher.queue_depth == 0
+        assert all(hasher.verify(pwhash, "test") for pwhash in hasher.hash_many(["test"] * 3))
+    finally:
+        hasher.shutdown()
+
+
+def hold_slot(folder, taken, done) -> None:
+    """Takes the only slot in another process and holds it until done"""
+    slots = HashSlots(folder, 1)
+    handle = slots.acquire(timeout=1)
+    taken.set()
+    done.wait(10)
+    slots.release(handle)
+
+
+def test_slots_are_shared_by_processes(tmp_path):
+    """Hashes over the slots of all processes fail fast, a freed slot is taken again"""
+    taken, done = multiprocessing.Event(), multiprocessing.Event()
+    holder = multiprocessing.Process(target=hold_slot, args=(str(tmp_path), taken, done))
+    holder.start()
+    try:
+        assert taken.wait(10)
+        hasher = PasswordHasher("pbkdf2:sha256:1000", slots=1, slots_dir=str(tmp_path), timeout=0.1)
+        start = default_timer()
+        with pytest.raises(RuntimeError, match="slots are busy"):
+            hasher.hash("test")
+        assert default_timer() - start < 1 and hasher.queue_depth == 0
+    finally:
+        done.set()
+        holder.join()
+    assert hasher.hash("test")
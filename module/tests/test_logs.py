@@ -0,0 +1,101 @@
+"""Tests for the non-blocking logging"""
+import json
+import time
+import logging
+import threading
+from module.server.logs import BackgroundHandler, DigestSMTPHandler, JsonFormatter
+from module.tests import init_app
+
+
+class SlowHandler(logging.Handler):
+    """Collects records, every record is handled only after the event is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.event = threading.Event()
+
+    def emit(self, record):
+        self.event.wait(5)
+        self.records.append(record)
+
+
+def make_logger(name, handler) -> "logging.Logger":
+    """Returns logger which passes records only to the handler"""
+    logger = logging.getLogger(name)
+    logger.handlers, logger.propagate = [handler], False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_background_handler():
+    """Logging doesn't wait for the handlers, records which don't fit into the queue are dropped"""
+    slow = SlowHandler()
+    handler = BackgroundHandler([slow], queue_size=2)
+    logger = make_logger("test_background_handler", handler)
+
+    start = time.perf_counter()
+    logger.info("record 0")
+    while handler.queue_depth:  # the first record is taken by the thread, which is blocked by the handler
+        time.sleep(0.001)
+    for i in range(1, 5):
+        logger.info("record %s", i)
+    assert time.perf_counter() - start < 1
+    assert handler.dropped == 2 and handler.queue_depth == 2
+
+    try:
+        raise ValueError("failure")
+    except ValueError:
+        logger.exception("error")  # dropped too, but the traceback is rendered in the calling thread
+
+    slow.event.set()
+    handler.close()  # waits for the queued records
+    assert [record.getMessage() for record in slow.records] == ["record 0", "record 1", "record 2"]
+
+
+def test_json_formatter(init_app):
+    """Records are formatted as JSON with the request and the traceback"""
+    slow = SlowHandler()
+    slow.event.set()
+    slow.setFormatter(JsonFormatter())
+    handler = BackgroundHandler([slow])
+    logger = make_logger("test_json_formatter", handler)
+
+    with init_app.test_request_context("/admin", method="POST"):
+        try:
+            raise ValueError("failure")
+        except ValueError:
+            logger.exception("Unable to %s", "save")
+    handler.close()
+
+    data = json.loads(slow.format(slow.records[0]))
+    assert data["message"] == "Unable to save" and data["level"] == "ERROR"
+    assert data["method"] == "POST" and data["path"] == "/admin"
+    assert "ValueError: failure" in data["exception"]
+
+
+def test_digest_smtp_handler(monkeypatch):
+    """Errors are sent in one email, records from the same place are counted"""
+    sent = []
+    handler = DigestSMTPHandler(
+        interval=0.05, mailhost="localhost", fromaddr="no-reply@test", toaddrs=["admin@test"], subject="Error"
+    )
+    monkeypatch.setattr(handler, "send", lambda subject, body: sent.append((subject, body)))
+    logger = make_logger("test_digest_smtp_handler", handler)
+
+    for i in range(3):
+        logger.error("failure %s", i)
+    logger.error("another failure")
+
+    for _ in range(100):  # the digest is sent by the timer
+        if sent:
+            break
+        time.sleep(0.01)
+    assert len(sent) == 1
+    subject, body = sent[0]
+    assert subject == "Error: 4 records"
+    assert body.startswith("3 x failure 2") and "1 x another failure" in body
+
+    logger.error("failure after the digest")
+    handler.close()  # the rest is sent on close
+    assert len(sent) == 2 and sent[1][0] == "Error: 1 records"
@@ -0,0 +1,115 @@
+"""Tests for the metrics of the requests"""
+import os
+import json
+import multiprocessing
+from flask import url_for
+from module.server.metrics import Counter, Gauge, Histogram, MetricsStore, ProcessFile
+from module.tests import init_app, get_access_token
+
+
+def parse(text) -> dict:
+    """Returns samples of the text format as {'name{labels}': value}"""
+    return {
+        line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+        for line in text.splitlines()
+        if line and not line.startswith("#")
+    }
+
+
+def record_in_worker(path):
+    """Records metrics in a separate process which exits"""
+    store = MetricsStore(path)
+    Counter(store, "requests_total", "", ("endpoint",)).inc(2, ("users",))
+    Gauge(store, "queue_depth", "").set(5)
+
+
+def test_store_sums_processes(tmp_path):
+    """Counters of all processes are summed, gauges only of the running ones"""
+    store = MetricsStore(str(tmp_path))
+    requests = Counter(store, "requests_total", "", ("endpoint",))
+    depth = Gauge(store, "queue_depth", "")
+    requests.inc(1, ("users",))
+    requests.inc(1, ("history",))
+    depth.set(3)
+
+    worker = multiprocessing.get_context("fork").Process(target=record_in_worker, args=(str(tmp_path),))
+    worker.start()
+    worker.join()
+    assert len(os.listdir(str(tmp_path))) == 2
+
+    totals = store.collect(live={"queue_depth"})
+    assert totals[("requests_total", (("endpoint", "users"),))] == 3
+    assert totals[("requests_total", (("endpoint", "history"),))] == 1
+    assert totals[("queue_depth", ())] == 3  # the worker has stopped
+
+    store.clear()
+    assert not os.listdir(str(tmp_path))
+
+
+def test_process_file(tmp_path):
+    """The file grows with new samples and is continued by the process with the same pid"""
+    path = str(tmp_path / "1.db")
+    process_file = ProcessFile(path)
+    for i in range(5000):  # more than the initial size
+        process_file.add(("sample", (("id", str(i)),)), i)
+    process_file.add(("sample", (("id", "7"),)), 0.5)
+    process_file.close()
+
+    process_file = ProcessFile(path)
+    process_file.add(("sample", (("id", "7"),)), 1)
+    with open(path, "rb") as file:
+        assert len(file.read()) > ProcessFile.INITIAL_SIZE
+    store = MetricsStore()
+    store._file, store._pid = process_file, os.getpid()
+    totals = store.collect()
+    assert len(totals) == 5000 and totals[("sample", (("id", "7"),))] == 8.5
+
+
+def test_histogram():
+    """Buckets are rendered cumulative with the sum and the count"""
+    store = MetricsStore()
+    latency = Histogram(store, "latency_seconds", "Latency.", ("endpoint",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, ('say "hi"',))
+
+    totals = dict()
+    for (name, labels), value in store.collect().items():
+        totals.setdefault(name, dict())[labels] = value
+    samples = parse("\n".join(latency.render(totals)))
+    assert samples == {
+        'latency_seconds_bucket{endpoint="say \\"hi\\"",le="0.1"}': 2,
+        'latency_seconds_bucket{endpoint="say \\"hi\\"",le="1.0"}': 3,
+        'latency_seconds_bucket{endpoint="say \\"hi\\"",le="+Inf"}': 4,
+        'latency_seconds_sum{endpoint="say \\"hi\\""}': 3.65,
+        'latency_seconds_count{endpoint="say \\"hi\\""}': 4,
+    }
+
+
+def test_metrics_endpoint(init_app):
+    """Requests are counted per endpoint with their SQL queries"""
+    app = init_app
+
+    with app.test_client() as client:
+        access_token = get_access_token(client, json.dumps({"login": "admin", "password": "test"}))
+        headers = {"Authorization": "Bearer {0}".format(access_token)}
+        for _ in range(3):
+            assert client.get(url_for("api_users"), headers=headers).status_code == 200
+        client.get("/not-found")
+
+        response = client.get("/metrics")
+        assert response.status_code == 200 and response.content_type.startswith("text/plain; version=0.0.4")
+        samples = parse(response.get_data(as_text=True))
+        assert samples['http_requests_total{endpoint="api_users",method="GET",status="200"}'] == 3
+        assert samples['http_requests_total{endpoint="unmatched",method="GET",status="404"}'] == 1
+        assert samples['http_request_duration_seconds_count{endpoint="api_users"}'] == 3
+        assert samples['http_request_duration_seconds_bucket{endpoint="api_users",le="+Inf"}'] == 3
+        assert samples['http_request_db_queries_sum{endpoint="api_users"}'] >= 3
+        assert samples['http_request_db_seconds_total{endpoint="api_users"}'] > 0
+        assert samples["db_pool_checkout_seconds_count"] >= 1  # the session of the test keeps the connection
+        assert samples['cache_requests_total{cache="jwt_blocklist",result="hit"}'] >= 2
+        assert samples['cache_requests_total{cache="url_templates",result="hit"}'] >= 1
+        assert samples["password_hash_queue_depth"] == 0 and samples["log_records_dropped_total"] == 0
+
+        app.config["METRICS_TOKEN"] = "secret"
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
@@ -0,0 +1,71 @@
+"""Tests for the SQL instrumentation"""
+import json
+import logging
+from flask import url_for
+from module import App
+from module.server.queries import SqlMonitor
+from module.server.models.user import User
+from module.tests import init_app, login_user, logout_user, get_access_token, assert_max_queries
+
+
+def test_slow_query_log(init_app, caplog):
+    """Slow statements are logged with their parameters and call site"""
+    SqlMonitor(slow_threshold=0).init_app(init_app, App.db)
+
+    with caplog.at_level(logging.WARNING):
+        User.query.filter_by(username="john").first()
+    message = caplog.records[-1].getMessage()
+    assert message.startswith("Slow query (")
+    assert "tests/test_queries.py:" in message and "in test_slow_query_log" in message
+    assert "WHERE user.username = ?" in message and "'john'" in message
+
+
+def test_repeated_queries(init_app, caplog):
+    """Statement repeated within one request is logged once"""
+    app = init_app
+    SqlMonitor(repeat_threshold=3).init_app(app, App.db)
+
+    @app.route("/usernames/<int:num>")
+    def usernames(num):
+        return ",".join(User.query.filter_by(id=i).first().username for i in range(1, num + 1))
+
+    with app.test_client() as client, caplog.at_level(logging.WARNING):
+        assert client.get("/usernames/2").status_code == 200  # the counts are reset by every request
+        assert client.get("/usernames/2").status_code == 200
+        assert not caplog.records
+
+        assert client.get("/usernames/4").status_code == 200
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert message.startswith("Possible N+1 query: repeated 3 times by usernames at tests/test_queries.py:")
+    assert "WHERE user.id = ?" in message
+
+
+def test_query_budgets(init_app):
+    """Pages and resources don't make more queries than expected"""
+    app = init_app
+
+    with app.test_client() as client:
+        with assert_max_queries(2):  # login and the cabinet page
+            login_user(client, "john", "test")
+        with assert_max_queries(1):
+            assert client.get("/cabinet").status_code == 200
+        logout_user(client)
+
+        login_user(client, "admin", "test")
+        with assert_max_queries(3):
+            assert client.get("/admin/").status_code == 200
+        with assert_max_queries(2):
+            assert client.get("/admin/search", query_string={"q": "joh"}).status_code == 200
+
+        access_token = get_access_token(client, json.dumps({"login": "admin", "password": "test"}))
+        headers = {"Authorization": "Bearer {0}".format(access_token)}
+        uuid = User.query.filter_by(username="john").first().uuid
+        with assert_max_queries(2):
+            assert client.get(url_for("api_users"), headers=headers).status_code == 200
+        with assert_max_queries(2):
+            assert client.get(url_for("api_user_details", uuid=uuid), headers=headers).status_code == 200
+        with assert_max_queries(3):
+            assert client.get(url_for("api_user_history", uuid=uuid), headers=headers).status_code == 200
+        with assert_max_queries(2):
+            assert client.get(url_for("api_search", q="john"), headers=headers).status_code == 200
@@ -0,0 +1,110 @@
+"""Tests for the routing of the reads to the replica"""
+import pytest
+from flask import url_for
+from sqlalchemy.exc import OperationalError
+from module import App
+from module.server.config import TestConfig
+from module.server.replica import REPLICA_BIND, copy_database, use_replica
+from module.server.models.user import User
+from module.server.models.payment_cards import Card
+from module.server.models.replica import LastWrite
+from module.server.models.stats import Stats
+from module.commands.replica import replica_cli
+
+
+@pytest.fixture()
+def replica_app(tmp_path):
+    """App with the primary and the replica file databases, the replica is synced after the users are created"""
+    primary, replica = str(tmp_path / "primary.db"), str(tmp_path / "replica.db")
+
+    class ReplicaConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + primary
+        REPLICA_DATABASE_URL = "sqlite:///" + replica
+
+    runner = App(config_obj=ReplicaConfig)
+    app, db = runner.get_flask_app(), runner.db
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(username="john", password="test"), User(username="andre", password="test")])
+        db.session.commit()
+        uuid = User.get_user_by_username("john").uuid
+        db.session.remove()
+    copy_database(primary, replica)
+    yield app, db, uuid
+    with app.app_context():
+        db.drop_all()
+
+
+def set_balance(db, balance) -> None:
+    """Changes the balance on the primary only, like a write which isn't replicated yet"""
+    with db.engine.connect() as connection:
+        connection.execute(User.__table__.update().values(balance=balance))
+
+
+def get_headers(client, username):
+    """Returns headers with the access token of the user"""
+    response = client.get(url_for("api_auth"), json=dict(login=username, password="test"))
+    return dict(Authorization="Bearer {0}".format(response.json["access_token"]))
+
+
+def get_balance(client, uuid, headers):
+    """Returns the balance of the user returned by the API"""
+    response = client.get(url_for("api_user_details", uuid=uuid), headers=headers)
+    assert response.status_code == 200
+    return response.json["balance"]
+
+
+def test_read_your_writes(replica_app):
+    """Read-only resources read from the replica unless the user has written within the sticky period"""
+    app, db, uuid = replica_app
+    with app.test_request_context(), app.test_client(use_cookies=False) as client:  # like the API clients
+        with app.app_context():
+            set_balance(db, 100)
+            db.session.add(Card(code="card", amount=200))
+            db.session.commit()
+            andre_uuid = User.get_user_by_username("andre").uuid
+        headers = get_headers(client, "john")
+        andre_headers = get_headers(client, "andre")
+        assert get_balance(client, uuid, headers) == 0  # the replica is behind
+
+        response = client.post(url_for("api_user_details", uuid=uuid), json=dict(code="card"), headers=headers)
+        assert response.status_code == 200  # reads and writes of the unsafe requests use the primary
+        assert get_balance(client, uuid, headers) == 300  # the user sees their own write
+        assert get_balance(client, andre_uuid, andre_headers) == 0  # other users still read from the replica
+        with app.app_context():
+            assert LastWrite.query.get(uuid) and not LastWrite.query.get(andre_uuid)
+
+        app.extensions["replica"].sticky_seconds = 0  # the sticky period is over
+        assert get_balance(client, uuid, headers) == 0
+        result = app.test_cli_runner().invoke(replica_cli, ["sync", "--once"])
+        assert result.exit_code == 0, result.output
+        assert get_balance(client, uuid, headers) == 300
+
+
+def test_replica_is_read_only(replica_app):
+    """Writes to the replica are refused, even if they are routed to it by mistake"""
+    app, db, uuid = replica_app
+    with app.app_context(), db.get_engine(app, bind=REPLICA_BIND).connect() as connection:
+        assert connection.execute("SELECT count(*) FROM user").scalar() == 2
+        with pytest.raises(OperationalError, match="readonly"):
+            connection.execute(Card.__table__.insert(), dict(code="card", amount=200))
+
+
+def test_writes_of_routed_request(replica_app):
+    """Bulk writes and rebuilt counters of a request routed to the replica use the primary"""
+    app, db, uuid = replica_app
+    with app.test_request_context():
+        set_balance(db, -100)
+        assert use_replica()
+        assert User.query.filter_by(uuid=uuid).one().balance == 0  # the replica is behind
+
+        # the counters are computed and saved on the primary
+        assert Stats.get()["total_debt"] == -200
+        assert User.query.filter_by(uuid=uuid).one().balance == 0  # other reads still use the replica
+
+        User.query.filter_by(uuid=uuid).update({User.balance: 50}, synchronize_session=False)
+        db.session.commit()
+        assert User.query.filter_by(uuid=uuid).one().balance == 50  # the request reads its own write
+    with app.app_context():
+        assert User.query.filter_by(uuid=uuid).one().balance == 50
+        assert Stats.query.get("total_debt").value == -200
@@ -0,0 +1,66 @@
+"""Tests for the SQLite profile"""
+import pytest
+from sqlalchemy.exc import OperationalError
+from module import App
+from module.server.config import TestConfig
+from module.server.sqlite import is_write
+from module.server.models.user import User
+from module.server.models.payment_cards import Card
+
+
+@pytest.fixture()
+def file_app(tmp_path):
+    """App with a file database, other connections wait for the write lock for 50 ms"""
+
+    class FileConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + str(tmp_path / "profile.db")
+        SQLITE_PRAGMAS = dict(TestConfig.SQLITE_PRAGMAS, busy_timeout=50)
+
+    runner = App(config_obj=FileConfig)
+    app, db = runner.get_flask_app(), runner.db
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username="john", password="test"))
+        db.session.commit()
+        yield app, db
+        db.session.remove()
+        db.drop_all()
+
+
+def test_is_write():
+    """Statements are told apart by their first keyword"""
+    assert is_write("INSERT INTO card (code) VALUES (?)") and is_write("\n  update user SET balance=?")
+    assert is_write("SAVEPOINT sa_savepoint_1")
+    assert not is_write("SELECT * FROM user") and not is_write("PRAGMA journal_mode")
+
+
+def test_pragmas(file_app):
+    """Pragmas are applied to every new connection"""
+    app, db = file_app
+    with db.engine.connect() as connection:
+        assert connection.execute("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.execute("PRAGMA synchronous").scalar() == 1  # normal
+        assert connection.execute("PRAGMA busy_timeout").scalar() == 50
+        assert connection.execute("PRAGMA temp_store").scalar() == 2  # memory
+
+
+def test_immediate_writes(file_app):
+    """The write lock is taken by the first write of the transaction, reads before it see the latest commits"""
+    app, db = file_app
+    assert not Card.query.count()  # the session is in a transaction now, but it hasn't begun in SQLite yet
+
+    with db.engine.connect() as connection:
+        connection.execute(Card.__table__.insert(), dict(code="other", amount=100))  # isn't blocked by the reader
+    assert Card.query.count() == 1
+
+    db.session.add(Card(code="own", amount=200))
+    db.session.flush()  # BEGIN IMMEDIATE
+    with db.engine.connect() as connection:
+        assert connection.execute("SELECT count(*) FROM card").scalar() == 1  # readers aren't blocked
+        with pytest.raises(OperationalError, match="database is locked"):
+            connection.execute(Card.__table__.insert(), dict(code="waiting", amount=100))
+
+    db.session.commit()
+    with db.engine.connect() as connection:
+        connection.execute(Card.__table__.insert(), dict(code="waiting", amount=100))
+    assert Card.query.count() == 3
@@ -0,0 +1,104 @@
+"""Tests for the write queue"""
+import os
+from time import sleep
+from threading import Thread
+import pytest
+from flask import current_app
+from module import App
+from module.server.config import TestConfig
+from module.server.writer import Writer, WriteQueue
+from module.server.models.user import User, State
+from module.server.models.payment_cards import Card, UsedCard
+from module.server.models.jwt_tokens import TokenBlocklist, revoke_token
+from module.server.models.replica import LastWrite
+from module.tests import setup_database
+
+
+def test_apply_batch(setup_database):
+    """Operations of the batch are applied with one commit, a failed operation doesn't affect the others"""
+    db = setup_database
+    users = [User(username="user{0}".format(i), password="test") for i in range(2)]
+    db.session.add_all(users)
+    db.session.add(Card(amount=200, code="shared"))
+    db.session.commit()
+    ids = [usr.id for usr in users]
+
+    writer = Writer(current_app, db)
+    results = writer.apply(
+        [
+            (None, "use_card", (ids[0], "shared")),
+            (None, "use_card", (ids[1], "shared")),  # already used by the first operation
+            (None, "delete_user", (ids[1] + 1,)),
+            (None, "unknown", ()),
+            (None, "revoke_token", (ids[0], "jti", "Logout", None)),
+            (None, "change_state", (ids[1], False)),
+            (None, "mark_write", ("uuid",)),
+            (None, "mark_write", ("uuid",)),  # the time of the last write is updated
+        ]
+    )
+    assert results[:3] == [(True, True), (True, False), (False, "Unable to delete user: the user doesn't exist")]
+    assert not results[3][0] and "KeyError" in results[3][1]
+    assert results[4:] == [(True, None)] * 4
+
+    assert UsedCard.query.one().user_id == ids[0] and not Card.query.count()
+    assert User.query.get(ids[0]).balance == 200 and User.query.get(ids[1]).state == State.activated_state.value
+    assert TokenBlocklist.query.filter_by(jti="jti").count() == 1 and LastWrite.query.count() == 1
+    assert current_app.extensions["write_queue"] is None  # writes of the writer aren't sent to the queue
+
+
+def test_write_queue(tmp_path):
+    """Writes of the worker are applied by the writer and the objects of the worker are updated"""
+    address = str(tmp_path / "writer.sock")
+
+    class FileConfig(TestConfig):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + str(tmp_path / "writer.db")
+
+    class QueueConfig(FileConfig):
+        WRITE_QUEUE_ADDRESS = address
+        WRITE_QUEUE_TIMEOUT = 5
+
+    writer_app = App(config_obj=FileConfig).get_flask_app()
+    worker_app = App(config_obj=QueueConfig).get_flask_app()
+    db = App.db
+    with writer_app.app_context():
+        db.create_all()
+        db.session.add(Card(amount=200, code="card"))
+        db.session.commit()
+        db.session.remove()
+
+    writer = Writer(writer_app, db)
+    thread = Thread(target=writer.serve_forever, args=(address, writer_app.config["SECRET_KEY"].encode()))
+    thread.start()
+    while not os.path.exists(address):  # the writer is listening
+        sleep(0.01)
+    try:
+        with worker_app.app_context():
+            usr = User(username="john", password="test", state=State.deactivated_state.value)
+            assert usr.ip is None  # reserved by the writer
+            usr.save_to_db()
+            assert usr.id and usr.ip and usr.check_password("test")
+
+            assert usr.use_card("card") and usr.balance == 200
+            assert not usr.use_card("card")
+
+            usr.change_state()
+            assert usr.state == State.activated_state.value
+
+            revoke_token(usr.id, dict(jti="jti", exp=None))
+            assert TokenBlocklist.query.filter_by(jti="jti").count() == 1
+
+            user_id = usr.id
+            usr.delete_from_db()
+            assert User.query.get(user_id) is None
+            with pytest.raises(ValueError, match="the user doesn't exist"):
+                usr.delete_from_db()
+
+            with pytest.raises(ValueError, match="Write queue is unavailable"):
+                WriteQueue(address, b"wrong").submit("change_state", user_id, False)
+            db.session.remove()
+    finally:
+        writer.stop()
+        thread.join()
+
+    with writer_app.app_context():
+        db.drop_all()
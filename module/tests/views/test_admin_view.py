@@ -25,6 +25,9 @@ def test_admin_view_access_and_render(init_app):
             template, context = templates[-1]
             assert len(templates) == 1
             assert template.name == "admin/admin.html"
+            assert context["data_general_table"] == dict(
+                num_users=4, num_active_users=0, num_non_used_cards=4, total_debt=0
+            )
 
             # Logout user
             response_logout_user = logout_user(client)
@@ -188,3 +191,20 @@ def test_register_new_user(init_app):
             assert response_register_view.status_code == 200
             assert len(User.query.filter_by(username="test").all()) == 1
             assert template.name == "auth/register.html"
+
+
+def test_search_view(init_app):
+    """Typeahead returns usernames for the admin only"""
+    app = init_app
+
+    with app.test_client() as client:
+        assert client.get("/admin/search?q=joh").status_code == 302
+
+        login_user(client, "john", "test")
+        assert client.get("/admin/search?q=joh").status_code == 403
+        logout_user(client)
+
+        login_user(client, "admin", "test")
+        assert client.get("/admin/search?q=joh").json == ["john"]
+        assert client.get("/admin/search?q=jo").json == []
+        assert b'list="admin__typeahead"' in client.get("/admin/").data